@@ -3,30 +3,13 @@ import pandas as pd
 import numpy as np
 from nilearn.connectome import ConnectivityMeasure
 from sklearn.preprocessing import StandardScaler
+from PUMI.utils import censor_frames
 
 
 def scrub(ts, fd, scrub_threshold, frames_before=0, frames_after=0):
-    frames_out = np.argwhere(fd > scrub_threshold).flatten().tolist()
-    extra_indices = []
-    for i in frames_out:
-        # remove preceding frames
-        if i > 0:
-            count = 1
-            while count <= frames_before:
-                extra_indices.append(i - count)
-                count += 1
-
-        # remove following frames
-        count = 1
-        while count <= frames_after:
-            if i+count < len(fd):  # do not censor unexistent data
-                extra_indices.append(i + count)
-            count += 1
-
-    indices_out = list(set(frames_out) | set(extra_indices))
-    indices_out.sort()
-
-    return np.delete(ts, indices_out, axis=0)
+    censored = censor_frames(fd, threshold=scrub_threshold, frames_before=frames_before, frames_after=frames_after,
+                             inclusive=False)
+    return ts[~censored]
 
 
 def load_timeseries(ts_files, data_frame, scrubbing=True, scrub_threshold=0.15):
@@ -1,4 +1,26 @@
+# Stamped with the package version at build time by poetry-dynamic-versioning (see pyproject.toml).
+# In a source checkout it stays empty and the version is computed from git by versioneer, when first needed.
+STATIC_VERSION = ''
 
-from ._version import get_versions
-__version__ = get_versions()['version']
-del get_versions
+_cached_version = None
+
+
+def get_version():
+    """
+    Return the version of PUMI, without calling git if the version was stamped at build time.
+    """
+    global _cached_version
+    if _cached_version is None:
+        if STATIC_VERSION:
+            _cached_version = STATIC_VERSION
+        else:
+            from ._version import get_versions
+            _cached_version = get_versions()['version']
+    return _cached_version
+
+
+def __getattr__(name):
+    # __version__ is computed lazily (PEP 562)
+    if name == '__version__':
+        return get_version()
+    raise AttributeError("module 'PUMI' has no attribute '%s'" % name)
@@ -0,0 +1,112 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from glob import escape, glob
+
+from PUMI import globals
+
+# Directories that pybids does not index, changes in them do not invalidate the layout index
+IGNORED_DIRS = ['code', 'derivatives', 'sourcedata', 'stimuli', 'models']
+
+FINGERPRINT_FILE = 'pumi_fingerprint.json'
+
+
+def dataset_fingerprint(bids_dir):
+    """
+    Summarize the state of a BIDS dataset by its file and directory names and their latest modification time.
+    Adding, removing, renaming or modifying files changes the fingerprint.
+
+    Parameters:
+        bids_dir (str): Path to the BIDS dataset.
+
+    Returns:
+        fingerprint (dict): Number of entries, digest of their paths and maximal mtime (in ns).
+    """
+    paths, max_mtime = [], 0
+    stack = [(bids_dir, True)]
+    while stack:
+        path, top_level = stack.pop()
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.startswith('.') or (top_level and entry.name in IGNORED_DIRS):
+                    continue
+                paths.append(os.path.relpath(entry.path, bids_dir))
+                max_mtime = max(max_mtime, entry.stat().st_mtime_ns)
+                if entry.is_dir():
+                    stack.append((entry.path, False))
+    return {'n_entries': len(paths),
+            'paths_digest': hashlib.sha1('\n'.join(sorted(paths)).encode()).hexdigest(),
+            'max_mtime_ns': max_mtime}
+
+
+def get_layout_index(bids_dir, base_dir='.'):
+    """
+    Return a persistent pybids layout index of the dataset as configured in the [BIDS] section of settings.ini.
+    The dataset is indexed once, the BIDSDataGrabber of every subject then loads the saved database instead of
+    re-indexing the whole dataset. The index is rebuilt when the dataset changes (see dataset_fingerprint), by one
+    process at a time, and replaced atomically.
+
+    Parameters:
+        bids_dir (str): Path to the BIDS dataset.
+        base_dir (str): Working directory of the workflow. The index is saved here, if no layout_index_dir is set.
+
+    Returns:
+        database_path (str): Path to the saved layout (to be passed to BIDSLayout.load), or None if disabled.
+    """
+    if not globals.cfg_parser.getboolean('BIDS', 'layout_index', fallback=False):
+        return None
+
+    bids_dir = os.path.abspath(bids_dir)
+    index_dir = globals.cfg_parser.get('BIDS', 'layout_index_dir', fallback='')
+    if not index_dir:
+        index_dir = os.path.join(base_dir, 'bids_layout_index')
+    database_path = os.path.join(os.path.abspath(os.path.expanduser(index_dir)),
+                                 hashlib.sha1(bids_dir.encode()).hexdigest()[:12])
+
+    fingerprint = dataset_fingerprint(bids_dir)
+    if _read_fingerprint(database_path) == fingerprint:
+        return database_path
+
+    os.makedirs(os.path.dirname(database_path), exist_ok=True)
+    with open(database_path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)  # one rebuild at a time, others wait and reuse it
+        if _read_fingerprint(database_path) != fingerprint:
+            _rebuild_index(bids_dir, database_path, fingerprint)
+    return database_path
+
+
+def _read_fingerprint(database_path):
+    try:
+        with open(os.path.join(database_path, FINGERPRINT_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _rebuild_index(bids_dir, database_path, fingerprint):
+    # The index is built in a new version directory and database_path (a symlink) is switched to it atomically:
+    # processes loading the index meanwhile see either the complete old or the complete new version.
+    from bids import BIDSLayout
+
+    print('[PUMI] indexing BIDS dataset', bids_dir)
+    version_path = '%s.v%d' % (database_path, time.time_ns())
+    BIDSLayout(bids_dir).save(version_path)  # same layout as created by BIDSDataGrabber
+    with open(os.path.join(version_path, FINGERPRINT_FILE), 'w') as f:
+        json.dump(fingerprint, f)
+
+    previous = os.readlink(database_path) if os.path.islink(database_path) else None
+    if os.path.isdir(database_path) and previous is None:  # index directory of an earlier version of PUMI
+        shutil.rmtree(database_path, ignore_errors=True)
+    link = database_path + '.link'
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(version_path), link)
+    os.replace(link, database_path)
+
+    # remove the outdated versions, except the one replaced now, which may still be loaded by other processes
+    for path in glob(escape(database_path) + '.v*'):
+        if os.path.basename(path) not in (os.path.basename(version_path), previous):
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,357 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import socket
+import time
+from pathlib import Path
+
+from PUMI import globals
+from PUMI.versions import get_interface_version
+
+# Interfaces that must never be served from the cache (side effects or bookkeeping only)
+UNCACHEABLE_INTERFACES = [
+    'nipype.interfaces.io.DataSink',
+    'PUMI.sink.LinkDataSink',
+    'nipype.interfaces.io.BIDSDataGrabber',
+    'nipype.interfaces.utility.base.IdentityInterface',
+]
+
+ENTRY_FILE = 'entry.json'
+
+_file_digests = {}  # (path, size, mtime in ns) -> content digest, for the lifetime of the process
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """
+    Return the SHA-1 hex digest of the content of a file.
+
+    Parameters:
+        path (str): Path to the file.
+        chunk_size (int): Number of bytes read at once.
+
+    Returns:
+        digest (str): Hex digest of the file content.
+    """
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def link_or_copy(src, dst):
+    """
+    Hardlink src to dst. Falls back to copying if hardlinking is not possible (e.g. across filesystems).
+    """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def get_result_cache(node=None):
+    """
+    Return the global result cache as configured in the [CACHE] section of settings.ini.
+
+    Parameters:
+        node (Node): If given, None is also returned if the interface of the node must not be cached.
+
+    Returns:
+        result_cache (ResultCache): The cache or None if caching is disabled (default).
+    """
+    cfg = globals.cfg_parser
+    if not cfg.getboolean('CACHE', 'enabled', fallback=False):
+        return None
+
+    if node is not None:
+        interface = node.interface
+        interface_name = type(interface).__module__ + '.' + type(interface).__name__
+        if interface_name in UNCACHEABLE_INTERFACES or interface.always_run:
+            return None
+
+    return ResultCache(
+        cache_dir=cfg.get('CACHE', 'cache_dir', fallback='~/.cache/pumi'),
+        max_size_gb=cfg.getfloat('CACHE', 'max_size_gb', fallback=100)
+    )
+
+
+class ResultCache:
+
+    """
+    Content-addressed cache for the results of node executions, shared across workflows and working directories.
+
+    The key of an entry combines the interface class, the non-file inputs, the content hash of the input files and the
+    version of the external tool. An entry stores the output files of a node (hardlinked, if possible) and a JSON file
+    describing how to rebuild the outputs of the interface. Entries are evicted in least-recently-used order as soon as
+    the cache grows beyond max_size_gb.
+    """
+
+    def __init__(self, cache_dir, max_size_gb=100):
+        self.cache_dir = Path(os.path.expanduser(cache_dir)).absolute()
+        self.max_size = int(max_size_gb * 1024 ** 3)
+
+    def key(self, node):
+        """
+        Calculate the cache key of a node from its current inputs.
+        """
+        interface = node.interface
+        inputs = {}
+        for name, value in node.inputs.get_traitsfree().items():
+            if node.inputs.trait(name).nohash:
+                continue
+            inputs[name] = self._normalize(value)
+
+        description = {
+            'interface': type(interface).__module__ + '.' + type(interface).__name__,
+            'inputs': inputs,
+            'version': get_interface_version(interface),
+            'needed_outputs': sorted(node.needed_outputs or []),
+        }
+        return hashlib.sha1(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def fetch(self, node):
+        """
+        Materialize a cached result into the output directory of the node.
+
+        Returns:
+            result (InterfaceResult): The result of the node or None on a cache miss.
+        """
+        from nipype.interfaces.base.support import Bunch, InterfaceResult
+        from nipype.pipeline.engine.utils import save_resultfile
+        from nipype.utils.misc import str2bool
+
+        node._pumi_cache_key = self.key(node)
+        entry_dir = self._entry_dir(node._pumi_cache_key)
+        entry_file = entry_dir / ENTRY_FILE
+        if not entry_file.exists():
+            return None
+
+        with open(entry_file, 'r') as f:
+            entry = json.load(f)
+
+        outdir = node.output_dir()
+        try:
+            outputs = self._restore(entry['outputs'], entry_dir, outdir)
+        except FileNotFoundError:  # entry was evicted while we read it
+            return None
+        os.utime(entry_file)  # LRU bookkeeping
+
+        interface_outputs = node.interface._outputs()
+        interface_outputs.trait_set(**outputs)
+        result = InterfaceResult(
+            interface=node.interface.__class__,
+            runtime=Bunch(
+                cwd=outdir,
+                returncode=0,
+                duration=0,
+                environ=dict(os.environ),
+                hostname=socket.gethostname(),
+            ),
+            inputs=node.interface.inputs.get_traitsfree(),
+            outputs=interface_outputs,
+        )
+        save_resultfile(result, outdir, node.name,
+                        rebase=str2bool(node.config['execution']['use_relative_paths']))
+        print(f'[PUMI cache] hit for {node.fullname} ({node._pumi_cache_key})')
+        return result
+
+    def store(self, node, result):
+        """
+        Add the result of a successful execution to the cache.
+        Results which reference files outside the output directory of the node are not cached.
+        """
+        key = getattr(node, '_pumi_cache_key', None) or self.key(node)
+        entry_dir = self._entry_dir(key)
+        if entry_dir.exists() or result.outputs is None:
+            return
+
+        outdir = node.output_dir()
+        files = []
+        try:
+            outputs = self._collect(result.outputs.get_traitsfree(), outdir, files)
+        except ValueError:
+            return
+
+        tmp_dir = entry_dir.parent / ('.tmp_' + key + '_' + str(os.getpid()))
+        try:
+            tmp_dir.mkdir(parents=True, exist_ok=True)
+            size = 0
+            for relpath in files:
+                link_or_copy(os.path.join(outdir, relpath), str(tmp_dir / relpath))
+                size += os.path.getsize(tmp_dir / relpath)
+
+            entry = {
+                'key': key,
+                'node': node.fullname,
+                'interface': type(node.interface).__module__ + '.' + type(node.interface).__name__,
+                'outputs': outputs,
+                'size': size,
+                'created': time.time(),
+            }
+            with open(tmp_dir / ENTRY_FILE, 'w') as f:
+                json.dump(entry, f, indent=4)
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # another process stored the same entry in the meantime, or the cache is not writable
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        self.prune()
+
+    def entries(self):
+        """
+        Return a list of all entries, least recently used first.
+        """
+        entries = []
+        for entry_file in self.cache_dir.glob('*/*/' + ENTRY_FILE):
+            try:
+                with open(entry_file, 'r') as f:
+                    entry = json.load(f)
+                entry['last_access'] = entry_file.stat().st_mtime
+            except (OSError, ValueError):
+                continue
+            entry['path'] = str(entry_file.parent)
+            entries.append(entry)
+        return sorted(entries, key=lambda e: e['last_access'])
+
+    def prune(self, max_size=None):
+        """
+        Evict least-recently-used entries until the cache is not larger than max_size bytes.
+
+        Returns:
+            removed (list): The evicted entries.
+        """
+        if max_size is None:
+            max_size = self.max_size
+        entries = self.entries()
+        total = sum(e['size'] for e in entries)
+        removed = []
+        for entry in entries:
+            if total <= max_size:
+                break
+            shutil.rmtree(entry['path'], ignore_errors=True)
+            total -= entry['size']
+            removed.append(entry)
+        return removed
+
+    def _entry_dir(self, key):
+        return self.cache_dir / key[:2] / key
+
+    def _normalize(self, value):
+        # Replace files by their content hash, so that the key does not depend on the location of the inputs
+        if isinstance(value, dict):
+            return {str(k): self._normalize(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._normalize(v) for v in value]
+        if isinstance(value, (str, os.PathLike)) and os.path.isfile(value):
+            return {'content': self.file_digest(value)}
+        return value
+
+    def file_digest(self, path):
+        """
+        Return the content hash of a file (see hash_file), memoized per path, size and modification time in the
+        process and in the cache directory (digests/), so that the nodes using a file (also in other processes) do not
+        read it again.
+        """
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        memo_key = (path, stat.st_size, stat.st_mtime_ns)
+        if memo_key in _file_digests:
+            return _file_digests[memo_key]
+
+        name = hashlib.sha1(repr(memo_key).encode()).hexdigest()
+        digest_file = self.cache_dir / 'digests' / name[:2] / name
+        try:
+            digest = digest_file.read_text()
+        except OSError:
+            digest = hash_file(path)
+            tmp = digest_file.with_name(name + '.tmp_%d' % os.getpid())
+            try:
+                digest_file.parent.mkdir(parents=True, exist_ok=True)
+                tmp.write_text(digest)
+                os.replace(tmp, digest_file)
+            except OSError:  # the cache is not writable
+                pass
+        _file_digests[memo_key] = digest
+        return digest
+
+    def _collect(self, value, outdir, files):
+        if isinstance(value, dict):
+            return {k: self._collect(v, outdir, files) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._collect(v, outdir, files) for v in value]
+        if isinstance(value, (str, os.PathLike)) and os.path.isabs(value) and os.path.exists(value):
+            relpath = os.path.relpath(os.path.realpath(value), os.path.realpath(outdir))
+            if not os.path.isfile(value) or relpath.startswith('..'):
+                raise ValueError(f'{value} can not be cached')
+            files.append(relpath)
+            return {'file': relpath}
+        return value
+
+    def _restore(self, value, entry_dir, outdir):
+        if isinstance(value, dict) and set(value) == {'file'}:
+            dst = os.path.join(outdir, value['file'])
+            link_or_copy(str(entry_dir / value['file']), dst)
+            return dst
+        if isinstance(value, dict):
+            return {k: self._restore(v, entry_dir, outdir) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._restore(v, entry_dir, outdir) for v in value]
+        return value
+
+
+def main():
+    """
+    Command line interface to inspect and prune the result cache.
+    """
+    parser = argparse.ArgumentParser(description='Inspect and prune the PUMI result cache.')
+    parser.add_argument('--cache_dir', help='Cache directory. Default is the cache_dir set in settings.ini.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('info', help='Print location, number of entries and size of the cache.')
+
+    list_parser = subparsers.add_parser('list', help='List entries, least recently used first.')
+    list_parser.add_argument('--interface', help='Only list entries of interfaces containing this string.')
+
+    prune_parser = subparsers.add_parser('prune', help='Evict least recently used entries.')
+    prune_parser.add_argument('--max_size_gb', type=float,
+                              help='Target size in GB. Default is max_size_gb set in settings.ini.')
+
+    subparsers.add_parser('clear', help='Remove all entries.')
+
+    args = parser.parse_args()
+
+    cfg = globals.cfg_parser
+    result_cache = ResultCache(
+        cache_dir=args.cache_dir or cfg.get('CACHE', 'cache_dir', fallback='~/.cache/pumi'),
+        max_size_gb=cfg.getfloat('CACHE', 'max_size_gb', fallback=100)
+    )
+
+    if args.command == 'info':
+        entries = result_cache.entries()
+        size = sum(e['size'] for e in entries)
+        print(f'Cache directory: {result_cache.cache_dir}')
+        print(f'Entries: {len(entries)}')
+        print(f'Size: {size / 1024 ** 3:.2f} GB (limit: {result_cache.max_size / 1024 ** 3:.2f} GB)')
+    elif args.command == 'list':
+        for entry in result_cache.entries():
+            if args.interface and args.interface not in entry['interface']:
+                continue
+            last_access = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_access']))
+            print(f"{entry['key']}  {entry['size'] / 1024 ** 2:10.1f} MB  {last_access}  {entry['node']}")
+    elif args.command == 'prune':
+        max_size = None if args.max_size_gb is None else int(args.max_size_gb * 1024 ** 3)
+        removed = result_cache.prune(max_size=max_size)
+        print(f'Removed {len(removed)} entries ({sum(e["size"] for e in removed) / 1024 ** 3:.2f} GB)')
+    elif args.command == 'clear':
+        removed = result_cache.prune(max_size=0)
+        print(f'Removed {len(removed)} entries')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+import json
+import os
+
+import numpy as np
+from nipype.interfaces.io import DataSink
+from PUMI import globals
+from PUMI.hashing import NIFTI_EXTENSIONS, hash_method, hash_file_fast
+from PUMI.scheduling import MultiProcPlugin as _MultiProcPlugin
+
+# Written into the working directory of a node whose outputs were removed, lists the removed files
+MARKER_FILE = '_pumi_collected.json'
+
+# Bookkeeping files of nipype, they are never removed (reruns need them to tell that the node is done)
+METADATA_PREFIXES = ('result_', '_0x', '_inputs.pklz', '_node.pklz', 'command.txt', MARKER_FILE)
+
+
+def cleanup_enabled():
+    return globals.cfg_parser.getboolean('WORKDIR', 'cleanup', fallback=False)
+
+
+def _files(value):
+    # all file paths in an (arbitrarily nested) output value
+    if isinstance(value, dict):
+        return [f for v in value.values() for f in _files(v)]
+    if isinstance(value, (list, tuple)):
+        return [f for v in value for f in _files(v)]
+    if isinstance(value, (str, os.PathLike)) and os.path.isabs(value) and os.path.exists(value):
+        if os.path.isdir(value):
+            return [os.path.join(root, f) for root, _, files in os.walk(value) for f in files]
+        return [str(value)]
+    return []
+
+
+def collect_node(node, keep_outputs=(), min_size_mb=None):
+    """
+    Remove the large files of a node from the working directory, after all of its consumers have finished.
+
+    Every removed file is replaced by an empty sparse file with the same size and modification time, so that the
+    (timestamp based) hashes of the consumers do not change and reruns still find the node and its consumers done.
+    The nipype metadata (results, hashfiles, report) is kept, the removed files are listed in MARKER_FILE, with their
+    digests for the 'fast' hash method (see PUMI.hashing and collected_digest).
+
+    Parameters:
+        node (Node): A finished node.
+        keep_outputs (list): Names of the outputs that are kept (e.g. the ones routed to a sinker).
+        min_size_mb (float): Smaller files are kept. Default is min_size_mb in the [WORKDIR] section of settings.ini.
+
+    Returns:
+        freed_bytes (int): Number of bytes removed.
+    """
+    from nipype.pipeline.engine.utils import load_resultfile
+
+    if min_size_mb is None:
+        min_size_mb = globals.cfg_parser.getfloat('WORKDIR', 'min_size_mb', fallback=1)
+    outdir = node.output_dir()
+    result_file = os.path.join(outdir, 'result_%s.pklz' % node.name)
+    if not os.path.exists(result_file):
+        return 0
+
+    keep = set()
+    if keep_outputs:
+        outputs = load_resultfile(result_file).outputs
+        for name in keep_outputs:
+            keep.update(os.path.realpath(f) for f in _files(getattr(outputs, name, None)))
+
+    collected, digests, freed_bytes = [], {}, 0
+    fast_hashing = hash_method() == 'fast'
+    for root, dirs, files in os.walk(outdir):
+        dirs[:] = [d for d in dirs if d != '_report']
+        for name in files:
+            path = os.path.join(root, name)
+            if name.startswith(METADATA_PREFIXES) or os.path.islink(path) or os.path.realpath(path) in keep:
+                continue
+            stat = os.stat(path)
+            if stat.st_size < min_size_mb * 1024 ** 2 or stat.st_blocks == 0:  # small or already collected
+                continue
+            if fast_hashing and path.endswith(NIFTI_EXTENSIONS):
+                digests[os.path.relpath(path, outdir)] = hash_file_fast(path)
+            os.remove(path)  # other hardlinks of the file (e.g. in the sink directory or the result cache) remain
+            with open(path, 'wb') as f:
+                f.truncate(stat.st_size)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            collected.append(os.path.relpath(path, outdir))
+            if stat.st_nlink == 1:
+                freed_bytes += stat.st_blocks * 512
+
+    if collected:
+        marker = os.path.join(outdir, MARKER_FILE)
+        if os.path.exists(marker):
+            with open(marker, 'r') as f:
+                previous = json.load(f)
+            collected = previous['files'] + collected
+            digests = {**previous.get('digests', {}), **digests}
+        with open(marker, 'w') as f:
+            json.dump({'files': collected, 'digests': digests}, f, indent=1)
+        print('[PUMI cleanup] removed %d file(s) (%.2f GB) of %s' % (len(collected), freed_bytes / 1024 ** 3,
+                                                                     node.fullname))
+    return freed_bytes
+
+
+def _find_marker(path, max_depth=8):
+    # working directory of the node that wrote the file and its MARKER_FILE content, if it has one
+    directory = os.path.dirname(path)
+    for _ in range(max_depth):
+        marker = os.path.join(directory, MARKER_FILE)
+        if os.path.exists(marker):
+            with open(marker, 'r') as f:
+                return directory, json.load(f)
+        directory = os.path.dirname(directory)
+    return None, None
+
+
+def collected_digest(path):
+    """
+    Return the digest (see PUMI.hashing.hash_file_fast) a file had before collect_node removed it, or None.
+    """
+    directory, marker = _find_marker(path)
+    if marker is None:
+        return None
+    return marker.get('digests', {}).get(os.path.relpath(path, directory))
+
+
+def check_collected_inputs(node, max_depth=8):
+    """
+    Raise an error if a node is about to run on inputs that were removed by collect_node (this happens if a consumer
+    has to be rerun, e.g. with changed parameters, while its producer is still cached). The producer is invalidated,
+    so that it is recomputed when the workflow is run again.
+    """
+    for path in _files(node.inputs.get_traitsfree()):
+        directory, marker = _find_marker(path, max_depth=max_depth)
+        if marker is not None and os.path.relpath(path, directory) in marker['files']:
+            for name in os.listdir(directory):
+                if name.startswith(('result_', '_0x')) and name.endswith(('.pklz', '.json')):
+                    os.remove(os.path.join(directory, name))
+            raise RuntimeError('Input %s of node %s was removed by the working directory cleanup ([WORKDIR] '
+                               'cleanup in settings.ini). Its producer %s has been invalidated, rerun the '
+                               'workflow to recompute it.' % (path, node.fullname, directory))
+
+
+class MultiProcPlugin(_MultiProcPlugin):
+    """
+    MultiProc plugin that removes the large outputs of a node as soon as all of its consumers (including the sinkers)
+    have finished (see collect_node). Outputs routed to a DataSink are kept.
+    Nodes without consumers (final outputs) and nodes with failed consumers are never cleaned up.
+    The schedulers are those of PUMI.scheduling.MultiProcPlugin.
+    """
+
+    def _generate_dependency_list(self, graph):
+        super()._generate_dependency_list(graph)
+        self._collectable = set(np.flatnonzero(np.asarray(self.refidx.sum(axis=1)).ravel() > 0))
+        self._collected = set()
+        self._keep_outputs = {}
+        index = {node: i for i, node in enumerate(self.procs)}
+        for u, v, data in graph.edges(data=True):
+            if isinstance(v.interface, DataSink):
+                self._keep_outputs.setdefault(index[u], set()).update(
+                    src[0] if isinstance(src, tuple) else src for src, _ in data['connect'])
+
+    def _remove_node_dirs(self):
+        super()._remove_node_dirs()
+        finished = np.flatnonzero(np.asarray(self.refidx.sum(axis=1)).ravel() == 0)
+        for idx in finished:
+            if idx not in self._collectable or idx in self._collected or idx in self.mapnodesubids:
+                continue
+            if self.proc_done[idx] and not self.proc_pending[idx]:
+                self._collected.add(idx)
+                try:
+                    collect_node(self.procs[idx], keep_outputs=self._keep_outputs.get(idx, ()))
+                except Exception as e:
+                    print('[PUMI cleanup] could not clean up %s: %s' % (self.procs[idx].fullname, e))
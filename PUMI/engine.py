@@ -1,19 +1,36 @@
 import argparse
 from configparser import SafeConfigParser
 from pathlib import Path
-from PUMI._version import get_versions
+from PUMI import get_version
 from nipype.pipeline.engine.workflows import *
 from nipype.pipeline.engine.nodes import *
 import nipype.interfaces.utility as utility
 from nipype.interfaces import BIDSDataGrabber
 from nipype.interfaces.io import DataSink
 from nipype import Function
-from nipype.utils.filemanip import list_to_filename
-from hashlib import sha1
+from nipype.utils.filemanip import ensure_list, list_to_filename
+from nipype.utils.misc import flatten
+from copy import deepcopy
+from hashlib import sha1, md5
 import re
 import ast
+import time
 from PUMI import globals
-import subprocess
+from PUMI.bids_index import get_layout_index
+from PUMI.cache import get_result_cache
+from PUMI.optimize import inline_function_nodes, merge_duplicate_nodes, prune_dead_nodes, disable_unused_outputs
+from PUMI.profiling import run_profiled
+from PUMI.resources import resources_enabled, estimate_memory_gb, estimate_threads, limit_threads_enabled, \
+    thread_budget
+from PUMI.sink import LinkDataSink, get_data_sink, wait_for_copies
+from PUMI.versions import get_interface_versions
+from PUMI.versions import get_interface_version  # noqa: F401, moved to PUMI.versions, importable from here as before
+from PUMI.sharding import parse_shard, list_subjects, estimate_subject_cost, partition_subjects, print_shards
+from PUMI.limits import effective_limits
+from PUMI.ledger import record_run, track_node
+from PUMI.estimate import estimate_run, print_estimate
+from PUMI.hashing import hash_method, get_hashval
+from PUMI.workflow_cache import workflow_cache_enabled, workflow_key, load_workflow, save_workflow
 import json
 
 
@@ -30,7 +47,83 @@ def _parameterization_dir(param):
     return param
 
 
+def _run_cached(node, execute, run_command):
+    # serve the result from the global result cache (see PUMI.cache), if enabled in settings.ini, otherwise run the
+    # command and store its result
+    result_cache = get_result_cache(node) if execute else None
+    result = result_cache.fetch(node) if result_cache is not None else None
+    if result is not None:
+        return result
+    result = run_command()
+    if result_cache is not None:
+        result_cache.store(node, result)
+    return result
+
+
+class CachedNode(Node):
+    # plain nipype Node that uses the result cache, the subnodes of NestedMapNodes
+
+    def _run_command(self, execute, copyfiles=True):
+        return _run_cached(self, execute, lambda: super(CachedNode, self)._run_command(execute, copyfiles))
+
+
 class NestedNode(Node):
+    # cheap Function nodes that do not write files can be marked as inline (see PUMI.optimize.inline_function_nodes)
+    inline = False
+    # nodes with side effects besides their outputs can be kept explicitly (see PUMI.optimize.prune_dead_nodes)
+    keep = False
+
+    def __init__(self, interface, name, mem_gb=None, **kwargs):
+        # without an explicit mem_gb, the memory is estimated at runtime (see mem_gb_runtime and PUMI.resources)
+        self._estimate_mem_gb = mem_gb is None
+        super().__init__(interface, name, mem_gb=0.2 if mem_gb is None else mem_gb, **kwargs)
+
+    @property
+    def mem_gb_runtime(self):
+        """Get estimated memory (GB), updated based on the inputs and previous runs (see PUMI.resources)"""
+        if getattr(self, '_estimate_mem_gb', False) and not self._ram_estimated and resources_enabled():
+            try:
+                self._get_inputs()
+                self._mem_gb, self.ram_estimator_str = estimate_memory_gb(self)
+            except Exception as e:
+                print('[PUMI resources] could not estimate the memory of %s: %s' % (self.fullname, e))
+            self._ram_estimated = True
+        return self.mem_gb
+
+    @property
+    def n_procs(self):
+        """Get the estimated number of threads, from the interface defaults and previous runs if not set explicitly"""
+        inputs = self._interface.inputs
+        if self._n_procs is None and not (hasattr(inputs, 'num_threads') and isdefined(inputs.num_threads)) \
+                and resources_enabled():
+            return estimate_threads(self)
+        return Node.n_procs.fget(self)
+
+    @n_procs.setter
+    def n_procs(self, value):
+        Node.n_procs.fset(self, value)
+
+    def _get_hashval(self):
+        """Return a hash of the input state, with the input files hashed as configured in settings.ini"""
+        # e.g. the 'fast' method of PUMI.hashing does not read the whole (large) images and does not depend on the
+        # timestamps, which change when the data is copied. Without a method in settings.ini, nipype's is used.
+        method = hash_method()
+        if method is None:
+            return super()._get_hashval()
+        self._get_inputs()
+        if self._hashvalue is None and self._hashed_inputs is None:
+            self._hashed_inputs, self._hashvalue = get_hashval(self.inputs, method)
+            # self.config is only set when the node runs (or is part of a workflow), fall back to nipype's config
+            rm_extra = self.config['execution']['remove_unnecessary_outputs'] if self.config \
+                else config.get('execution', 'remove_unnecessary_outputs')
+            if str2bool(rm_extra) and self.needed_outputs:
+                hashobject = md5()
+                hashobject.update(self._hashvalue.encode())
+                hashobject.update(str(self.needed_outputs).encode())
+                self._hashvalue = hashobject.hexdigest()
+                self._hashed_inputs.append(('needed_outputs', self.needed_outputs))
+        return self._hashed_inputs, self._hashvalue
+
     # costumizing directories
     def output_dir(self):
         """Return the location of the output directory for the node"""
@@ -74,6 +167,27 @@ class NestedNode(Node):
 
         return self._output_dir
 
+    def _run_command(self, execute, copyfiles=True):
+        # inputs removed by the working directory cleanup (see PUMI.cleanup) can not be used anymore
+        if execute and globals.cfg_parser.getboolean('WORKDIR', 'cleanup', fallback=False):
+            from PUMI.cleanup import check_collected_inputs
+            check_collected_inputs(self)
+
+        # served from the global result cache (see PUMI.cache), if enabled in settings.ini
+        return _run_cached(self, execute, lambda: self._run_tracked(execute, copyfiles))
+
+    def _run_tracked(self, execute, copyfiles):
+        # record runtime and resource usage into the profile database (see PUMI.profiling), if enabled
+        # with the threads of the tools limited to n_procs of the node (see PUMI.resources.thread_budget)
+        # and the status of the node in the ledger of the run (see PUMI.ledger)
+        if execute and limit_threads_enabled():
+            with track_node(self), thread_budget(self):
+                return run_profiled(self, lambda: super(NestedNode, self)._run_command(execute, copyfiles))
+        if execute:
+            with track_node(self):
+                return run_profiled(self, lambda: super(NestedNode, self)._run_command(execute, copyfiles))
+        return super()._run_command(execute, copyfiles)
+
 
 class NestedMapNode(MapNode, NestedNode):
     # costumizing directories
@@ -81,6 +195,34 @@ class NestedMapNode(MapNode, NestedNode):
     def output_dir(self):
         return super().output_dir()
 
+    def _make_nodes(self, cwd=None):
+        # as MapNode._make_nodes, but the subnodes are CachedNodes, so that they also use the result cache (they are
+        # run, profiled and recorded in the ledger as part of the MapNode)
+        if cwd is None:
+            cwd = self.output_dir()
+        iterfield_values = {}
+        for field in self.iterfield:
+            values = ensure_list(getattr(self.inputs, field))
+            iterfield_values[field] = flatten(values) if self.nested else values
+        for i in range(len(iterfield_values[self.iterfield[0]])):
+            node = CachedNode(
+                deepcopy(self._interface),
+                n_procs=self._n_procs,
+                mem_gb=self._mem_gb,
+                overwrite=self.overwrite,
+                needed_outputs=self.needed_outputs,
+                run_without_submitting=self.run_without_submitting,
+                base_dir=op.join(cwd, 'mapflow'),
+                name='_%s%d' % (self.name, i),
+            )
+            node.plugin_args = self.plugin_args
+            node.interface.inputs.trait_set(**deepcopy(self._interface.inputs.trait_get()))
+            node.interface.resource_monitor = self._interface.resource_monitor
+            for field, values in iterfield_values.items():
+                setattr(node.inputs, field, values[i])
+            node.config = self.config
+            yield i, node
+
 
 class NestedWorkflow(Workflow):
     # input/output filed naming is convenient: no need for 'inputspec.in_file' but simply 'in_file' (as if it was a node)
@@ -88,6 +230,51 @@ class NestedWorkflow(Workflow):
 
     # plus: connect accepts names instead of objects (for using the pre-specified in/outpoutspec nodes)
 
+    def run(self, plugin=None, plugin_args=None, updatehash=False):
+        # critical path scheduling (see PUMI.scheduling) and eager cleanup of the working directory (see PUMI.cleanup),
+        # as configured in settings.ini. Imported here, the nipype plugins are slow to import.
+        if plugin == 'MultiProc':
+            if globals.cfg_parser.getboolean('WORKDIR', 'cleanup', fallback=False):
+                from PUMI.cleanup import MultiProcPlugin
+            else:
+                from PUMI.scheduling import MultiProcPlugin
+            plugin = MultiProcPlugin(plugin_args=plugin_args)
+        execgraph = super().run(plugin=plugin, plugin_args=plugin_args, updatehash=updatehash)
+        # the sinkers may still copy in the background (see PUMI.sink)
+        wait_for_copies()
+        return execgraph
+
+    def write_graph(self, *args, **kwargs):
+        # recorded to be written again when the workflow is loaded from the workflow cache (see BidsPipeline)
+        self.written_graphs = getattr(self, 'written_graphs', []) + [(args, kwargs)]
+        return super().write_graph(*args, **kwargs)
+
+    def _create_flat_graph(self):
+        # the complete graph (all pipeline functions have built their parts): remove unused nodes and outputs and
+        # merge duplicated computations
+        flatgraph = super()._create_flat_graph()
+        if globals.cfg_parser.getboolean('OPTIMIZE', 'prune', fallback=False):
+            n_pruned = prune_dead_nodes(flatgraph, self.name)
+            if n_pruned:
+                print('[PUMI] %d unused node(s) pruned' % n_pruned)
+        if globals.cfg_parser.getboolean('OPTIMIZE', 'merge_duplicates', fallback=False):
+            n_merged = merge_duplicate_nodes(flatgraph)
+            if n_merged:
+                print('[PUMI] %d duplicate node(s) merged' % n_merged)
+        if globals.cfg_parser.getboolean('OPTIMIZE', 'prune', fallback=False):
+            n_disabled = disable_unused_outputs(flatgraph)
+            if n_disabled:
+                print('[PUMI] %d unused output(s) switched off' % n_disabled)
+        return flatgraph
+
+    def _configure_exec_nodes(self, graph):
+        # evaluate the inline Function nodes without running them as separate jobs (see PUMI.optimize)
+        if globals.cfg_parser.getboolean('OPTIMIZE', 'inline_functions', fallback=False):
+            n_fused = inline_function_nodes(graph)
+            if n_fused:
+                print('[PUMI] %d inline Function node(s) fused into their consumers' % n_fused)
+        super()._configure_exec_nodes(graph)
+
     def connect(self, *args, **kwargs):
 
         """
@@ -210,9 +397,11 @@ class PumiPipeline:
                 wf.add_nodes([outputspec])
 
             sinker = NestedNode(
-                DataSink(),
+                get_data_sink(),
                 name='sinker'
             )
+            # cheap with LinkDataSink (see PUMI.sink), nipype's DataSink copies: submitted as a job
+            sinker.run_without_submitting = isinstance(sinker.interface, LinkDataSink)
             sinker.inputs.base_directory = wf.qc_dir if isinstance(self, QcPipeline) else wf.sink_dir
             sinker.inputs.regexp_substitutions = self.regexp_sub
             wf.add_nodes([sinker])
@@ -361,8 +550,69 @@ class BidsPipeline(PumiPipeline):
 
         super().__init__(None, None, None)
 
+    def _build(self, pipeline_fun, name, bids_dir, base_dir, sink_dir, qc_dir, **kwargs):
+        # main workflow, without the subjects and the BIDS layout index (see wrapper). The working directory is set
+        # for the side effects of the construction (e.g. wf.write_graph), it is not part of the workflow cache key.
+        wf = NestedWorkflow(name, base_dir=base_dir)
+        wf.sink_dir = sink_dir
+        wf.qc_dir = qc_dir
+        wf.cfg_parser = globals.cfg_parser
+
+        # instead of inputspec, we need a bidsgrabber
+
+        # Create a subroutine (subgraph) for every subject
+        subject_iterator = Node(interface=utility.IdentityInterface(fields=['subject']), name='subject_iterator')
+
+        # create a BIDS-node
+        bids_grabber = Node(BIDSDataGrabber(), name='bids_grabber')
+        bids_grabber.inputs.base_dir = os.path.abspath(bids_dir)
+        bids_grabber.inputs.output_query = self.output_query
+
+        wf.connect(subject_iterator, 'subject', bids_grabber, 'subject')
+
+        inputspec = NestedNode(
+            utility.IdentityInterface(
+                fields=[*self.output_query]
+            ),
+            name='inputspec'
+        )
+
+        # 'Unpack' list from bids_grabber
+        # bids_grabber returns a list with a string (path to the anat image of a subject),
+        # but most other nodes do not take a list as input file
+        for bids_modality in [*self.output_query]:
+            print(bids_modality)
+            path_extractor = Node(
+                Function(
+                    input_names=["filelist"],
+                    output_names=[bids_modality],
+                    function=list_to_filename
+                ),
+                name="path_extractor_" + bids_modality
+            )
+            path_extractor.inline = True
+            wf.connect(bids_grabber, bids_modality, path_extractor, 'filelist')
+            wf.connect(path_extractor, bids_modality, inputspec, bids_modality)
+
+        # there is no outputspec, this pipeline should not be nested!
+
+        # in case it's needed:
+        sinker = NestedNode(
+            get_data_sink(),
+            name='sinker'
+        )
+        # cheap with LinkDataSink (see PUMI.sink), nipype's DataSink copies: submitted as a job
+        sinker.run_without_submitting = isinstance(sinker.interface, LinkDataSink)
+        sinker.inputs.base_directory = wf.qc_dir if isinstance(self, QcPipeline) else wf.sink_dir
+        sinker.inputs.regexp_substitutions = self.regexp_sub
+        wf.add_nodes([sinker])
+
+        pipeline_fun(wf=wf, bids_dir=bids_dir, **kwargs)
+        return wf
+
     def __call__(self, pipeline_fun):
-        def wrapper(name, bids_dir, subjects=None, base_dir='.', sink_dir=None, qc_dir=None, run_args=None, **kwargs):
+        def wrapper(name, bids_dir, subjects=None, base_dir='.', sink_dir=None, qc_dir=None, run_args=None,
+                    build_only=False, **kwargs):
 
             """
             # Todo Docs
@@ -384,72 +634,66 @@ class BidsPipeline(PumiPipeline):
                 qc_dir = os.path.abspath(os.path.join(sink_dir, qc_dir))
             globals.cfg_parser.set('SINKING', 'qc_dir', qc_dir)
 
-            # main workflow
-            wf = NestedWorkflow(name, base_dir)
-            wf.sink_dir = sink_dir
-            wf.qc_dir = qc_dir
-            wf.cfg_parser = globals.cfg_parser
-
-            # instead of inputspec, we need a bidsgrabber
-
             if subjects is None:
                 # parse all subjects
                 subjects = []
                 for sub in glob(bids_dir + '/sub-*'):
                     subjects.append(sub.split('sub-')[-1])
 
-            # Create a subroutine (subgraph) for every subject
-            subject_iterator = Node(interface=utility.IdentityInterface(fields=['subject']), name='subject_iterator')
-            subject_iterator.iterables = [('subject', subjects)]
-
-            # create a BIDS-node
-            bids_grabber = Node(BIDSDataGrabber(), name='bids_grabber')
-            bids_grabber.inputs.base_dir = os.path.abspath(bids_dir)
-            bids_grabber.inputs.output_query = self.output_query
-
-            wf.connect(subject_iterator, 'subject', bids_grabber, 'subject')
-
-            inputspec = NestedNode(
-                utility.IdentityInterface(
-                    fields=[*self.output_query]
-                ),
-                name='inputspec'
-            )
-
-            # 'Unpack' list from bids_grabber
-            # bids_grabber returns a list with a string (path to the anat image of a subject),
-            # but most other nodes do not take a list as input file
-            for bids_modality in [*self.output_query]:
-                print(bids_modality)
-                path_extractor = Node(
-                    Function(
-                        input_names=["filelist"],
-                        output_names=[bids_modality],
-                        function=list_to_filename
-                    ),
-                    name="path_extractor_" + bids_modality
-                )
-                wf.connect(bids_grabber, bids_modality, path_extractor, 'filelist')
-                wf.connect(path_extractor, bids_modality, inputspec, bids_modality)
-
-            # there is no outputspec, this pipeline should not be nested!
-
-            # in case it's needed:
-            sinker = NestedNode(
-                DataSink(),
-                name='sinker'
-            )
-            sinker.inputs.base_directory = wf.qc_dir if isinstance(self, QcPipeline) else wf.sink_dir
-            sinker.inputs.regexp_substitutions = self.regexp_sub
-            wf.add_nodes([sinker])
-
-            pipeline_fun(wf=wf, bids_dir=bids_dir, **kwargs)
+            # the constructed workflow is cached (see PUMI.workflow_cache). The subjects, the working directory and the
+            # BIDS layout index are set afterwards, so that e.g. the array tasks of a sharded run share the workflow.
+            start = time.time()
+            key = workflow_key(pipeline_fun, name=name, bids_dir=os.path.abspath(bids_dir), sink_dir=sink_dir,
+                               qc_dir=qc_dir, output_query=self.output_query, kwargs=kwargs) \
+                if workflow_cache_enabled() else None
+            wf = load_workflow(key) if key is not None else None
+            if wf is None:
+                wf = self._build(pipeline_fun, name, bids_dir, base_dir, sink_dir, qc_dir, **kwargs)
+                if key is not None:
+                    save_workflow(key, wf)
+                print('[PUMI] workflow %s built in %.1f s' % (name, time.time() - start))
+            else:
+                wf.cfg_parser = globals.cfg_parser
+                wf.base_dir = base_dir
+                # the side effects of the construction
+                if getattr(wf, 'dataset_description', None) is not None:
+                    write_dataset_description(wf)
+                for args, graph_kwargs in getattr(wf, 'written_graphs', []):
+                    Workflow.write_graph(wf, *args, **graph_kwargs)
+                print('[PUMI] workflow %s loaded from the workflow cache in %.1f s' % (name, time.time() - start))
+
+            wf.output_query = self.output_query
+            wf.get_node('subject_iterator').iterables = [('subject', subjects)]
+            bids_grabber = wf.get_node('bids_grabber')
+            layout_index = get_layout_index(bids_dir, base_dir)
+            if layout_index is not None:
+                bids_grabber.inputs.load_layout = layout_index
 
             # todo: should we do any post workflow checks
             # e.g. is outputspec connected
             # or unconnected nodes
 
-            wf.run(**run_args)
+            if build_only:
+                return wf
+
+            # the thread estimates of the nodes (see PUMI.resources) must not exceed the processors of the plugin,
+            # the limit is set for this run only
+            n_procs = run_args.get('plugin_args', {}).get('n_procs')
+            if not globals.cfg_parser.has_section('RESOURCES'):
+                globals.cfg_parser.add_section('RESOURCES')
+            previous_max_threads = globals.cfg_parser.get('RESOURCES', 'max_threads', fallback=None)
+            if n_procs is not None:
+                globals.cfg_parser.set('RESOURCES', 'max_threads', str(n_procs))
+
+            try:
+                # the status of the subjects and nodes is recorded in the run ledger (see PUMI.ledger and pumi-runs)
+                with record_run(name, subjects, base_dir):
+                    wf.run(**run_args)
+            finally:
+                if previous_max_threads is None:
+                    globals.cfg_parser.remove_option('RESOURCES', 'max_threads')
+                else:
+                    globals.cfg_parser.set('RESOURCES', 'max_threads', previous_max_threads)
             return wf
 
         return wrapper
@@ -496,8 +740,7 @@ class BidsApp:
 
         self.parser.add_argument(
             '--version',
-            action='version',
-            version='Version {}'.format(get_versions()['version']),
+            action=_VersionAction,
             help='Print version of PUMI'
         )
 
@@ -516,13 +759,15 @@ class BidsApp:
         self.parser.add_argument(
             '--n_procs',
             type=int,
-            help='Amount of threads to execute in parallel. If not set, the amount of CPU cores is used.'
+            help='Amount of threads to execute in parallel. If not set, the CPUs available to the process are used '
+                 '(CPU affinity mask and cgroup CPU quota, e.g. in containers or Slurm jobs). '
                  'Caution: Does only work with the MultiProc-plugin!')
 
         self.parser.add_argument(
             '--memory_gb',
             type=int,
-            help='Memory limit in GB. If not set, use 90 percent of the available memory'
+            help='Memory limit in GB. If not set, use 90 percent of the available memory (host memory or cgroup '
+                 'memory limit, e.g. in containers or Slurm jobs). '
                  'Caution: Does only work with the MultiProc-plugin!')
 
         self.parser.add_argument(
@@ -534,6 +779,36 @@ class BidsApp:
                  'be ignored!'
         )
 
+        self.parser.add_argument(
+            '--shard',
+            type=str,
+            help='Process only the i-th of N shards of the participants, given as i/N with 0 <= i < N '
+                 '(e. g. "$SLURM_ARRAY_TASK_ID/10" in a Slurm array job). The participants (all or the ones given by '
+                 '--participant_label) are deterministically partitioned into N shards of similar cost, estimated '
+                 'by the voxel x volume count of their images.'
+        )
+
+        self.parser.add_argument(
+            '--build_only',
+            action='store_true',
+            help='Only construct the workflow (and save it in the workflow cache, see settings.ini), but do not run it. '
+                 'E.g. before submitting an array job, so that the tasks load the constructed workflow.'
+        )
+
+        self.parser.add_argument(
+            '--estimate',
+            action='store_true',
+            help='Only estimate the CPU-hours, peak memory, scratch disk (working directory) and sink disk of the run '
+                 'per stage, from the image headers of the participants and the cost models of the nodes (refined by '
+                 'the profile database, see settings.ini), but do not run the pipeline.'
+        )
+
+        self.parser.add_argument(
+            '--dry_run',
+            action='store_true',
+            help='Only print the participants assigned to each shard (see --shard), but do not run the pipeline.'
+        )
+
         self.pipeline = pipeline  # mandatory via script
         self.name = name  # mandatory via script
         self.bids_dir = bids_dir
@@ -567,7 +842,11 @@ class BidsApp:
             'plugin',
             'plugin_args',
             'n_procs',
-            'memory_gb'
+            'memory_gb',
+            'shard',
+            'dry_run',
+            'build_only',
+            'estimate'
         ]
 
         pipeline_specific_arguments = {}
@@ -607,6 +886,17 @@ class BidsApp:
                     self.run_args['plugin_args']['memory_gb'] = cli_args.memory_gb
                 # Also not a problem if not set! Nipype will deal with this!
 
+        # Nipype's defaults are the CPUs and memory of the host, which oversubscribes containers with cgroup quotas.
+        # We use the detected limits instead (see PUMI.limits).
+        limits = effective_limits()
+        print('[PUMI] Detected ' + limits['description'])
+        if self.run_args.get('plugin') == 'MultiProc':
+            plugin_args = self.run_args.setdefault('plugin_args', {})
+            plugin_args.setdefault('n_procs', limits['n_procs'])
+            if limits['memory_gb'] is not None:
+                plugin_args.setdefault('memory_gb', round(0.9 * limits['memory_gb'], 2))
+            print('[PUMI] MultiProc: n_procs=%s, memory_gb=%s' % (plugin_args['n_procs'], plugin_args.get('memory_gb')))
+
         if (cli_args.bids_dir is None) and (self.bids_dir is None):
             raise ValueError('The argument "bids_dir" has to be set!')
         else:
@@ -618,73 +908,52 @@ class BidsApp:
         self.participant_label = cli_args.participant_label if (cli_args.participant_label is not None) else self.participant_label
         self.working_dir = cli_args.working_dir if (cli_args.working_dir is not None) else self.working_dir
 
+        if cli_args.shard is not None:
+            shard_index, n_shards = parse_shard(cli_args.shard)
+            subjects = self.participant_label if self.participant_label is not None else list_subjects(self.bids_dir)
+            costs = {subject: estimate_subject_cost(self.bids_dir, subject) for subject in subjects}
+            shards, loads = partition_subjects(costs, n_shards)
+            if cli_args.dry_run:
+                print_shards(shards, loads, costs)
+                return
+            self.participant_label = shards[shard_index]
+            print('Shard %d/%d: %s' % (shard_index, n_shards, ' '.join(self.participant_label)))
+            if not self.participant_label:
+                print('No participants in this shard, nothing to do.')
+                return
+        elif cli_args.dry_run:
+            subjects = self.participant_label if self.participant_label is not None else list_subjects(self.bids_dir)
+            print('Participants: ' + ' '.join(subjects))
+            return
+
         # todo: integrate analysis_level
 
-        self.pipeline(
+        wf = self.pipeline(
             self.name,
             bids_dir=self.bids_dir,
             sink_dir=self.output_dir,
             base_dir=self.working_dir,
             subjects=self.participant_label,
             run_args=self.run_args,
+            build_only=cli_args.build_only or cli_args.estimate,
             **pipeline_specific_arguments,
             **self.kwargs
         )
 
+        if cli_args.estimate:
+            # cost of the run, estimated from the constructed workflow (see PUMI.estimate)
+            subjects = self.participant_label if self.participant_label is not None else list_subjects(self.bids_dir)
+            print_estimate(estimate_run(wf, self.bids_dir, subjects),
+                           memory_gb=self.run_args.get('plugin_args', {}).get('memory_gb'))
 
-def get_interface_version(interface):
-    """
-
-    Try to get the version number of the underlying tool used in an interface.
-
-    Return None if interface is a nipype in-house interface that does not use external software like FSL.
-    Otherwise, return name of the tool and the version number of the underlying used tool (or 'Unknown' if the
-    version could not be fetched).
 
-    """
+class _VersionAction(argparse.Action):
+    # like argparse's 'version' action, but the version is only determined when requested
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
+        super().__init__(option_strings=option_strings, dest=dest, default=default, nargs=0, help=help)
 
-    # Nipype provides some in-house interfaces that do not use external software like FSL.
-    # We can exclude modules:
-    NIPYPE_IN_HOUSE_MODULES = [
-        'nipype.algorithms.',
-        'nipype.interfaces.image.',
-        'nipype.interfaces.io.',
-        'nipype.interfaces.mixins.',
-        'nipype.interfaces.utility.'
-    ]
-
-    interface_name = str(type(interface))  # e.g., "<class 'nipype.interfaces.fsl.utils.Reorient2Std'>"
-    interface_name = interface_name.replace("<class \'", "")  # e.g., "nipype.interfaces.fsl.utils.Reorient2Std'>"
-    interface_name = interface_name.replace("\'>", "")  # e.g., "nipype.interfaces.fsl.utils.Reorient2Std"
-    # Let's see if it's a nipype in-house interface
-    for in_house in NIPYPE_IN_HOUSE_MODULES:
-        if in_house in interface_name:
-            return None
-
-    tool_name = interface_name.split('.')[2]  # e.g., 'fsl', 'ants', 'afni'
-
-    try:
-        version = interface.version
-        if version is not None:
-            return tool_name, version
-    except AttributeError:
-        pass
-
-    if 'afni' in interface_name:
-        version_cmd = ['afni', '-ver']
-    elif 'ants' in interface_name:
-        version_cmd = ['antsRegistration', '--version']
-    elif 'c3' in interface_name:
-        version_cmd = ['c3d', '-version']
-    else:
-        return interface_name, 'Unknown'
-
-    try:
-        result = subprocess.run(version_cmd, capture_output=True, text=True)
-        return tool_name, result.stdout.strip()
-    except Exception as e:
-        print(f"Error getting version for {interface_name}: {e}")
-        return tool_name, 'Unknown'
+    def __call__(self, parser, namespace, values, option_string=None):
+        parser.exit(message='Version {}\n'.format(get_version()))
 
 
 def create_dataset_description(wf,
@@ -709,9 +978,11 @@ def create_dataset_description(wf,
 
     software_versions = {}
 
-    for node_name in wf.list_node_names():
-        node = wf.get_node(node_name)
-        result = get_interface_version(interface=node.interface)
+    nodes = [wf.get_node(node_name) for node_name in wf.list_node_names()]
+    # the distinct tools are probed in parallel, versions are cached (see PUMI.versions)
+    interface_versions = get_interface_versions([node.interface for node in nodes])
+    for node in nodes:
+        result = interface_versions[type(node.interface).__module__ + '.' + type(node.interface).__name__]
 
         if result is None:
             continue  # We can skip the external-tool-independent nipype in-house interfaces
@@ -719,18 +990,25 @@ def create_dataset_description(wf,
             interface_name, version = result
             software_versions[interface_name] = version
 
-    dataset_description_path = Path(wf.sink_dir) / 'dataset_description.json'
-    dataset_description_path.parent.mkdir(parents=True, exist_ok=True)
-
-    dataset_description = {
+    wf.dataset_description = {
         'Name': dataset_description_name,
         'BIDSVersion': bids_version,
         'PipelineDescription': {
             'Name': pipeline_description_name,
-            'Version': get_versions()['version'],
+            'Version': get_version(),
             'Software': [{'Name': name, 'Version': version} for name, version in software_versions.items()]
         }
     }
 
+    write_dataset_description(wf)
+
+
+def write_dataset_description(wf):
+    """
+    Save the dataset description created by create_dataset_description in the workflow's sink directory, e.g. again
+    for a workflow loaded from the workflow cache (see PUMI.workflow_cache).
+    """
+    dataset_description_path = Path(wf.sink_dir) / 'dataset_description.json'
+    dataset_description_path.parent.mkdir(parents=True, exist_ok=True)
     with open(dataset_description_path, 'w') as outfile:
-        json.dump(dataset_description, outfile, indent=4)
+        json.dump(wf.dataset_description, outfile, indent=4)
@@ -0,0 +1,141 @@
+import os
+from glob import glob
+
+from PUMI import globals
+from PUMI.resources import estimate_memory_gb, estimate_output_bytes, estimate_runtime, estimate_threads, \
+    has_history
+
+
+def subject_voxels(bids_dir, subject, output_query):
+    """
+    Return the size of the input images of a subject as modality -> number of voxels (incl. volumes), from the NIfTI
+    headers only. With several images of a modality (e.g. runs), the largest one counts.
+
+    Parameters:
+        bids_dir (str): Path to the BIDS dataset.
+        subject (str): Participant label (without 'sub-').
+        output_query (dict): Output query of the BIDS grabber (see PUMI.engine.BidsPipeline), modality -> query.
+    """
+    import nibabel as nib
+    import numpy as np
+
+    voxels = {}
+    for modality, query in output_query.items():
+        pattern = 'sub-%s*_%s.nii*' % (subject, query.get('suffix', modality))
+        images = glob(os.path.join(bids_dir, 'sub-' + subject, '**', query.get('datatype', ''), pattern),
+                      recursive=True)
+        voxels[modality] = 0
+        for image in images:
+            try:
+                voxels[modality] = max(voxels[modality], int(np.prod(nib.load(image).shape)))
+            except Exception:  # not a valid image, e.g. a broken symlink of a not yet downloaded dataset
+                continue
+    return voxels
+
+
+def node_modalities(graph, modalities):
+    """
+    Return the input modalities every node depends on, as node -> set of modalities (the path extractors of the
+    BIDS grabber outputs among its ancestors, see PUMI.engine.BidsPipeline).
+    """
+    import networkx as nx
+
+    depends = {node: set() for node in graph.nodes()}
+    for node in graph.nodes():
+        for modality in modalities:
+            if node.name == 'path_extractor_' + modality:
+                for descendant in nx.descendants(graph, node):
+                    depends[descendant].add(modality)
+    return depends
+
+
+def estimate_run(wf, bids_dir, subjects):
+    """
+    Estimate the cost of running a BIDS pipeline on the given subjects: CPU time, peak memory, scratch disk (files in
+    the working directory) and sink disk (files routed to the sinkers) per stage and per subject.
+
+    The nodes of the flat workflow graph (as it will be executed, after pruning and merging) are estimated with the
+    cost models of PUMI.resources (DEFAULT_RESOURCES, DEFAULT_RUNTIMES, DEFAULT_OUTPUT_BYTES), scaled by the size of
+    the subject's input images the node depends on (NIfTI headers only). Nodes with previous runs in the profile
+    database are estimated from their history instead. MapNodes are counted once, inline Function nodes (see
+    PUMI.optimize.inline_function_nodes) are free.
+
+    Parameters:
+        wf (NestedWorkflow): Workflow built by a BidsPipeline (with build_only=True).
+        bids_dir (str): Path to the BIDS dataset.
+        subjects (list): Participant labels (without 'sub-').
+
+    Returns:
+        estimate (dict): 'stages': stage -> costs summed over the subjects (peak memory: maximum),
+                         'subjects': subject -> costs, 'nodes': number of estimated nodes,
+                         'history': number of nodes estimated from previous runs.
+                         Costs are dicts with 'cpu_h', 'wall_h', 'peak_mem_gb', 'scratch_gb' and 'sink_gb'.
+    """
+    from nipype.interfaces.io import DataSink, BIDSDataGrabber
+    from nipype.interfaces.utility import IdentityInterface
+
+    graph = wf._create_flat_graph()
+    output_query = getattr(wf, 'output_query', {})
+    depends = node_modalities(graph, output_query)
+    inline = globals.cfg_parser.getboolean('OPTIMIZE', 'inline_functions', fallback=False)
+    nodes = [node for node in graph.nodes()
+             if not isinstance(node.interface, (IdentityInterface, DataSink, BIDSDataGrabber))
+             and not (inline and getattr(node, 'inline', False))]
+    sinked = {u for u, v in graph.edges() if isinstance(v.interface, DataSink)}
+
+    def costs():
+        return {'cpu_h': 0.0, 'wall_h': 0.0, 'peak_mem_gb': 0.0, 'scratch_gb': 0.0, 'sink_gb': 0.0}
+
+    stages, per_subject = {}, {}
+    for subject in subjects:
+        voxels = subject_voxels(bids_dir, subject, output_query)
+        subject_costs = per_subject[subject] = costs()
+        for node in nodes:
+            node_voxels = max((voxels[modality] for modality in depends[node]), default=0)
+            runtime = estimate_runtime(node, voxels=node_voxels)
+            threads = node._n_procs if getattr(node, '_n_procs', None) else estimate_threads(node)
+            mem_gb = estimate_memory_gb(node, voxels=node_voxels)[0] if getattr(node, '_estimate_mem_gb', True) \
+                else node.mem_gb
+            output_gb = estimate_output_bytes(node, node_voxels) / 1024 ** 3
+
+            hierarchy = (node._hierarchy or wf.name).split('.')
+            stage_costs = stages.setdefault(hierarchy[1] if len(hierarchy) > 1 else wf.name, costs())
+            for c in [stage_costs, subject_costs]:
+                c['cpu_h'] += runtime * threads / 3600
+                c['wall_h'] += runtime / 3600
+                c['peak_mem_gb'] = max(c['peak_mem_gb'], mem_gb)
+                c['scratch_gb'] += output_gb
+                c['sink_gb'] += output_gb if node in sinked else 0
+
+    return {'stages': stages, 'subjects': per_subject, 'nodes': len(nodes),
+            'history': sum(1 for node in nodes if has_history(node))}
+
+
+def print_estimate(estimate, memory_gb=None):
+    """
+    Print the per-stage breakdown and the totals of a cost estimate (see estimate_run). A warning is printed if a
+    node is estimated to need more than memory_gb (e.g. the memory limit of the MultiProc plugin).
+    """
+    from PUMI.profiling import _print_table
+
+    subjects = estimate['subjects']
+    print('Estimated cost of %d node(s) for %d subject(s), %d node(s) estimated from previous runs:'
+          % (estimate['nodes'], len(subjects), estimate['history']))
+    columns = ['cpu_h', 'wall_h', 'peak_mem_gb', 'scratch_gb', 'sink_gb']
+    _print_table([{'stage': stage, **c} for stage, c in sorted(estimate['stages'].items(),
+                                                                 key=lambda item: -item[1]['cpu_h'])],
+                 ['stage'] + columns)
+    if not subjects:
+        return
+
+    total = {column: sum(c[column] for c in subjects.values()) for column in columns}
+    peak_mem_gb = max(c['peak_mem_gb'] for c in subjects.values())
+    largest = max(subjects, key=lambda subject: subjects[subject]['cpu_h'])
+    print('Total: %.1f CPU-hours (%.1f hours of serial node runtime), scratch disk %.1f GB, sink disk %.1f GB'
+          % (total['cpu_h'], total['wall_h'], total['scratch_gb'], total['sink_gb']))
+    print('Per subject: peak memory %.1f GB (largest node), up to %.1f CPU-hours and %.1f GB scratch disk '
+          '(sub-%s)' % (peak_mem_gb, subjects[largest]['cpu_h'], max(c['scratch_gb'] for c in subjects.values()),
+                        largest))
+    if memory_gb is not None and peak_mem_gb > memory_gb:
+        print('Warning: the largest node needs an estimated %.1f GB, more than the memory limit of %.1f GB'
+              % (peak_mem_gb, memory_gb))
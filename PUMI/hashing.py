@@ -0,0 +1,136 @@
+import gzip
+import hashlib
+import os
+
+from PUMI import globals
+
+# Bytes of the NIfTI header hashed (NIfTI-2 header size, covers NIfTI-1 and the start of the extensions)
+NIFTI_HEADER_BYTES = 540
+
+# Files hashed by sampling with the 'fast' method, all other files are hashed by their whole content
+NIFTI_EXTENSIONS = ('.nii', '.nii.gz')
+
+_float_fmt = '{:.10f}'.format
+
+
+def hash_method():
+    """
+    Return the method for hashing the input files of the nodes: 'fast', 'content' or 'timestamp' (method in the
+    [HASHING] section of settings.ini), or None to use the hash_method of the nipype configuration.
+    """
+    method = globals.cfg_parser.get('HASHING', 'method', fallback='').strip().lower()
+    if method and method not in ('fast', 'content', 'timestamp'):
+        raise ValueError("Unknown hash method in settings.ini: %s (use 'fast', 'content' or 'timestamp')" % method)
+    return method or None
+
+
+def _digest():
+    # fast non-cryptographic digest if xxhash is installed
+    try:
+        import xxhash
+        return xxhash.xxh3_128()
+    except ImportError:
+        return hashlib.blake2b(digest_size=16)
+
+
+def _nifti_header(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    try:
+        with opener(path, 'rb') as f:
+            return f.read(NIFTI_HEADER_BYTES)
+    except (OSError, EOFError):  # not a valid (compressed) file, the sampled blocks still identify it
+        return b''
+
+
+def hash_file_fast(path, block_size=None, n_blocks=None):
+    """
+    Fast digest of a NIfTI image (.nii or .nii.gz) that does not depend on its location or timestamps: the NIfTI
+    header, the file size and n_blocks blocks of block_size bytes sampled evenly across the file (incl. the first and
+    the last block). Files smaller than the sample are read completely. Files removed by the working directory cleanup
+    keep their digest (see PUMI.cleanup.collected_digest).
+
+    Parameters:
+        path (str): Path to the file.
+        block_size (int): Bytes per block. Default is block_kb in the [HASHING] section of settings.ini.
+        n_blocks (int): Number of blocks sampled. Default is n_blocks in the [HASHING] section of settings.ini.
+
+    Returns:
+        digest (str): Hex digest.
+    """
+    if block_size is None:
+        block_size = globals.cfg_parser.getint('HASHING', 'block_kb', fallback=64) * 1024
+    if n_blocks is None:
+        n_blocks = globals.cfg_parser.getint('HASHING', 'n_blocks', fallback=16)
+
+    stat = os.stat(path)
+    if stat.st_size and not stat.st_blocks:  # sparse placeholder of a file removed by the cleanup
+        from PUMI.cleanup import collected_digest
+        digest = collected_digest(path)
+        if digest is not None:
+            return digest
+
+    digest = _digest()
+    digest.update(str(stat.st_size).encode())
+    digest.update(_nifti_header(path))
+    with open(path, 'rb') as f:
+        if stat.st_size <= block_size * n_blocks:
+            digest.update(f.read())
+        else:
+            step = (stat.st_size - block_size) / max(n_blocks - 1, 1)
+            for i in range(n_blocks):
+                f.seek(int(i * step))
+                digest.update(f.read(block_size))
+    return digest.hexdigest()
+
+
+def hash_file(path, method):
+    """
+    Hash an input file of a node with the given method: 'fast' (NIfTI images: see hash_file_fast, other files: MD5 of
+    the whole content), 'content' (MD5 of the whole content) or 'timestamp' (size and modification time), the latter
+    two as in nipype.
+    """
+    from nipype.utils.filemanip import hash_infile, hash_timestamp
+
+    if method == 'fast' and path.endswith(NIFTI_EXTENSIONS):
+        return hash_file_fast(path)
+    if method in ('fast', 'content'):
+        return hash_infile(path)
+    return hash_timestamp(path)
+
+
+def _sorted_value(value, method, with_hash, hash_files):
+    # as nipype's BaseTraitedSpec._get_sorteddict, with the file hashing of PUMI
+    if isinstance(value, dict):
+        return [(key, _sorted_value(value[key], method, with_hash, hash_files)) for key in sorted(value)]
+    if isinstance(value, (list, tuple)):
+        sorted_values = [_sorted_value(v, method, with_hash, hash_files) for v in value]
+        return tuple(sorted_values) if isinstance(value, tuple) else sorted_values
+    if isinstance(value, (str, bytes)) and hash_files and os.path.isfile(value):
+        digest = hash_file(os.fsdecode(value), method)
+        return (value, digest) if with_hash else digest
+    if isinstance(value, float):
+        return _float_fmt(value)
+    return value
+
+
+def get_hashval(inputs, method):
+    """
+    Hash the inputs of an interface like nipype's BaseTraitedSpec.get_hashval, but with the input files hashed by
+    the given method (see hash_file).
+
+    Returns:
+        hashed_inputs (list): (name, value) of the inputs, with (path, hash) for the files.
+        hashvalue (str): MD5 hex digest of the inputs.
+    """
+    from nipype.interfaces.base import isdefined
+    from nipype.utils.filemanip import md5
+
+    with_hash, without_filename = [], []
+    for name, value in sorted(inputs.trait_get().items()):
+        if not isdefined(value) or inputs.has_metadata(name, 'nohash', True):
+            continue
+        hash_files = not inputs.has_metadata(name, 'hash_files', False) \
+            and not inputs.has_metadata(name, 'name_source')
+        without_filename.append((name, _sorted_value(value, method, False, hash_files)))
+        with_hash.append((name, _sorted_value(value, method, True, hash_files)))
+    return with_hash, md5(str(without_filename).encode()).hexdigest()
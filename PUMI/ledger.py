@@ -0,0 +1,425 @@
+import argparse
+import json
+import os
+import re
+import shlex
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from PUMI import globals
+
+# The run id and the ledger are passed to the processes executing the nodes (MultiProc workers, Slurm jobs)
+RUN_ID_VARIABLE = 'PUMI_RUN_ID'
+LEDGER_VARIABLE = 'PUMI_RUN_LEDGER'
+
+# Arguments of a BIDS app (see PUMI.engine.BidsApp) that select the participants, replaced when retrying a run
+SUBJECT_OPTIONS = {'--participant_label': None, '--shard': 1}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    pipeline TEXT,
+    command TEXT,
+    cwd TEXT,
+    working_dir TEXT,
+    hostname TEXT,
+    pid INTEGER,
+    started REAL,
+    finished REAL,
+    status TEXT,
+    exit_reason TEXT
+);
+CREATE TABLE IF NOT EXISTS subjects (
+    run_id TEXT,
+    subject TEXT,
+    status TEXT,
+    started REAL,
+    finished REAL,
+    hostname TEXT,
+    exit_reason TEXT,
+    PRIMARY KEY (run_id, subject)
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    run_id TEXT,
+    subject TEXT,
+    node TEXT,
+    status TEXT,
+    started REAL,
+    finished REAL,
+    hostname TEXT,
+    crash_file TEXT,
+    exit_reason TEXT,
+    PRIMARY KEY (run_id, subject, node)
+)
+"""
+
+
+def ledger_enabled():
+    return globals.cfg_parser.getboolean('LEDGER', 'enabled', fallback=False)
+
+
+def ledger_path():
+    return globals.cfg_parser.get('LEDGER', 'db_path', fallback='~/.cache/pumi/runs.sqlite')
+
+
+def node_subject(node):
+    """
+    Return the participant label of a node (from its '_subject_<label>' parameterization), or '' if it has none.
+    """
+    for param in node.parameterization or []:
+        match = re.match(r'_subject_(.+)', str(param))
+        if match:
+            return match.group(1)
+    return ''
+
+
+def exit_reason(error):
+    """
+    Short description of an exception: its type and the last non-empty line of its message (the messages of failed
+    commands contain their whole output).
+    """
+    lines = [line.strip() for line in str(error).splitlines() if line.strip()]
+    return (type(error).__name__ + (': ' + lines[-1] if lines else ''))[:500]
+
+
+def launch_command(argv=None, executable=None):
+    """
+    Return the command of a BIDS app launch without the participant selection (--participant_label, --shard), so that
+    it can be rerun on other participants. Scripts are run with the python interpreter.
+    """
+    argv = list(sys.argv if argv is None else argv)
+    command = [executable or sys.executable, argv[0]] if argv and argv[0].endswith('.py') else argv[:1]
+    i = 1
+    while i < len(argv):
+        option = argv[i].split('=', 1)[0]
+        i += 1
+        if option not in SUBJECT_OPTIONS:
+            command.append(argv[i - 1])
+        elif '=' not in argv[i - 1]:
+            n_values = SUBJECT_OPTIONS[option]
+            if n_values is None:  # nargs='+': all values until the next option
+                while i < len(argv) and not argv[i].startswith('-'):
+                    i += 1
+            else:
+                i += n_values
+    return command
+
+
+def workflow_completed(error):
+    """
+    Whether the error was raised by a nipype plugin after the workflow ran to its end with failed nodes: nipype
+    re-raises the first node error (with a summary RuntimeError if there were several), older versions raised
+    'Workflow did not execute cleanly'.
+    """
+    from nipype.pipeline.engine.nodes import NodeExecutionError
+
+    return isinstance(error, NodeExecutionError) or (
+        isinstance(error, RuntimeError) and any(message in str(error) for message in
+                                                ('did not execute cleanly', 'raised. Re-raising first')))
+
+
+class RunLedger:
+    """
+    SQLite database with the status of the BIDS app runs, their subjects and nodes: timestamps, host, crash file and
+    exit reason. Written by the engine (see record_run and track_node), read by pumi-runs.
+    """
+
+    def __init__(self, db_path, create=True):
+        self.db_path = os.path.abspath(os.path.expanduser(str(db_path)))
+        self._connections = {}
+        if create:  # once per run (see record_run), the node processes only connect
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            with self.connect() as con:
+                con.executescript(SCHEMA)
+
+    def connect(self):
+        # one connection per process and thread, reused for all records
+        key = (os.getpid(), threading.get_ident())
+        if key not in self._connections:
+            self._connections[key] = sqlite3.connect(self.db_path, timeout=60)
+        return self._connections[key]
+
+    def query(self, sql, params=()):
+        with self.connect() as con:
+            return con.execute(sql, params).fetchall()
+
+    def start_run(self, pipeline, subjects, working_dir, argv=None):
+        run_id = time.strftime('%Y%m%d-%H%M%S-') + uuid.uuid4().hex[:6]
+        now, hostname = time.time(), socket.gethostname()
+        with self.connect() as con:
+            con.execute('INSERT INTO runs (run_id, pipeline, command, cwd, working_dir, hostname, pid, started, status) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (run_id, pipeline, json.dumps(launch_command(argv)), os.getcwd(),
+                         os.path.abspath(working_dir), hostname, os.getpid(), now, 'running'))
+            con.executemany('INSERT INTO subjects (run_id, subject, status, started, hostname) VALUES (?, ?, ?, ?, ?)',
+                            [(run_id, subject, 'running', now, hostname) for subject in subjects])
+        return run_id
+
+    def finish_run(self, run_id, error=None):
+        """
+        Set the final status of a run and its subjects: subjects with a failed node are 'failed'. The others are
+        'done' if the workflow ran to its end (also if nodes of other subjects crashed), otherwise 'unfinished'.
+        """
+        failed = {}
+        for subject, node, reason in self.query('SELECT subject, node, exit_reason FROM nodes '
+                                                'WHERE run_id = ? AND status = ? ORDER BY finished',
+                                                (run_id, 'failed')):
+            failed.setdefault(subject, '%s: %s' % (node, reason))
+        completed = error is None or workflow_completed(error)
+        now = time.time()
+        with self.connect() as con:
+            for (subject,) in con.execute('SELECT subject FROM subjects WHERE run_id = ?', (run_id,)).fetchall():
+                if subject in failed:
+                    status, reason = 'failed', failed[subject]
+                elif completed:
+                    status, reason = 'done', None
+                else:
+                    status, reason = 'unfinished', exit_reason(error)
+                con.execute('UPDATE subjects SET status = ?, finished = ?, exit_reason = ? '
+                            'WHERE run_id = ? AND subject = ?', (status, now, reason, run_id, subject))
+            status = 'done' if error is None else 'failed' if completed else 'interrupted'
+            con.execute('UPDATE runs SET status = ?, finished = ?, exit_reason = ? WHERE run_id = ?',
+                        (status, now, None if error is None else exit_reason(error), run_id))
+
+    def record_node(self, run_id, node, status, **fields):
+        from PUMI.resources import node_path
+
+        row = {'run_id': run_id, 'subject': node_subject(node), 'node': node_path(node), 'status': status,
+               'hostname': socket.gethostname(), **fields}
+        with self.connect() as con:
+            con.execute('INSERT INTO nodes (%s) VALUES (%s) ON CONFLICT (run_id, subject, node) DO UPDATE SET %s'
+                        % (', '.join(row), ', '.join('?' * len(row)),
+                           ', '.join('%s = excluded.%s' % (column, column) for column in row)),
+                        list(row.values()))
+
+    def runs(self, top=20):
+        rows = self.query("""
+            SELECT r.run_id, r.pipeline, r.hostname, r.started, r.status, COUNT(s.subject),
+                   SUM(s.status = 'done'), SUM(s.status = 'failed'), SUM(s.status NOT IN ('done', 'failed'))
+            FROM runs r LEFT JOIN subjects s ON s.run_id = r.run_id
+            GROUP BY r.run_id ORDER BY r.started DESC LIMIT ?""", (top,))
+        return [{'run_id': run_id, 'pipeline': pipeline, 'host': host, 'started': _format_time(started),
+                 'status': status, 'subjects': n, 'done': done or 0, 'failed': failed or 0,
+                 'unfinished': unfinished or 0}
+                for run_id, pipeline, host, started, status, n, done, failed, unfinished in rows]
+
+    def launch(self, run_id=None):
+        """
+        Return the runs of the same launch as run_id (default: the most recent run): the runs with the same command
+        (apart from the participant selection) and working directory, e.g. the array tasks of a sharded run and its
+        retries. Oldest first.
+        """
+        rows = self.query('SELECT command, cwd FROM runs WHERE run_id = ?', (run_id,)) if run_id else \
+            self.query('SELECT command, cwd FROM runs ORDER BY started DESC LIMIT 1')
+        if not rows:
+            raise ValueError('No run %s in the ledger %s' % (run_id or '', self.db_path))
+        return [run for (run,) in self.query('SELECT run_id FROM runs WHERE command = ? AND cwd = ? ORDER BY started',
+                                             rows[0])]
+
+    def pending_subjects(self, run_id=None):
+        """
+        Return the subjects of a launch (see launch) whose latest status is not 'done', as
+        subject -> (status, run_id, host, exit_reason), with the failed nodes of their latest run as
+        subject -> list of (node, host, crash_file, exit_reason).
+        """
+        runs = self.launch(run_id)
+        latest = {}
+        for run in runs:
+            for subject, status, host, reason in self.query('SELECT subject, status, hostname, exit_reason '
+                                                            'FROM subjects WHERE run_id = ?', (run,)):
+                latest[subject] = (status, run, host, reason)
+        pending = {subject: state for subject, state in sorted(latest.items()) if state[0] != 'done'}
+        failed_nodes = {subject: self.query('SELECT node, hostname, crash_file, exit_reason FROM nodes '
+                                            'WHERE run_id = ? AND subject = ? AND status = ? ORDER BY finished',
+                                            (run, subject, 'failed'))
+                        for subject, (_, run, _, _) in pending.items()}
+        return pending, failed_nodes
+
+    def retry_command(self, run_id=None):
+        """
+        Return the command rerunning the failed or unfinished subjects of a launch (see pending_subjects) with the
+        same arguments, its working directory, and the subjects. The command is None if there is nothing to retry.
+        Completed nodes are not recomputed: the retry runs in the same working directory, where nipype finds them.
+        """
+        runs = self.launch(run_id)
+        command, cwd = self.query('SELECT command, cwd FROM runs WHERE run_id = ?', (runs[-1],))[0]
+        subjects = list(self.pending_subjects(runs[-1])[0])
+        if not subjects:
+            return None, cwd, subjects
+        return json.loads(command) + ['--participant_label'] + subjects, cwd, subjects
+
+
+def get_run_ledger():
+    """
+    Return the run ledger as configured in the [LEDGER] section of settings.ini, or None if disabled.
+    """
+    return RunLedger(ledger_path()) if ledger_enabled() else None
+
+
+@contextmanager
+def record_run(pipeline, subjects, working_dir):
+    """
+    Context manager that records a run of a BIDS pipeline and the final status of its subjects in the run ledger, if
+    enabled. The nodes executed during the run (also in other processes) record their status (see track_node).
+    """
+    try:
+        ledger = get_run_ledger()
+        run_id = ledger.start_run(pipeline, subjects, working_dir) if ledger is not None else None
+    except Exception as e:
+        print('[PUMI ledger] could not record the run: %s' % e)
+        ledger = run_id = None
+    if run_id is None:
+        yield None
+        return
+
+    print('[PUMI ledger] run %s (%s)' % (run_id, ledger.db_path))
+    previous = {variable: os.environ.get(variable) for variable in [RUN_ID_VARIABLE, LEDGER_VARIABLE]}
+    os.environ[RUN_ID_VARIABLE], os.environ[LEDGER_VARIABLE] = run_id, ledger.db_path
+    error = None
+    try:
+        yield run_id
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        for variable, value in previous.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+        try:
+            ledger.finish_run(run_id, error=error)
+        except Exception as e:
+            print('[PUMI ledger] could not record the end of run %s: %s' % (run_id, e))
+
+
+_ledgers = {}  # ledger path -> RunLedger used by the nodes of the process
+
+
+def _current_ledger():
+    run_id, db_path = os.environ.get(RUN_ID_VARIABLE), os.environ.get(LEDGER_VARIABLE)
+    if run_id is None or db_path is None:
+        return None, None
+    if db_path not in _ledgers:
+        _ledgers[db_path] = RunLedger(db_path, create=False)  # created by record_run
+    return _ledgers[db_path], run_id
+
+
+@contextmanager
+def track_node(node):
+    """
+    Context manager that records the execution of a node (running, done or failed with the exit reason) in the
+    ledger of the current run (see record_run). Recording never makes a node fail.
+    """
+    try:
+        ledger, run_id = _current_ledger()
+        if ledger is not None:
+            ledger.record_node(run_id, node, 'running', started=time.time(), finished=None, crash_file=None,
+                               exit_reason=None)
+    except Exception as e:
+        print('[PUMI ledger] could not record %s: %s' % (node.fullname, e))
+        ledger = None
+    if ledger is None:
+        yield
+        return
+
+    try:
+        yield
+    except BaseException as e:
+        _record_safely(ledger, run_id, node, 'failed', finished=time.time(), exit_reason=exit_reason(e))
+        raise
+    _record_safely(ledger, run_id, node, 'done', finished=time.time())
+
+
+def record_crash(node, crash_file):
+    """
+    Record the crash file of a failed node in the ledger of the current run (called by the plugin reporting it).
+    """
+    try:
+        ledger, run_id = _current_ledger()
+        if ledger is not None:
+            ledger.record_node(run_id, node, 'failed', crash_file=crash_file)
+    except Exception as e:
+        print('[PUMI ledger] could not record the crash of %s: %s' % (node.fullname, e))
+
+
+def _record_safely(ledger, run_id, node, status, **fields):
+    try:
+        ledger.record_node(run_id, node, status, **fields)
+    except Exception as e:
+        print('[PUMI ledger] could not record %s: %s' % (node.fullname, e))
+
+
+def _format_time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp)) if timestamp else ''
+
+
+def main():
+    from PUMI.profiling import _print_table
+
+    parser = argparse.ArgumentParser(description='List the failed subjects of PUMI runs and retry them.')
+    parser.add_argument('--db_path', help='Path to the run ledger. Default is db_path in the [LEDGER] section of '
+                                          'settings.ini.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = subparsers.add_parser('list', help='Most recent runs and the status of their subjects.')
+    list_parser.add_argument('--top', type=int, default=20, help='Number of runs to list.')
+
+    failed_parser = subparsers.add_parser('failed', help='Failed or unfinished subjects of a launch (the runs with '
+                                                         'the same arguments, e.g. all shards and retries), with '
+                                                         'the failed nodes, hosts, crash files and exit reasons.')
+    failed_parser.add_argument('--run', help='A run of the launch. Default is the most recent run.')
+
+    retry_parser = subparsers.add_parser('retry', help='Rerun the failed or unfinished subjects of a launch with the '
+                                                       'same arguments, in the same working directory (completed '
+                                                       'nodes are reused).')
+    retry_parser.add_argument('--run', help='A run of the launch. Default is the most recent run.')
+    retry_parser.add_argument('--print_only', action='store_true',
+                              help='Only print the command (e.g. to submit it as a Slurm job).')
+
+    args = parser.parse_args()
+    db_path = args.db_path or ledger_path()
+    if not os.path.exists(os.path.expanduser(db_path)):
+        parser.error('Run ledger %s does not exist.' % db_path)
+    ledger = RunLedger(db_path)
+
+    try:
+        if args.command == 'list':
+            rows = ledger.runs(top=args.top)
+            if not rows:
+                print('No runs recorded.')
+                return
+            _print_table(rows, ['run_id', 'pipeline', 'host', 'started', 'status', 'subjects', 'done', 'failed',
+                                'unfinished'])
+        elif args.command == 'failed':
+            pending, failed_nodes = ledger.pending_subjects(args.run)
+            if not pending:
+                print('No failed or unfinished subjects.')
+                return
+            rows = []
+            for subject, (status, run_id, host, reason) in pending.items():
+                for node, node_host, crash_file, node_reason in failed_nodes[subject] or [(None, host, None, reason)]:
+                    rows.append({'subject': subject, 'status': status, 'run_id': run_id, 'host': node_host or '',
+                                 'node': node or '', 'crash_file': crash_file or '', 'exit_reason': node_reason or ''})
+            _print_table(rows, ['subject', 'status', 'run_id', 'host', 'node', 'crash_file', 'exit_reason'])
+        elif args.command == 'retry':
+            command, cwd, subjects = ledger.retry_command(args.run)
+            if command is None:
+                print('No failed or unfinished subjects, nothing to retry.')
+                return
+            print('Retrying %d subject(s) in %s: %s' % (len(subjects), cwd, ' '.join(subjects)))
+            print(' '.join(shlex.quote(arg) for arg in command))
+            if not args.print_only:
+                sys.exit(subprocess.call(command, cwd=cwd))
+    except ValueError as e:
+        parser.error(str(e))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import os
+from functools import lru_cache
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+PROC_CGROUP = '/proc/self/cgroup'
+
+# cgroup v1 reports "no limit" as a huge number (close to 2^63, rounded to the page size)
+UNLIMITED_BYTES = 1 << 60
+
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_paths(proc_cgroup=PROC_CGROUP):
+    # controller -> path of the cgroup of this process ('' for the cgroup v2 hierarchy)
+    paths = {}
+    for line in (_read(proc_cgroup) or '').splitlines():
+        _, controllers, path = line.split(':', 2)
+        for controller in controllers.split(','):
+            paths[controller] = path
+    return paths
+
+
+def _candidate_dirs(base, path):
+    # the directory of the cgroup and its ancestors (the limits of the parents apply as well); inside a container,
+    # the cgroup of the process is often mounted as the root
+    dirs = []
+    path = path.strip('/')
+    while path:
+        dirs.append(os.path.join(base, path))
+        path = os.path.dirname(path)
+    dirs.append(base)
+    return [d for d in dirs if os.path.isdir(d)]
+
+
+def _v2_base(root):
+    for base in [root, os.path.join(root, 'unified')]:
+        if os.path.exists(os.path.join(base, 'cgroup.controllers')):
+            return base
+    return None
+
+
+def cgroup_cpu_limit(root=CGROUP_ROOT, proc_cgroup=PROC_CGROUP):
+    """
+    Return the CPU quota of the cgroup of this process (cgroup v2 cpu.max or v1 cpu.cfs_quota_us / cpu.cfs_period_us),
+    as a number of CPUs (may be fractional), or None if there is no quota.
+    """
+    paths = _cgroup_paths(proc_cgroup)
+    limits = []
+    v2_base = _v2_base(root)
+    if v2_base is not None and '' in paths:
+        for d in _candidate_dirs(v2_base, paths['']):
+            value = _read(os.path.join(d, 'cpu.max'))
+            if value and not value.startswith('max'):
+                quota, period = value.split()[:2]
+                limits.append(int(quota) / int(period))
+    for controller in ['cpu', 'cpu,cpuacct']:
+        if 'cpu' not in paths or not os.path.isdir(os.path.join(root, controller)):
+            continue
+        for d in _candidate_dirs(os.path.join(root, controller), paths['cpu']):
+            quota, period = _read(os.path.join(d, 'cpu.cfs_quota_us')), _read(os.path.join(d, 'cpu.cfs_period_us'))
+            if quota and period and int(quota) > 0:
+                limits.append(int(quota) / int(period))
+    return min(limits) if limits else None
+
+
+def cgroup_memory_limit_gb(root=CGROUP_ROOT, proc_cgroup=PROC_CGROUP):
+    """
+    Return the memory limit of the cgroup of this process (cgroup v2 memory.max or v1 memory.limit_in_bytes) in GB,
+    or None if there is no limit.
+    """
+    paths = _cgroup_paths(proc_cgroup)
+    limits = []
+    v2_base = _v2_base(root)
+    if v2_base is not None and '' in paths:
+        for d in _candidate_dirs(v2_base, paths['']):
+            value = _read(os.path.join(d, 'memory.max'))
+            if value and value != 'max':
+                limits.append(int(value))
+    if 'memory' in paths and os.path.isdir(os.path.join(root, 'memory')):
+        for d in _candidate_dirs(os.path.join(root, 'memory'), paths['memory']):
+            value = _read(os.path.join(d, 'memory.limit_in_bytes'))
+            if value and 0 < int(value) < UNLIMITED_BYTES:
+                limits.append(int(value))
+    return min(limits) / 1024 ** 3 if limits else None
+
+
+def affinity_cpus():
+    """
+    Return the number of CPUs this process may run on (affinity mask, e.g. set by Slurm or taskset).
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS
+        return os.cpu_count() or 1
+
+
+def host_memory_gb():
+    """
+    Return the total memory of the host in GB (None if unknown).
+    """
+    for line in (_read('/proc/meminfo') or '').splitlines():
+        if line.startswith('MemTotal:'):
+            return int(line.split()[1]) / 1024 ** 2
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 ** 3
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def effective_limits(root=CGROUP_ROOT, proc_cgroup=PROC_CGROUP):
+    """
+    Detect the CPUs and memory actually available to this process, e.g. inside a Docker or Singularity container with
+    cgroup quotas or in a Slurm job: the CPUs of the affinity mask limited by the cgroup CPU quota, and the host memory
+    limited by the cgroup memory limit.
+
+    Returns:
+        limits (dict): 'n_procs' (int), 'memory_gb' (float or None) and 'description' (str).
+    """
+    cpus = affinity_cpus()
+    cpu_quota = cgroup_cpu_limit(root, proc_cgroup)
+    n_procs = min(cpus, max(int(cpu_quota), 1)) if cpu_quota is not None else cpus
+
+    host_gb = host_memory_gb()
+    cgroup_gb = cgroup_memory_limit_gb(root, proc_cgroup)
+    memory_gb = min(gb for gb in [host_gb, cgroup_gb] if gb is not None) if (host_gb or cgroup_gb) else None
+
+    def gb(value, default):
+        return '%.1f GB' % value if value is not None else default
+
+    description = 'CPUs: %d (affinity mask: %d, cgroup quota: %s, host: %d), memory: %s (cgroup limit: %s, host: %s)' \
+                  % (n_procs, cpus, '%.2f' % cpu_quota if cpu_quota is not None else 'none', os.cpu_count() or 1,
+                     gb(memory_gb, 'unknown'), gb(cgroup_gb, 'none'), gb(host_gb, 'unknown'))
+    return {'n_procs': n_procs, 'memory_gb': memory_gb, 'description': description}
+
+
+@lru_cache(maxsize=None)
+def effective_cpus():
+    """
+    Number of CPUs available to this process (see effective_limits), determined once per process.
+    """
+    return effective_limits()['n_procs']
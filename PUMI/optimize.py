@@ -0,0 +1,236 @@
+import ast
+import re
+import textwrap
+
+from nipype.interfaces.utility import Function
+from nipype.pipeline.engine import MapNode, JoinNode
+
+INLINE_SOURCE = """def pumi_inline(value):
+{function}
+    kwargs = {kwargs}
+    kwargs[{input_name}] = value
+    return {function_name}(**kwargs){index}
+"""
+
+
+def _is_literal(value):
+    try:
+        return ast.literal_eval(repr(value)) == value
+    except (ValueError, SyntaxError):
+        return False
+
+
+def _fuse(graph, node):
+    # replace the edges upstream -> node -> consumers by upstream -> consumers with a connect function
+    in_edges = list(graph.in_edges(node, data=True))
+    if len(in_edges) != 1 or len(in_edges[0][2]['connect']) != 1:
+        return False
+    upstream, _, data = in_edges[0]
+    source, input_name = data['connect'][0]
+    if isinstance(source, tuple):
+        return False
+
+    function_str = textwrap.dedent(node.interface.inputs.function_str)
+    match = re.match(r'def\s+(\w+)', function_str)
+    kwargs = {name: value for name, value in node.inputs.get_traitsfree().items()
+              if name not in ['function_str', input_name]}
+    out_edges = list(graph.out_edges(node, data=True))
+    if match is None or not all(_is_literal(value) for value in kwargs.values()) or \
+            any(isinstance(src, tuple) for _, _, d in out_edges for src, _ in d['connect']):
+        return False
+
+    output_names = node.interface._output_names
+    for _, consumer, d in out_edges:
+        connect = graph.get_edge_data(upstream, consumer, default={'connect': []})['connect']
+        for output_name, consumer_input in d['connect']:
+            index = '[%d]' % output_names.index(output_name) if len(output_names) > 1 else ''
+            inline_source = INLINE_SOURCE.format(function=textwrap.indent(function_str, '    '), kwargs=repr(kwargs),
+                                                 input_name=repr(input_name), function_name=match.group(1),
+                                                 index=index)
+            connect.append(((source, inline_source, ()), consumer_input))
+        graph.add_edge(upstream, consumer, connect=connect)
+    graph.remove_node(node)
+    return True
+
+
+def inline_function_nodes(graph):
+    """
+    Evaluate the Function nodes marked as inline (node.inline = True) without running them as separate jobs.
+    Such functions must be cheap and must not write files (e.g. reading a header or converting a value).
+
+    A node with a single connected input is fused into its consumers: the function becomes a connect function,
+    evaluated when the consumers retrieve their inputs, so the node needs no working directory, hashing, result file
+    or scheduler slot. Other inline nodes are run in the scheduler process (run_without_submitting).
+
+    Parameters:
+        graph (networkx.DiGraph): Expanded execution graph (without identity nodes), modified in place.
+
+    Returns:
+        n_fused (int): Number of nodes removed from the graph.
+    """
+    n_fused = 0
+    for node in list(graph.nodes()):
+        if not getattr(node, 'inline', False) or not isinstance(node.interface, Function):
+            continue
+        if not isinstance(node, (MapNode, JoinNode)) and _fuse(graph, node):
+            n_fused += 1
+        else:
+            node.run_without_submitting = True
+    return n_fused
+
+
+# Interfaces with side effects, their nodes are never merged
+UNMERGEABLE_INTERFACES = ['DataSink', 'LinkDataSink', 'BIDSDataGrabber']
+
+
+def _node_signature(graph, node):
+    # identical signatures: same kind of node and interface, same static inputs, same upstream connections and same
+    # scheduling attributes (resources, plugin arguments, keep/inline flags)
+    connected, upstream = set(), []
+    for u, _, data in graph.in_edges(node, data=True):
+        for source, dest in data['connect']:
+            connected.add(dest)
+            upstream.append((id(u), repr(source), dest))
+    static = {name: value for name, value in node.inputs.get_traitsfree().items() if name not in connected}
+    return (type(node).__name__, type(node.interface).__module__ + '.' + type(node.interface).__name__,
+            tuple(getattr(node, 'iterfield', None) or ()), node.overwrite, repr(sorted(static.items())),
+            tuple(sorted(upstream)), getattr(node, '_n_procs', None), getattr(node, '_mem_gb', None),
+            node.run_without_submitting, repr(sorted((node.plugin_args or {}).items())), getattr(node, 'keep', False),
+            getattr(node, 'inline', False))
+
+
+def merge_duplicate_nodes(graph):
+    """
+    Common subexpression elimination: merge nodes that compute the same thing, i.e. nodes with the same interface,
+    the same static inputs and the same connections from the same upstream nodes (e.g. pick_volume subworkflows
+    picking the same volume of the same image for processing and for QC). Merging propagates downstream.
+    Nodes with iterables, JoinNodes, always-run interfaces and sinkers/grabbers are never merged.
+
+    Parameters:
+        graph (networkx.DiGraph): Flat workflow graph, modified in place.
+
+    Returns:
+        n_merged (int): Number of nodes removed from the graph.
+    """
+    import networkx as nx
+
+    seen, n_merged = {}, 0
+    for node in list(nx.topological_sort(graph)):  # upstream duplicates are merged first
+        if node.iterables or isinstance(node, JoinNode) or node.interface.always_run or \
+                type(node.interface).__name__ in UNMERGEABLE_INTERFACES:
+            continue
+        signature = _node_signature(graph, node)
+        kept = seen.setdefault(signature, node)
+        if kept is node:
+            continue
+        for _, consumer, data in list(graph.out_edges(node, data=True)):
+            connect = graph.get_edge_data(kept, consumer, default={'connect': []})['connect']
+            graph.add_edge(kept, consumer, connect=connect + [c for c in data['connect'] if c not in connect])
+        graph.remove_node(node)
+        n_merged += 1
+    return n_merged
+
+
+# Outputs that can be switched off: interface key (see PUMI.resources.interface_key) -> list of
+# (outputs, input, value of the input that switches the outputs off)
+OPTIONAL_OUTPUTS = {
+    'fsl.FAST': [
+        (['tissue_class_files'], 'segments', False),
+        (['probability_maps'], 'probability_maps', False),
+        (['partial_volume_files', 'partial_volume_map', 'mixeltype'], 'no_pve', True),
+        (['restored_image'], 'output_biascorrected', False),
+        (['bias_field'], 'output_biasfield', False),
+    ],
+    'fsl.MCFLIRT': [
+        (['mat_file'], 'save_mats', False),
+        (['par_file'], 'save_plots', False),
+        (['rms_files'], 'save_rms', False),
+    ],
+}
+
+
+def _is_root(graph, node, top):
+    # nodes whose results are used outside of the graph: connected sinkers, the outputspec of the workflow that is run,
+    # the connected fields of the outputspecs of the nested pipelines and nodes marked with node.keep = True
+    from nipype.interfaces.io import DataSink
+    if isinstance(node.interface, DataSink):
+        return graph.in_degree(node) > 0 or bool(node.inputs._outputs)
+    if node.name == 'outputspec':
+        return node._hierarchy == top or graph.in_degree(node) > 0
+    return getattr(node, 'keep', False)
+
+
+def prune_dead_nodes(graph, top):
+    """
+    Remove the nodes whose outputs reach no outputspec (of the workflow that is run or of a nested pipeline) and no
+    connected sinker (e.g. sinkers without connections or branches that are built but never used), and the
+    connections to fields of inputspec nodes that are not used further. Nodes can be kept explicitly with
+    node.keep = True. Nothing is removed if the graph has none of these (e.g. a plain workflow without pipelines).
+
+    Parameters:
+        graph (networkx.DiGraph): Flat workflow graph (with the identity nodes), modified in place.
+        top (str): Name of the workflow that is run.
+
+    Returns:
+        n_pruned (int): Number of nodes removed from the graph.
+    """
+    import networkx as nx
+    from nipype.interfaces.utility import IdentityInterface
+
+    if not any(_is_root(graph, node, top) for node in graph.nodes()):
+        return 0
+
+    live, live_fields = set(), {}  # live_fields: used fields of the identity nodes
+    for node in reversed(list(nx.topological_sort(graph))):
+        identity = isinstance(node.interface, IdentityInterface)
+        if _is_root(graph, node, top):
+            live.add(node)
+            live_fields[node] = None  # all fields
+            continue
+        used = set()
+        for _, consumer, data in graph.out_edges(node, data=True):
+            for source, dest in data['connect']:
+                if consumer in live and (live_fields.get(consumer) is None or dest in live_fields[consumer]):
+                    used.add(source[0] if isinstance(source, tuple) else source)
+        if used:
+            live.add(node)
+            live_fields[node] = used if identity else None
+
+    # connections to unused fields
+    for u, v, data in list(graph.edges(data=True)):
+        if v in live and live_fields[v] is not None:
+            data['connect'] = [(source, dest) for source, dest in data['connect'] if dest in live_fields[v]]
+            if not data['connect']:
+                graph.remove_edge(u, v)
+
+    dead = [node for node in graph.nodes() if node not in live]
+    graph.remove_nodes_from(dead)
+    return len(dead)
+
+
+def disable_unused_outputs(graph):
+    """
+    Switch off the generation of outputs that are not connected, for the interfaces listed in OPTIONAL_OUTPUTS
+    (e.g. the partial volume files and the mixeltype of FAST). Run it after prune_dead_nodes.
+
+    Parameters:
+        graph (networkx.DiGraph): Flat workflow graph, modified in place.
+
+    Returns:
+        n_disabled (int): Number of inputs changed.
+    """
+    from PUMI.resources import interface_key
+
+    n_disabled = 0
+    for node in graph.nodes():
+        optional = OPTIONAL_OUTPUTS.get(interface_key(node.interface))
+        if not optional or getattr(node, 'keep', False):
+            continue
+        connected = {source[0] if isinstance(source, tuple) else source
+                     for _, _, data in graph.out_edges(node, data=True) for source, _ in data['connect']}
+        for outputs, input_name, off in optional:
+            produced = (getattr(node.inputs, input_name) is True) != off
+            if produced and not connected.intersection(outputs):
+                setattr(node.inputs, input_name, off)
+                n_disabled += 1
+    return n_disabled
@@ -112,6 +112,7 @@ def func2anat(wf, func_volume='middle', bbr=True, **kwargs):
                                                         output_names=["arg"],
                                                         function=bbreg_args),
                                      name="bbr_arg_converter")
+            bbreg_arg_convert.inline = True
             wf.connect('inputspec', 'anat_wm_segmentation', bbreg_arg_convert, 'bbreg_target')
 
             # BBR registration within the FLIRT node
@@ -128,6 +128,7 @@ def compcor(wf, volume='first', **kwargs):
         ),
         name='time_repetition'
     )
+    time_repetition.inline = True
     wf.connect('inputspec', 'func_aligned', time_repetition, 'in_file')
 
     compcor = Node(
@@ -151,6 +152,7 @@ def compcor(wf, volume='first', **kwargs):
         ),
         name='drop_first_line'
     )
+    drop_first_line.run_without_submitting = True  # cheap, but writes a file: can not be inline
     wf.connect(compcor, 'components_file', drop_first_line, 'in_file')
 
     # qc
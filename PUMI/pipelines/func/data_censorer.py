@@ -2,7 +2,7 @@ from nipype.interfaces import utility
 
 from PUMI.engine import FuncPipeline, NestedNode as Node, QcPipeline
 from PUMI.pipelines.multimodal.image_manipulation import timecourse2png
-from PUMI.utils import get_indx, scrub_image, above_threshold
+from PUMI.utils import scrub_image_native, above_threshold
 
 
 @QcPipeline(inputspec_fields=['scrubbed_image'],
@@ -83,29 +83,17 @@ def datacens_workflow_threshold(wf, ex_before=1, ex_after=2, **kwargs):
     wf.connect('inputspec', 'FD', above_thr, 'in_file')
     wf.connect('inputspec', 'threshold', above_thr, 'threshold')
 
-    # Generate the weird input for the scrubbing procedure which is done in afni
-    craft_scrub_input = Node(
-        utility.Function(
-            input_names=['scrub_input', 'frames_in_1D_file'],
-            output_names=['scrub_input_string'],
-            function=get_indx
-        ),
-        name='scrubbing_craft_input_string'
-    )
-    wf.connect(above_thr, 'frames_in_idx', craft_scrub_input, 'frames_in_1D_file')
-    wf.connect('inputspec', 'func', craft_scrub_input, 'scrub_input')
-
-    # Scrub the image
+    # Scrub the image (in-process, only the retained volumes are read and written)
     scrubbed_preprocessed = Node(
         utility.Function(
-            input_names=['scrub_input'],
+            input_names=['in_file', 'frames_in_idx'],
             output_names=['scrubbed_image'],
-            function=scrub_image
+            function=scrub_image_native
         ),
         name='scrubbed_preprocessed'
     )
-
-    wf.connect(craft_scrub_input, 'scrub_input_string', scrubbed_preprocessed, 'scrub_input')
+    wf.connect('inputspec', 'func', scrubbed_preprocessed, 'in_file')
+    wf.connect(above_thr, 'frames_in_idx', scrubbed_preprocessed, 'frames_in_idx')
 
     # qc
     myqc = qc_datacens('myqc_datacens')
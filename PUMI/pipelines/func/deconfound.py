@@ -1,11 +1,10 @@
 from nipype import Function
-from nipype.algorithms import confounds
 from nipype.interfaces import afni, fsl, utility
 from PUMI.engine import NestedNode as Node, QcPipeline
 from PUMI.engine import FuncPipeline
 from PUMI.pipelines.anat.segmentation import bet_deepbet
 from PUMI.pipelines.multimodal.image_manipulation import pick_volume, timecourse2png
-from PUMI.utils import calc_friston_twenty_four, calculate_FD_Jenkinson, mean_from_txt, max_from_txt
+from PUMI.utils import motion_metrics
 from PUMI.plot.carpet_plot import plot_carpet
 
 
@@ -247,6 +246,7 @@ def fieldmap_correction_topup(wf, num_volumes=5, **kwargs):
         function=combine_items_to_list),
         name='avg_volumes_to_list'
     )
+    avg_volumes_to_list.inline = True
     wf.connect(mean_main, 'out_file', avg_volumes_to_list, 'item_1')
     wf.connect(mean_fmap, 'out_file', avg_volumes_to_list, 'item_2')
 
@@ -495,7 +495,9 @@ def motion_correction_mcflirt(wf, reference_vol='middle', FD_mode='Power', **kwa
         - absolute and relative displacement parameters
         - friston24 parameters
         - FD
+        - FDmedian
         - FDmax
+        - FDpercent_above (percentage of volumes with FD above 0.2 mm)
         - quality check images (FD/rotations/translations and timeseries plot)
 
     Acknowledgements:
@@ -525,60 +527,19 @@ def motion_correction_mcflirt(wf, reference_vol='middle', FD_mode='Power', **kwa
     if reference_vol != "mean":
         wf.connect(refvol, 'out_file', mcflirt, 'ref_file')
 
-    calc_friston = Node(
+    # friston24, FD (Power and Jenkinson) and FD statistics
+    calc_motion_metrics = Node(
         utility.Function(
-            input_names=['in_file'], output_names=['out_file'],
-            function=calc_friston_twenty_four
+            input_names=['in_file', 'fd_mode', 'threshold', 'save_plot'],
+            output_names=['friston24_file', 'fd_file', 'fd_power_file', 'fd_jenkinson_file', 'mean_fd_file',
+                          'median_fd_file', 'max_fd_file', 'percent_above_file', 'fd_figure'],
+            function=motion_metrics
         ),
-        name='calc_friston'
+        name='motion_metrics'
     )
-    wf.connect(mcflirt, 'par_file', calc_friston, 'in_file')
-
-    if FD_mode == "Power":
-        calculate_FD = Node(
-            confounds.FramewiseDisplacement(
-                parameter_source='FSL',
-                save_plot=True,
-                out_figure='fd_power_2012.png'
-            ),
-            name='calculate_FD_Power'
-        )
-    elif FD_mode == "Jenkinson":
-        calculate_FD = Node(
-            utility.Function(
-                input_names=['in_file'],
-                output_names=['out_file'],
-                function=calculate_FD_Jenkinson
-            ),
-            name='calculate_FD_Jenkinson'
-        )
-    wf.connect(mcflirt, 'par_file', calculate_FD, 'in_file')
-
-    mean_FD = Node(
-        utility.Function(
-            input_names=['in_file', 'axis', 'header', 'out_file'],
-            output_names=['mean_file'],
-            function=mean_from_txt
-        ),
-        name='meanFD'
-    )
-    mean_FD.inputs.axis = 0  # global mean
-    mean_FD.inputs.header = True  # global mean
-    mean_FD.inputs.out_file = 'FD.txt'
-    wf.connect(calculate_FD, 'out_file', mean_FD, 'in_file')
-
-    max_FD = Node(
-        utility.Function(
-            input_names=['in_file', 'axis', 'header', 'out_file'],
-            output_names=['max_file'],
-            function=max_from_txt
-        ),
-        name='maxFD'
-    )
-    max_FD.inputs.axis = 0  # global mean
-    max_FD.inputs.header = True
-    max_FD.inputs.out_file = 'FDmax.txt'
-    wf.connect(calculate_FD, 'out_file', max_FD, 'in_file')
+    calc_motion_metrics.inputs.fd_mode = FD_mode
+    calc_motion_metrics.inputs.save_plot = True
+    wf.connect(mcflirt, 'par_file', calc_motion_metrics, 'in_file')
 
     plot_motion_rot = Node(
         interface=fsl.PlotMotionParams(in_source='fsl'),
@@ -595,23 +556,25 @@ def motion_correction_mcflirt(wf, reference_vol='middle', FD_mode='Power', **kwa
     qc_mc = qc_motion_correction_mcflirt('qc_mc')
     wf.connect(plot_motion_rot, 'out_file', qc_mc, 'motion_correction')
     wf.connect(plot_motion_trans, 'out_file', qc_mc, 'plot_motion_trans')
-    wf.connect(calculate_FD, 'out_figure', qc_mc, 'FD_figure')
+    wf.connect(calc_motion_metrics, 'fd_figure', qc_mc, 'FD_figure')
     wf.connect(mcflirt, 'out_file', qc_mc, 'func')
 
     # sinking
     wf.connect(mcflirt, 'out_file', 'sinker', 'mc_func')
     wf.connect(mcflirt, 'par_file', 'sinker', 'mc_par')
     wf.connect(mcflirt, 'rms_files', 'sinker', 'mc_rms')
-    wf.connect(calc_friston, 'out_file', 'sinker', 'mc_first24')
-    wf.connect(mean_FD, 'mean_file', 'sinker', 'FD')
-    wf.connect(max_FD, 'max_file', 'sinker', 'FDmax')
+    wf.connect(calc_motion_metrics, 'friston24_file', 'sinker', 'mc_first24')
+    wf.connect(calc_motion_metrics, 'mean_fd_file', 'sinker', 'FD')
+    wf.connect(calc_motion_metrics, 'median_fd_file', 'sinker', 'FDmedian')
+    wf.connect(calc_motion_metrics, 'max_fd_file', 'sinker', 'FDmax')
+    wf.connect(calc_motion_metrics, 'percent_above_file', 'sinker', 'FDpercent_above')
 
     # output
     wf.connect(mcflirt, 'out_file', 'outputspec', 'func_out_file')
     wf.connect(mcflirt, 'mat_file', 'outputspec', 'mat_file')
     wf.connect(mcflirt, 'par_file', 'outputspec', 'mc_par_file')
-    wf.connect(calculate_FD, 'out_file', 'outputspec', 'FD_file')
-    wf.connect(calc_friston, 'out_file', 'outputspec', 'friston24_file')
+    wf.connect(calc_motion_metrics, 'fd_file', 'outputspec', 'FD_file')
+    wf.connect(calc_motion_metrics, 'friston24_file', 'outputspec', 'friston24_file')
     wf.connect(refvol, 'out_file', 'outputspec', 'mc_ref_vol')
 
 
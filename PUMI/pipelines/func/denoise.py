@@ -0,0 +1,97 @@
+from nipype.interfaces import utility
+
+from PUMI.engine import FuncPipeline, NestedNode as Node
+from PUMI.pipelines.func.compcor import compcor_qc
+from PUMI.pipelines.func.data_censorer import qc_datacens
+from PUMI.pipelines.func.temporal_filtering import qc_temporal_filtering
+from PUMI.utils import denoise_func
+
+
+@FuncPipeline(inputspec_fields=['func', 'cc_noise_roi', 'friston24', 'FD'],
+              outputspec_fields=['out_file', 'scrubbed_image', 'compcor_file', 'FD_scrubbed'])
+def denoise(wf, highpass=0.008, lowpass=0.08, num_components=5, fwhm=0, threshold=0.2, ex_before=0, ex_after=0,
+            volume='first', **kwargs):
+    """
+
+    Fused denoising stage: aCompCor, nuisance regression (compcor + Friston-24), optional smoothing, temporal
+    bandpass filtering and data censoring in one in-memory step (see PUMI.utils.denoise_func).
+    Replaces the chain compcor -> concat -> nuisance_removal -> (smoothing) -> temporal_filtering ->
+    datacens_workflow_threshold, without writing the intermediate 4D images.
+
+    Parameters:
+        highpass (float): Highpass cutoff in Hz.
+        lowpass (float): Lowpass cutoff in Hz.
+        num_components (int): Number of compcor components.
+        fwhm (float): FWHM of the smoothing kernel in mm. No smoothing if 0.
+        threshold (float): FD threshold for the data censoring.
+        ex_before (int): Number of volumes to exclude before a high-FD volume.
+        ex_after (int): Number of volumes to exclude after a high-FD volume.
+        volume (str): Select which volume of the functional image should be used for the compcor quality check image.
+                      Can be either 'first', 'middle', 'last', 'mean' or an arbitrary number
+
+    Inputs:
+        func (str): Reoriented, realigned (and despiked) functional image
+        cc_noise_roi (str): Noise ROI for aCompCor
+        friston24 (str): Friston-24 motion parameters
+        FD (str): Framewise displacement
+
+    Outputs:
+        out_file (str): Denoised functional image
+        scrubbed_image (str): Denoised and scrubbed functional image
+        compcor_file (str): Text file containing the noise components
+        FD_scrubbed (str): FD of the retained volumes
+
+    Sinking:
+        - Text file containing the noise components
+        - Denoised functional image
+        - Denoised and scrubbed functional image
+        - FD of the retained volumes and percentage of scrubbed volumes
+        - quality check images
+
+    """
+
+    denoise_node = Node(
+        utility.Function(
+            input_names=['in_file', 'noise_roi', 'friston24_file', 'fd_file', 'fd_threshold', 'frames_before',
+                         'frames_after', 'highpass', 'lowpass', 'num_components', 'fwhm'],
+            output_names=['out_file', 'scrubbed_image', 'compcor_file', 'fd_scrubbed_file', 'percent_scrubbed_file'],
+            function=denoise_func
+        ),
+        name='denoise'
+    )
+    denoise_node.inputs.fd_threshold = threshold
+    denoise_node.inputs.frames_before = ex_before
+    denoise_node.inputs.frames_after = ex_after
+    denoise_node.inputs.highpass = highpass
+    denoise_node.inputs.lowpass = lowpass
+    denoise_node.inputs.num_components = num_components
+    denoise_node.inputs.fwhm = fwhm
+    wf.connect('inputspec', 'func', denoise_node, 'in_file')
+    wf.connect('inputspec', 'cc_noise_roi', denoise_node, 'noise_roi')
+    wf.connect('inputspec', 'friston24', denoise_node, 'friston24_file')
+    wf.connect('inputspec', 'FD', denoise_node, 'fd_file')
+
+    # qc
+    qc_compcor = compcor_qc('qc_compcor', volume=volume)
+    wf.connect('inputspec', 'func', qc_compcor, 'func_aligned')
+    wf.connect('inputspec', 'cc_noise_roi', qc_compcor, 'mask_file')
+
+    qc_tmpfilt = qc_temporal_filtering('qc_tmpfilt')
+    wf.connect(denoise_node, 'out_file', qc_tmpfilt, 'in_file')
+
+    qc_scrub = qc_datacens('qc_datacens')
+    wf.connect(denoise_node, 'scrubbed_image', qc_scrub, 'scrubbed_image')
+
+    # output
+    wf.connect(denoise_node, 'out_file', 'outputspec', 'out_file')
+    wf.connect(denoise_node, 'scrubbed_image', 'outputspec', 'scrubbed_image')
+    wf.connect(denoise_node, 'compcor_file', 'outputspec', 'compcor_file')
+    wf.connect(denoise_node, 'fd_scrubbed_file', 'outputspec', 'FD_scrubbed')
+
+    # sinking
+    wf.connect(denoise_node, 'compcor_file', 'sinker', 'compcor_noise')
+    wf.connect('inputspec', 'cc_noise_roi', 'sinker', 'compcor_noise_mask')
+    wf.connect(denoise_node, 'out_file', 'sinker', 'func_denoised')
+    wf.connect(denoise_node, 'scrubbed_image', 'sinker', 'scrubbed_image')
+    wf.connect(denoise_node, 'fd_scrubbed_file', 'sinker', 'FD_scrubbed')
+    wf.connect(denoise_node, 'percent_scrubbed_file', 'sinker', 'percentFD')
@@ -81,6 +81,7 @@ def func2standard(wf, stdreg='ants', interp='NearestNeighbor', **kwargs):
                 function=lambda trf_first, trf_second: [trf_first, trf_second]
             ), name="collect_trf"
         )
+        transform_list.inline = True
         wf.connect(bbr2ants, 'itk_transform', transform_list, 'trf_second')
         #wf.connect('inputspec', 'linear_reg_mtrx', transform_list, 'trf_second')
         wf.connect('inputspec', 'nonlinear_reg_mtrx', transform_list, 'trf_first')
@@ -188,6 +189,7 @@ def atlas2func(wf, stdreg='ants', interp="NearestNeighbor", **kwargs):
                 function=lambda trf_first, trf_second: [trf_second, trf_first]
             ), name="collect_trf"
         )
+        transform_list.inline = True
         wf.connect(bbr2ants, 'itk_transform', transform_list, 'trf_second')
         wf.connect('inputspec', 'inv_nonlinear_reg_mtrx', transform_list, 'trf_first')
 
@@ -5,12 +5,14 @@ from PUMI.pipelines.func.compcor import compcor
 from PUMI.pipelines.func.concat import concat
 from PUMI.pipelines.func.data_censorer import datacens_workflow_threshold
 from PUMI.pipelines.func.deconfound import motion_correction_mcflirt, nuisance_removal
+from PUMI.pipelines.func.denoise import denoise
 from PUMI.pipelines.func.temporal_filtering import temporal_filtering
 
 
 @FuncPipeline(inputspec_fields=['func', 'cc_noise_roi'],
               outputspec_fields=['func_preprocessed', 'func_preprocessed_scrubbed', 'FD', 'mc_ref_vol'])
-def func_proc_despike_afni(wf, bet_tool='FSL', deepbet_n_dilate=0, stdrefvol='middle', fwhm=0, carpet_plot='', **kwargs):
+def func_proc_despike_afni(wf, bet_tool='FSL', deepbet_n_dilate=0, stdrefvol='middle', fwhm=0, carpet_plot='',
+                           native_denoise=False, **kwargs):
 
     """
 
@@ -24,6 +26,9 @@ def func_proc_despike_afni(wf, bet_tool='FSL', deepbet_n_dilate=0, stdrefvol='mi
         stdrefvol (str): Reference volume (e.g., 'first', 'middle', 'last').
         fwhm (str): Full Width at Half Maximum (FWHM) value.
         carpet_plot (bool): Set to True to generate carpet plots.
+        native_denoise (bool): Set to True to run compcor, nuisance removal, smoothing, temporal filtering and data
+                               censoring as one in-memory step (see PUMI.pipelines.func.denoise) instead of the
+                               FSL/AFNI chain.
 
     Inputs:
         func (str): Path to reoriented functional image.
@@ -63,36 +68,47 @@ def func_proc_despike_afni(wf, bet_tool='FSL', deepbet_n_dilate=0, stdrefvol='mi
     despike_wf = Node(afni.Despike(outputtype="NIFTI_GZ"), name="despike_wf")
     wf.connect(motion_correction_mcflirt_wf, 'func_out_file', despike_wf, 'in_file')
 
-    compcor_wf = compcor('compcor_wf') # to  WM+CSF signal
-    wf.connect(despike_wf, 'out_file', compcor_wf, 'func_aligned')
-    wf.connect('inputspec', 'cc_noise_roi', compcor_wf, 'mask_file')
-
-    concat_wf = concat('concat_wf')
-    wf.connect(compcor_wf, 'out_file', concat_wf, 'par1')
-    wf.connect(motion_correction_mcflirt_wf, 'friston24_file', concat_wf, 'par2')
-
-    nuisance_removal_wf = nuisance_removal('nuisance_removal_wf') # regress out 5 compcor variables and the Friston24
-    wf.connect(concat_wf, 'concat_file', nuisance_removal_wf, 'design_file')
-    wf.connect(despike_wf, 'out_file', nuisance_removal_wf, 'in_file')
-
-    # optional smoother:
-    if fwhm > 0:
-        smoother = Node(interface=fsl.Smooth(fwhm=fwhm), name="smoother")
-        wf.connect(nuisance_removal_wf, 'out_file', smoother, 'in_file')
-
-    temportal_filtering_wf = temporal_filtering('temportal_filtering_wf')
-    temportal_filtering_wf.get_node('inputspec').inputs.highpass = 0.008
-    temportal_filtering_wf.get_node('inputspec').inputs.lowpass = 0.08
-    if fwhm > 0:
-        wf.connect(smoother, 'smoothed_file', temportal_filtering_wf, 'func')
+    if native_denoise:
+        denoise_wf = denoise('denoise_wf', fwhm=fwhm, highpass=0.008, lowpass=0.08, ex_before=0, ex_after=0)
+        wf.connect(despike_wf, 'out_file', denoise_wf, 'func')
+        wf.connect('inputspec', 'cc_noise_roi', denoise_wf, 'cc_noise_roi')
+        wf.connect(motion_correction_mcflirt_wf, 'friston24_file', denoise_wf, 'friston24')
+        wf.connect(motion_correction_mcflirt_wf, 'FD_file', denoise_wf, 'FD')
+        wf.connect(denoise_wf, 'scrubbed_image', 'outputspec', 'func_preprocessed_scrubbed')
+        wf.connect(denoise_wf, 'out_file', 'outputspec', 'func_preprocessed')
     else:
-        wf.connect(nuisance_removal_wf, 'out_file', temportal_filtering_wf, 'func')
-
-    datacens_workflow_threshold_wf = datacens_workflow_threshold('datacens_workflow_threshold_wf',
-                                                                 ex_before=0,
-                                                                 ex_after=0)
-    wf.connect(motion_correction_mcflirt_wf, 'FD_file', datacens_workflow_threshold_wf, 'FD')
-    wf.connect(temportal_filtering_wf, 'out_file', datacens_workflow_threshold_wf, 'func')
+        compcor_wf = compcor('compcor_wf') # to  WM+CSF signal
+        wf.connect(despike_wf, 'out_file', compcor_wf, 'func_aligned')
+        wf.connect('inputspec', 'cc_noise_roi', compcor_wf, 'mask_file')
+
+        concat_wf = concat('concat_wf')
+        wf.connect(compcor_wf, 'out_file', concat_wf, 'par1')
+        wf.connect(motion_correction_mcflirt_wf, 'friston24_file', concat_wf, 'par2')
+
+        nuisance_removal_wf = nuisance_removal('nuisance_removal_wf') # regress out 5 compcor variables and the Friston24
+        wf.connect(concat_wf, 'concat_file', nuisance_removal_wf, 'design_file')
+        wf.connect(despike_wf, 'out_file', nuisance_removal_wf, 'in_file')
+
+        # optional smoother:
+        if fwhm > 0:
+            smoother = Node(interface=fsl.Smooth(fwhm=fwhm), name="smoother")
+            wf.connect(nuisance_removal_wf, 'out_file', smoother, 'in_file')
+
+        temportal_filtering_wf = temporal_filtering('temportal_filtering_wf')
+        temportal_filtering_wf.get_node('inputspec').inputs.highpass = 0.008
+        temportal_filtering_wf.get_node('inputspec').inputs.lowpass = 0.08
+        if fwhm > 0:
+            wf.connect(smoother, 'smoothed_file', temportal_filtering_wf, 'func')
+        else:
+            wf.connect(nuisance_removal_wf, 'out_file', temportal_filtering_wf, 'func')
+
+        datacens_workflow_threshold_wf = datacens_workflow_threshold('datacens_workflow_threshold_wf',
+                                                                     ex_before=0,
+                                                                     ex_after=0)
+        wf.connect(motion_correction_mcflirt_wf, 'FD_file', datacens_workflow_threshold_wf, 'FD')
+        wf.connect(temportal_filtering_wf, 'out_file', datacens_workflow_threshold_wf, 'func')
+        wf.connect(datacens_workflow_threshold_wf, 'scrubbed_image', 'outputspec', 'func_preprocessed_scrubbed')
+        wf.connect(temportal_filtering_wf, 'out_file', 'outputspec', 'func_preprocessed')
 
     # sinking
     wf.connect(motion_correction_mcflirt_wf, 'FD_file', 'sinker', 'FD')
@@ -100,6 +116,3 @@ def func_proc_despike_afni(wf, bet_tool='FSL', deepbet_n_dilate=0, stdrefvol='mi
     # output
     wf.connect(motion_correction_mcflirt_wf, 'FD_file', 'outputspec', 'FD')
     wf.connect(motion_correction_mcflirt_wf, 'mc_ref_vol', 'outputspec', 'mc_ref_vol')
-    wf.connect(datacens_workflow_threshold_wf, 'scrubbed_image', 'outputspec', 'func_preprocessed_scrubbed')
-    wf.connect(temportal_filtering_wf, 'out_file', 'outputspec', 'func_preprocessed')
-
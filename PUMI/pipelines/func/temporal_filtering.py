@@ -60,6 +60,7 @@ def temporal_filtering(wf, **kwargs):
         ),
         name='time_repetition'
     )
+    time_repetition.inline = True
     wf.connect('inputspec', 'func', time_repetition, 'in_file')
 
     tmpfilt = Node(interface=afni.Bandpass(), name='tmpfilt')
@@ -613,9 +613,14 @@ def get_atlas(name_atlas, atlas_dir=None, **kwargs):
                 labels_init.index.names = ['Label']
 
             # Relabel labelmap with a range of values from 0 to the number of labels
+            # (one lookup-table remap over the unique values, values without label are kept)
             labelmap_data = labelmap_nii.get_fdata()
+            label_pos = {}
             for p, v in enumerate(labels_init.index.values):
-                labelmap_data[labelmap_data == v] = p
+                label_pos.setdefault(v, p)
+            values, inverse = np.unique(labelmap_data, return_inverse=True)
+            lut = np.array([label_pos.get(v, v) for v in values], dtype=labelmap_data.dtype)
+            labelmap_data = lut[inverse].reshape(labelmap_data.shape)
 
             # Create final labelmap and labels file
             labels = labels_init
@@ -653,9 +658,10 @@ def dummy_labels(atlas_data):
         labels: Dataframe
             Labels with dummy region names
     """
+    import numpy as np
     import pandas as pd
 
-    indices = list(map(round, list(set(atlas_data.flatten()))))
+    indices = [int(round(x)) for x in np.unique(atlas_data)]
     print(indices)
 
     value_to_label_dict = [''] * len(indices)
@@ -685,16 +691,18 @@ def get_det_atlas(labelmap_4d, threshold=0):
     """
     import numpy as np
     import nibabel as nb
-    import operator
 
     nii = nb.load(labelmap_4d)
-    img_4d_data = nii.get_fdata()
-    det_labelmap = np.zeros(img_4d_data.shape[:3])
+    shape = nii.shape
+    det_labelmap = np.zeros(shape[:3])
 
-    for x in np.ndindex(img_4d_data.shape[:3]):
-        idx, value = max(enumerate(img_4d_data[x].flatten()), key=operator.itemgetter(1))
-        if value > threshold:
-            det_labelmap[x] = idx + 1
+    # read the 4D map in slabs along the z-axis (about 256 MB as float64 at a time)
+    slab = max(1, int(2 ** 28 // (8 * shape[0] * shape[1] * shape[3])))
+    for z in range(0, shape[2], slab):
+        data = np.asanyarray(nii.dataobj[:, :, z:z + slab, :])
+        idx = data.argmax(axis=3)
+        value = np.take_along_axis(data, idx[..., np.newaxis], axis=3)[..., 0]
+        det_labelmap[:, :, z:z + slab] = np.where(value > threshold, idx + 1, 0)
 
     deterministic_nii = nb.Nifti1Image(det_labelmap, nii.affine, nii.header)
 
@@ -729,7 +737,6 @@ def relabel_atlas(labels, labelmap, labels_modules, labelmap_modules_resampled,
             Path to relabeled labelmap file
 
     """
-    from scipy.spatial.distance import dice
     import nibabel as nb
     import pandas as pd
     import numpy as np
@@ -753,22 +760,29 @@ def relabel_atlas(labels, labelmap, labels_modules, labelmap_modules_resampled,
         # Initialize modules list
         modules = ['NA'] * len(labels)
 
-        for i in range(len(labels)):
-
-            # Get mask of each region in labelmap
-            region_mask = np.zeros(labelmap_data.shape)
-            region_mask[labelmap_data == i] = 1
+        # Region/module overlaps from a single joint label histogram (contingency table)
+        n_labels, n_modules = len(labels), len(labels_modules)
+        labelmap_flat = labelmap_data.ravel()
+        modules_flat = labelmap_modules_data.ravel()
+        in_labels = (labelmap_flat >= 0) & (labelmap_flat < n_labels) & (labelmap_flat == np.round(labelmap_flat))
+        in_modules = (modules_flat >= 0) & (modules_flat < n_modules) & (modules_flat == np.round(modules_flat))
+        labelmap_flat = np.where(in_labels, labelmap_flat, 0).astype(np.int64)
+        modules_flat = np.where(in_modules, modules_flat, 0).astype(np.int64)
+        both = in_labels & in_modules
+
+        region_size = np.bincount(labelmap_flat[in_labels], minlength=n_labels)
+        module_size = np.bincount(modules_flat[in_modules], minlength=n_modules)
+        overlap = np.bincount(labelmap_flat[both] * n_modules + modules_flat[both],
+                              minlength=n_labels * n_modules).reshape(n_labels, n_modules)
+
+        # Dice coefficients, computed as in scipy.spatial.distance.dice (nan for two empty masks)
+        ntf = region_size[:, np.newaxis] - overlap
+        nft = module_size[np.newaxis, :] - overlap
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dice_coeffs = 1 - (ntf + nft) / (2.0 * overlap + ntf + nft)
 
-            # Initialize dice coefficient array
-            dice_coeff = np.zeros(len(labels_modules))
-
-            # Get dice coefficient of mask overlap with module mask
-            for j in range(len(labels_modules)):
-                # Get mask of each module in labelmap_modules_resampled
-                module_mask = np.zeros(labelmap_data.shape)
-                module_mask[labelmap_modules_data == j] = 1
-
-                dice_coeff[j] = 1 - dice(region_mask.flatten(), module_mask.flatten())
+        for i in range(len(labels)):
+            dice_coeff = dice_coeffs[i]
 
             # Get module (or background) associated to the current
             pos = heapq.nlargest(2, range(len(dice_coeff)), key=dice_coeff.__getitem__)
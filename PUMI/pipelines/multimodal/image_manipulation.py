@@ -33,6 +33,7 @@ def pick_volume(wf, volume='middle', sink=True, **kwargs):
     img_4d_info = Node(Function(input_names=['in_file', 'volume'],
                                 output_names=['start_idx'],
                                 function=get_info), name='img_4d_info')
+    img_4d_info.inline = True
     img_4d_info.inputs.volume = volume
 
     mean = False
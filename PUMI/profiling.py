@@ -0,0 +1,282 @@
+import argparse
+import os
+import resource
+import socket
+import sqlite3
+import threading
+import time
+
+from PUMI import globals
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS node_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    pipeline TEXT,
+    node TEXT,
+    parameterization TEXT,
+    interface TEXT,
+    input_shape TEXT,
+    pumi_version TEXT,
+    hostname TEXT,
+    started REAL,
+    wall_time REAL,
+    cpu_time REAL,
+    peak_rss_mb REAL,
+    threads INTEGER,
+    read_bytes INTEGER,
+    write_bytes INTEGER,
+    success INTEGER
+)
+"""
+
+
+def get_profile_db():
+    """
+    Return the profile database as configured in the [PROFILE] section of settings.ini, or None if disabled.
+    """
+    cfg = globals.cfg_parser
+    if not cfg.getboolean('PROFILE', 'enabled', fallback=False):
+        return None
+    return ProfileDB(cfg.get('PROFILE', 'db_path', fallback='~/.cache/pumi/profile.sqlite'))
+
+
+def input_shape(node):
+    """
+    Return the dimensions of the first NIfTI input of a node (e.g. '91x109x91x200'), or None.
+    """
+    import nibabel as nib
+
+    for name, value in sorted(node.inputs.get_traitsfree().items()):
+        for path in (value if isinstance(value, (list, tuple)) else [value]):
+            if isinstance(path, str) and path.endswith(('.nii', '.nii.gz')) and os.path.isfile(path):
+                try:
+                    return 'x'.join(str(x) for x in nib.load(path).shape)
+                except Exception:
+                    continue
+    return None
+
+
+def _read_io():
+    # storage I/O of this process, including its reaped child processes
+    counters = {}
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                key, value = line.split(':')
+                counters[key] = int(value)
+    except OSError:
+        pass
+    return counters.get('read_bytes', 0), counters.get('write_bytes', 0)
+
+
+def _process_tree(pid):
+    pids, stack = [], [pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        try:
+            for tid in os.listdir('/proc/%d/task' % pid):
+                with open('/proc/%d/task/%s/children' % (pid, tid), 'r') as f:
+                    stack.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+class _Sampler(threading.Thread):
+    """
+    Sample the RSS and the number of threads of the process tree (this process and the commands it runs).
+    """
+
+    def __init__(self, interval=0.5):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak_rss_kb = 0
+        self.max_threads = 0
+        self._stop_event = threading.Event()
+
+    def sample(self):
+        rss_kb, threads = 0, 0
+        for pid in _process_tree(os.getpid()):
+            try:
+                with open('/proc/%d/status' % pid, 'r') as f:
+                    for line in f:
+                        if line.startswith('VmRSS:'):
+                            rss_kb += int(line.split()[1])
+                        elif line.startswith('Threads:'):
+                            threads += int(line.split()[1])
+            except OSError:
+                continue
+        self.peak_rss_kb = max(self.peak_rss_kb, rss_kb)
+        self.max_threads = max(self.max_threads, threads)
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.sample()
+
+
+def run_profiled(node, run):
+    """
+    Run a node (run is a callable returning the nipype result) and record its runtime and resource usage into the
+    profile database, if enabled. Profiling never makes a node fail.
+    """
+    try:
+        profile_db = get_profile_db()
+    except Exception as e:  # e.g. the directory of the database is not writable or the database is locked
+        print('[PUMI profile] could not open the profile database, %s is not profiled: %s' % (node.fullname, e))
+        profile_db = None
+    if profile_db is None:
+        return run()
+
+    usage_self, usage_children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    read_bytes, write_bytes = _read_io()
+    sampler = _Sampler()
+    sampler.sample()
+    sampler.start()
+    started, start = time.time(), time.perf_counter()
+    success = False
+    try:
+        result = run()
+        success = True
+        return result
+    finally:
+        wall_time = time.perf_counter() - start
+        sampler.stop()
+        try:
+            usage_self_end = resource.getrusage(resource.RUSAGE_SELF)
+            usage_children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+            cpu_time = sum(getattr(end, attr) - getattr(begin, attr)
+                           for begin, end in [(usage_self, usage_self_end), (usage_children, usage_children_end)]
+                           for attr in ['ru_utime', 'ru_stime'])
+            peak_rss_kb = sampler.peak_rss_kb
+            if usage_children_end.ru_maxrss > usage_children.ru_maxrss:  # a command peaked between two samples
+                peak_rss_kb = max(peak_rss_kb, usage_children_end.ru_maxrss)
+            read_bytes_end, write_bytes_end = _read_io()
+            profile_db.record(node, started=started, wall_time=wall_time, cpu_time=cpu_time,
+                              peak_rss_mb=peak_rss_kb / 1024, threads=sampler.max_threads,
+                              read_bytes=read_bytes_end - read_bytes, write_bytes=write_bytes_end - write_bytes,
+                              success=success)
+        except Exception as e:
+            print('[PUMI profile] could not record %s: %s' % (node.fullname, e))
+
+
+class ProfileDB:
+    """
+    SQLite database with the runtime and resource usage of every executed node, across runs and PUMI versions.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = os.path.abspath(os.path.expanduser(str(db_path)))
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with self.connect() as con:
+            con.execute(SCHEMA)
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=60)
+
+    def record(self, node, **measures):
+        from PUMI import get_version
+
+        hierarchy = node._hierarchy if node._hierarchy else ''
+        interface = node.interface.__class__
+        row = {
+            'pipeline': hierarchy.split('.')[0] if hierarchy else node.name,
+            'node': '.'.join([hierarchy.split('.', 1)[1], node.name]) if '.' in hierarchy else node.name,
+            'parameterization': '/'.join(node.parameterization) if node.parameterization else '',
+            'interface': interface.__module__ + '.' + interface.__name__,
+            'input_shape': input_shape(node),
+            'pumi_version': get_version(),
+            'hostname': socket.gethostname(),
+            **measures
+        }
+        with self.connect() as con:
+            con.execute('INSERT INTO node_runs (%s) VALUES (%s)' % (', '.join(row), ', '.join('?' * len(row))),
+                        list(row.values()))
+
+    def query(self, sql, params=()):
+        with self.connect() as con:
+            return con.execute(sql, params).fetchall()
+
+    def hot_nodes(self, pipeline=None, top=20):
+        """
+        Nodes sorted by their total wall time, with the mean, standard deviation and coefficient of variation of the
+        wall time across runs (subjects), the mean CPU time and the maximal peak RSS.
+        """
+        where, params = ('WHERE success = 1 AND pipeline = ?', (pipeline,)) if pipeline else ('WHERE success = 1', ())
+        rows = self.query("""
+            SELECT pipeline, node, COUNT(*), SUM(wall_time), AVG(wall_time),
+                   AVG(wall_time * wall_time) - AVG(wall_time) * AVG(wall_time), AVG(cpu_time), MAX(peak_rss_mb)
+            FROM node_runs %s GROUP BY pipeline, node ORDER BY SUM(wall_time) DESC LIMIT ?""" % where,
+                          params + (top,))
+        report = []
+        for pipeline, node, n, total, mean, var, cpu, rss in rows:
+            std = max(var, 0) ** 0.5
+            report.append({'pipeline': pipeline, 'node': node, 'runs': n, 'total_s': total, 'mean_s': mean,
+                           'std_s': std, 'cv': std / mean if mean else 0, 'mean_cpu_s': cpu, 'max_rss_mb': rss})
+        return report
+
+    def trends(self, node=None, pipeline=None):
+        """
+        Mean wall time, CPU time and peak RSS per node and PUMI version.
+        """
+        conditions, params = ['success = 1'], []
+        if node:
+            conditions.append('node LIKE ?')
+            params.append('%' + node + '%')
+        if pipeline:
+            conditions.append('pipeline = ?')
+            params.append(pipeline)
+        rows = self.query("""
+            SELECT pipeline, node, pumi_version, COUNT(*), AVG(wall_time), AVG(cpu_time), AVG(peak_rss_mb),
+                   MIN(started)
+            FROM node_runs WHERE %s GROUP BY pipeline, node, pumi_version
+            ORDER BY pipeline, node, MIN(started)""" % ' AND '.join(conditions), params)
+        return [{'pipeline': p, 'node': n, 'pumi_version': v, 'runs': c, 'mean_s': w, 'mean_cpu_s': cpu,
+                 'mean_rss_mb': rss} for p, n, v, c, w, cpu, rss, _ in rows]
+
+
+def _print_table(rows, columns):
+    if not rows:
+        print('No profiled nodes found.')
+        return
+    formatted = [[('%.2f' % row[c]) if isinstance(row[c], float) else str(row[c]) for c in columns] for row in rows]
+    widths = [max(len(c), *(len(r[i]) for r in formatted)) for i, c in enumerate(columns)]
+    print('  '.join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in formatted:
+        print('  '.join(v.ljust(w) for v, w in zip(r, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report the runtime and resource profile of PUMI nodes.')
+    parser.add_argument('--db_path', help='Path to the profile database. Default is db_path from settings.ini.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    hot_parser = subparsers.add_parser('hot', help='Nodes with the highest total wall time and their variance.')
+    hot_parser.add_argument('--pipeline', help='Only report nodes of this pipeline (e.g. rcpl).')
+    hot_parser.add_argument('--top', type=int, default=20, help='Number of nodes to report.')
+
+    trends_parser = subparsers.add_parser('trends', help='Runtime of the nodes across PUMI versions.')
+    trends_parser.add_argument('--pipeline', help='Only report nodes of this pipeline (e.g. rcpl).')
+    trends_parser.add_argument('--node', help='Only report nodes whose name contains this string.')
+
+    args = parser.parse_args()
+    db_path = args.db_path or globals.cfg_parser.get('PROFILE', 'db_path', fallback='~/.cache/pumi/profile.sqlite')
+    if not os.path.exists(os.path.expanduser(db_path)):
+        parser.error('Profile database %s does not exist.' % db_path)
+    profile_db = ProfileDB(db_path)
+
+    if args.command == 'hot':
+        _print_table(profile_db.hot_nodes(pipeline=args.pipeline, top=args.top),
+                     ['pipeline', 'node', 'runs', 'total_s', 'mean_s', 'std_s', 'cv', 'mean_cpu_s', 'max_rss_mb'])
+    elif args.command == 'trends':
+        _print_table(profile_db.trends(node=args.node, pipeline=args.pipeline),
+                     ['pipeline', 'node', 'pumi_version', 'runs', 'mean_s', 'mean_cpu_s', 'mean_rss_mb'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+import os
+import re
+import sys
+from contextlib import contextmanager, ExitStack
+
+from PUMI import globals
+from PUMI.limits import effective_cpus
+from PUMI.profiling import ProfileDB, input_shape
+
+# Default resource estimates per interface: (base memory in GB, bytes per input voxel, threads)
+# The memory estimate is base + bytes per voxel x voxels (incl. volumes) of the input image.
+# Function nodes are identified by the name of their function.
+DEFAULT_RESOURCES = {
+    'ants.Registration': (2.0, 64, 4),
+    'ants.ApplyTransforms': (0.5, 16, 1),
+    'ants.ResampleImageBySpacing': (0.3, 16, 1),
+    'fsl.FAST': (0.5, 48, 1),
+    'fsl.FNIRT': (1.5, 48, 1),
+    'fsl.FLIRT': (0.3, 16, 1),
+    'fsl.MCFLIRT': (0.5, 16, 1),
+    'fsl.BET': (0.3, 8, 1),
+    'fsl.TOPUP': (1.0, 32, 1),
+    'fsl.ApplyTOPUP': (0.5, 16, 1),
+    'fsl.ApplyWarp': (0.3, 16, 1),
+    'fsl.FilterRegressor': (0.5, 16, 1),
+    'afni.Despike': (0.3, 12, 1),
+    'afni.Bandpass': (0.3, 16, 1),
+    'HDBet.HDBet': (4.0, 0, 4),
+    'Function:registration_ants_hardcoded': (2.0, 64, 4),
+    'Function:run_deepbet': (3.0, 16, 4),
+    'Function:denoise_func': (0.3, 16, 1),
+    'Function:TsExtractor': (0.3, 12, 1),
+}
+GENERIC_RESOURCES = (0.2, 8, 1)
+
+# Default runtime estimates per interface in seconds (for a typical input), e.g. for the critical path scheduler
+DEFAULT_RUNTIMES = {
+    'ants.Registration': 2400,
+    'Function:registration_ants_hardcoded': 2400,
+    'fsl.FNIRT': 1200,
+    'fsl.TOPUP': 900,
+    'fsl.FAST': 300,
+    'fsl.MCFLIRT': 180,
+    'HDBet.HDBet': 120,
+    'Function:run_deepbet': 120,
+    'afni.Despike': 120,
+    'fsl.FLIRT': 60,
+    'fsl.ApplyWarp': 60,
+    'fsl.ApplyTOPUP': 60,
+    'ants.ApplyTransforms': 60,
+    'afni.Bandpass': 60,
+    'Function:denoise_func': 60,
+    'fsl.BET': 30,
+    'fsl.FilterRegressor': 30,
+    'Function:TsExtractor': 30,
+}
+GENERIC_RUNTIME = 5
+
+# Default size of the files written by a node into the working directory, in bytes per input voxel (incl. volumes),
+# e.g. for the cost estimate of a run (see PUMI.estimate). Function nodes write nothing, unless listed here.
+DEFAULT_OUTPUT_BYTES = {
+    'ants.Registration': 16,
+    'Function:registration_ants_hardcoded': 16,
+    'fsl.FNIRT': 16,
+    'fsl.FAST': 12,
+    'fsl.TOPUP': 8,
+    'fsl.MCFLIRT': 4,
+    'fsl.ApplyWarp': 4,
+    'fsl.ApplyTOPUP': 4,
+    'ants.ApplyTransforms': 4,
+    'afni.Despike': 4,
+    'afni.Bandpass': 4,
+    'fsl.FilterRegressor': 4,
+    'Function:denoise_func': 4,
+    'Function:run_deepbet': 2,
+    'HDBet.HDBet': 2,
+    'fsl.BET': 2,
+}
+GENERIC_OUTPUT_BYTES = 2
+
+# Environment variables for the size of the thread pools of ITK (ANTs), OpenMP (e.g. AFNI, FSL), BLAS and numexpr
+THREAD_VARIABLES = ['ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS', 'OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                    'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+# Safety margin on top of the peak memory observed in previous runs
+HISTORY_MARGIN = 1.2
+
+_history = {}
+
+
+def resources_enabled():
+    return globals.cfg_parser.getboolean('RESOURCES', 'enabled', fallback=False)
+
+
+def max_threads():
+    """
+    Upper limit for the thread estimates (n_procs of the MultiProc plugin, if known, else the number of CPUs available
+    to the process, see PUMI.limits).
+    """
+    limit = globals.cfg_parser.get('RESOURCES', 'max_threads', fallback='')
+    return int(limit) if limit else effective_cpus()
+
+
+def interface_key(interface):
+    """
+    Return the key of an interface in DEFAULT_RESOURCES, e.g. 'fsl.FAST' or 'Function:run_deepbet'.
+    """
+    cls = interface.__class__
+    if cls.__name__ == 'Function':
+        match = re.search(r'def\s+(\w+)', getattr(interface.inputs, 'function_str', '') or '')
+        return 'Function:' + (match.group(1) if match else '')
+    module = cls.__module__.split('.')
+    tool = module[2] if module[0] == 'nipype' and len(module) > 2 else module[-1]
+    return tool + '.' + cls.__name__
+
+
+def node_path(node):
+    # node hierarchy without the pipeline name, as in the profile database
+    hierarchy = node._hierarchy if node._hierarchy else ''
+    return '.'.join([hierarchy.split('.', 1)[1], node.name]) if '.' in hierarchy else node.name
+
+
+def shape_voxels(shape):
+    # number of voxels (incl. volumes) of a shape as recorded in the profile database (e.g. '91x109x91x200')
+    voxels = 1
+    for dim in shape.split('x'):
+        voxels *= int(dim)
+    return voxels
+
+
+def load_history():
+    """
+    Return the resource usage of previous runs from the profile database (see PUMI.profiling), as
+    (node path, interface) -> list of (voxels, peak memory in GB, cpu time / wall time, wall time in s, bytes written).
+    Loaded once per process.
+    """
+    if not globals.cfg_parser.getboolean('RESOURCES', 'use_history', fallback=True):
+        return {}
+    db_path = os.path.expanduser(globals.cfg_parser.get('PROFILE', 'db_path', fallback='~/.cache/pumi/profile.sqlite'))
+    if db_path in _history:
+        return _history[db_path]
+
+    history = {}
+    if os.path.exists(db_path):
+        try:
+            rows = ProfileDB(db_path).query('SELECT node, interface, input_shape, peak_rss_mb, cpu_time, wall_time, '
+                                            'write_bytes FROM node_runs WHERE success = 1 ORDER BY started DESC')
+        except Exception as e:
+            print('[PUMI resources] could not read the profile database %s: %s' % (db_path, e))
+            rows = []
+        for node, interface, shape, peak_rss_mb, cpu_time, wall_time, write_bytes in rows:
+            runs = history.setdefault((node, interface), [])
+            if len(runs) < 50:  # most recent runs only
+                runs.append((shape_voxels(shape) if shape else 0, (peak_rss_mb or 0) / 1024,
+                             (cpu_time or 0) / wall_time if wall_time else 1, wall_time or 0, write_bytes or 0))
+    _history[db_path] = history
+    return history
+
+
+def _history_runs(node):
+    cls = node.interface.__class__
+    return load_history().get((node_path(node), cls.__module__ + '.' + cls.__name__), [])
+
+
+def has_history(node):
+    """Whether previous runs of the node are recorded in the profile database (see load_history)"""
+    return bool(_history_runs(node))
+
+
+def _scale(voxels, run_voxels):
+    # ratio of the input size to that of a previous run, 1 if one of them is unknown
+    return voxels / run_voxels if voxels and run_voxels else 1
+
+
+def estimate_memory_gb(node, voxels=None):
+    """
+    Estimate the peak memory of a node in GB: from previous runs of the same node if available (scaled to the
+    current input size), otherwise from the interface defaults (DEFAULT_RESOURCES) scaled by the input size.
+    The input size is that of the first NIfTI input (see PUMI.profiling.input_shape).
+
+    Returns:
+        mem_gb (float), description (str)
+    """
+    if voxels is None:
+        shape = input_shape(node)
+        voxels = shape_voxels(shape) if shape else 0
+    key = interface_key(node.interface)
+    base_gb, bytes_per_voxel, _ = DEFAULT_RESOURCES.get(key, GENERIC_RESOURCES)
+    mem_gb = base_gb + bytes_per_voxel * voxels / 1024 ** 3
+    description = '%s: %.2f GB default (%d voxels)' % (key, mem_gb, voxels)
+
+    runs = _history_runs(node)
+    if runs:
+        scaled = [peak_gb * _scale(voxels, run_voxels) for run_voxels, peak_gb, _, _, _ in runs]
+        mem_gb = max(HISTORY_MARGIN * max(scaled), 0.1)
+        description = '%s: %.2f GB learned from %d previous run(s)' % (key, mem_gb, len(runs))
+    return mem_gb, description
+
+
+def estimate_threads(node):
+    """
+    Estimate the number of threads of a node: the median CPU utilization (CPU time / wall time) of previous runs if
+    available, otherwise the interface default (DEFAULT_RESOURCES). Limited by max_threads().
+    """
+    import numpy as np
+
+    runs = _history_runs(node)
+    if runs:
+        threads = int(round(float(np.median([utilization for _, _, utilization, _, _ in runs]))))
+    else:
+        threads = DEFAULT_RESOURCES.get(interface_key(node.interface), GENERIC_RESOURCES)[2]
+    return int(min(max(threads, 1), max_threads()))
+
+
+def estimate_runtime(node, voxels=None):
+    """
+    Estimate the runtime of a node in seconds: the median wall time of previous runs if available (scaled to the input
+    size, if given as voxels), otherwise the interface default (DEFAULT_RUNTIMES).
+    """
+    import numpy as np
+
+    runs = _history_runs(node)
+    if runs:
+        return float(np.median([wall_time * _scale(voxels, run_voxels) for run_voxels, _, _, wall_time, _ in runs]))
+    return DEFAULT_RUNTIMES.get(interface_key(node.interface), GENERIC_RUNTIME)
+
+
+def estimate_output_bytes(node, voxels):
+    """
+    Estimate the size of the files a node writes for an input of the given number of voxels (incl. volumes): the
+    median bytes written by previous runs scaled to the input size if available, otherwise the interface default
+    (DEFAULT_OUTPUT_BYTES per voxel).
+    """
+    import numpy as np
+
+    runs = [run for run in _history_runs(node) if run[4]]
+    if runs:
+        return float(np.median([write_bytes * _scale(voxels, run_voxels)
+                                for run_voxels, _, _, _, write_bytes in runs]))
+    key = interface_key(node.interface)
+    if key.startswith('Function:') and key not in DEFAULT_OUTPUT_BYTES:
+        return 0.0
+    return float(DEFAULT_OUTPUT_BYTES.get(key, GENERIC_OUTPUT_BYTES) * voxels)
+
+
+def limit_threads_enabled():
+    return globals.cfg_parser.getboolean('RESOURCES', 'limit_threads', fallback=False)
+
+
+@contextmanager
+def thread_budget(node):
+    """
+    Context manager that limits the threads of a node to its n_procs (set explicitly, by num_threads or estimated,
+    see estimate_threads), so that the nodes run in parallel by MultiProc use at most n_procs threads in total:
+    the THREAD_VARIABLES are set in the environment of command line interfaces and of the process (for Function
+    nodes), the BLAS/OpenMP pools already loaded in the process are limited with threadpoolctl (if available) and the
+    threads of torch (if imported).
+    """
+    n_threads = str(min(max(int(node.n_procs or 1), 1), max_threads()))
+    environ = {variable: n_threads for variable in THREAD_VARIABLES}
+    inputs = node.interface.inputs
+    previous_environ = dict(inputs.environ) if hasattr(inputs, 'environ') else None
+    if previous_environ is not None:  # command line interface, environment variables set by the pipeline win
+        inputs.environ = {**environ, **previous_environ}
+
+    previous = {variable: os.environ.get(variable) for variable in THREAD_VARIABLES}
+    os.environ.update(environ)
+    with ExitStack() as stack:
+        try:
+            from threadpoolctl import threadpool_limits
+            stack.enter_context(threadpool_limits(limits=int(n_threads)))
+        except ImportError:
+            pass
+        torch = sys.modules.get('torch')  # torch reads the environment only when it is imported
+        if torch is not None:
+            torch_threads = torch.get_num_threads()
+            torch.set_num_threads(int(n_threads))
+            stack.callback(torch.set_num_threads, torch_threads)
+        try:
+            yield int(n_threads)
+        finally:
+            if previous_environ is not None:
+                inputs.environ = previous_environ
+            for variable, value in previous.items():
+                if value is None:
+                    os.environ.pop(variable, None)
+                else:
+                    os.environ[variable] = value
@@ -0,0 +1,62 @@
+from nipype.pipeline.plugins.multiproc import MultiProcPlugin as _MultiProcPlugin
+
+from PUMI import globals
+from PUMI.ledger import record_crash
+from PUMI.resources import estimate_runtime
+
+
+def critical_path_lengths(graph):
+    """
+    Estimate the remaining critical path length of every node: its own runtime plus the longest chain of runtimes
+    among its consumers (see PUMI.resources.estimate_runtime).
+
+    Parameters:
+        graph (networkx.DiGraph): Execution graph.
+
+    Returns:
+        lengths (dict): Node -> remaining critical path length in seconds.
+    """
+    import networkx as nx
+
+    lengths = {}
+    for node in reversed(list(nx.topological_sort(graph))):
+        lengths[node] = estimate_runtime(node) + max((lengths[v] for v in graph.successors(node)), default=0)
+    return lengths
+
+
+class MultiProcPlugin(_MultiProcPlugin):
+    """
+    MultiProc plugin with the 'critical_path' scheduler (plugin argument 'scheduler', default: scheduler in the
+    [RESOURCES] section of settings.ini): the ready nodes with the longest remaining chain of estimated runtimes
+    start first (e.g. the registrations of all subjects before their QC nodes), instead of in graph order.
+    Subnodes of MapNodes inherit the priority of their MapNode. Nipype's schedulers ('tsort', 'mem_thread') work as
+    with nipype's MultiProc plugin. The crash files are recorded in the run ledger (see PUMI.ledger).
+    """
+
+    def __init__(self, plugin_args=None):
+        plugin_args = dict(plugin_args) if plugin_args else {}
+        plugin_args.setdefault('scheduler', globals.cfg_parser.get('RESOURCES', 'scheduler', fallback='tsort'))
+        super().__init__(plugin_args=plugin_args)
+        self._priority = {}
+
+    def _generate_dependency_list(self, graph):
+        super()._generate_dependency_list(graph)
+        if self.plugin_args['scheduler'] == 'critical_path':
+            lengths = critical_path_lengths(graph)
+            self._priority = {jobid: lengths[node] for jobid, node in enumerate(self.procs)}
+            longest = max(lengths, key=lengths.get, default=None)
+            if longest is not None:
+                print('[PUMI scheduling] longest chain: %.0f min estimated, starting at %s'
+                      % (lengths[longest] / 60, longest.fullname))
+
+    def _sort_jobs(self, jobids, scheduler='tsort'):
+        if scheduler == 'critical_path':
+            # stable: graph order among nodes with the same priority
+            return sorted(jobids, key=lambda jobid: -self._priority.get(
+                jobid, self._priority.get(self.mapnodesubids.get(jobid), 0)))
+        return super()._sort_jobs(jobids, scheduler=scheduler)
+
+    def _report_crash(self, node, result=None):
+        crash_file = super()._report_crash(node, result=result)
+        record_crash(node, crash_file)
+        return crash_file
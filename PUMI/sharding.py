@@ -0,0 +1,86 @@
+import os
+from glob import glob
+
+
+def parse_shard(shard):
+    """
+    Parse a shard specification of the form 'i/N' (0 <= i < N), e.g. '3/10' or '$SLURM_ARRAY_TASK_ID/10'.
+
+    Returns:
+        index (int), n_shards (int)
+    """
+    try:
+        index, n_shards = (int(x) for x in shard.split('/'))
+    except ValueError:
+        raise ValueError('The shard has to be given as i/N (e.g. 0/10) but not ' + str(shard))
+    if n_shards < 1 or not 0 <= index < n_shards:
+        raise ValueError('Invalid shard %s: 0 <= i < N is required' % shard)
+    return index, n_shards
+
+
+def list_subjects(bids_dir):
+    """
+    Return the sorted participant labels (without 'sub-') of a BIDS dataset.
+    """
+    return sorted(os.path.basename(sub)[len('sub-'):] for sub in glob(os.path.join(bids_dir, 'sub-*'))
+                  if os.path.isdir(sub))
+
+
+def estimate_subject_cost(bids_dir, subject):
+    """
+    Estimate the processing cost of a subject by the number of voxels x volumes of its NIfTI images.
+    Only the headers are read.
+
+    Parameters:
+        bids_dir (str): Path to the BIDS dataset.
+        subject (str): Participant label (without 'sub-').
+
+    Returns:
+        cost (int): Sum of the voxel x volume counts of all images of the subject.
+    """
+    import nibabel as nib
+    import numpy as np
+
+    cost = 0
+    subject_dir = os.path.join(bids_dir, 'sub-' + subject)
+    for image in glob(os.path.join(subject_dir, '**', '*.nii*'), recursive=True):
+        try:
+            cost += int(np.prod(nib.load(image).shape))
+        except Exception:  # not a valid image, e.g. a broken symlink of a not yet downloaded dataset
+            continue
+    return cost
+
+
+def partition_subjects(costs, n_shards):
+    """
+    Deterministically partition the subjects into n_shards shards with balanced total cost (the most expensive
+    subject goes to the currently cheapest shard). Ties are broken by the participant label and the shard index, so
+    every array task computes the same partition.
+
+    Parameters:
+        costs (dict): Participant label -> estimated cost.
+        n_shards (int): Number of shards.
+
+    Returns:
+        shards (list): n_shards lists of participant labels (sorted).
+        loads (list): Total cost of each shard.
+    """
+    shards = [[] for _ in range(n_shards)]
+    loads = [0] * n_shards
+    for subject in sorted(costs, key=lambda s: (-costs[s], s)):
+        i = min(range(n_shards), key=lambda j: (loads[j], j))
+        shards[i].append(subject)
+        loads[i] += costs[subject]
+    return [sorted(shard) for shard in shards], loads
+
+
+def print_shards(shards, loads, costs):
+    """
+    Print the subjects assigned to each shard (dry run of --shard).
+    """
+    total = max(sum(loads), 1)
+    for i, (shard, load) in enumerate(zip(shards, loads)):
+        print('shard %d/%d: %d subject(s), cost %.3g (%.1f%%)' % (i, len(shards), len(shard), load,
+                                                                  100 * load / total))
+        for subject in shard:
+            print('    sub-%s (cost %.3g)' % (subject, costs[subject]))
@@ -0,0 +1,157 @@
+import atexit
+import fcntl
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from nipype.interfaces.base import isdefined
+from nipype.interfaces.io import DataSink
+from nipype.utils.filemanip import ensure_list
+
+from PUMI import globals
+
+# ioctl of Linux to share the extents of two files (copy-on-write clone, e.g. on btrfs and XFS)
+FICLONE = 0x40049409
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = []
+
+
+def get_data_sink():
+    """
+    Return the DataSink interface for the sinkers as configured by 'mode' in the [SINKING] section of settings.ini:
+    'link' (LinkDataSink, default) or 'copy' (nipype's DataSink).
+    """
+    if globals.cfg_parser.get('SINKING', 'mode', fallback='link') == 'copy':
+        return DataSink()
+    return LinkDataSink()
+
+
+def reflink(src, dst):
+    """
+    Clone src to dst without copying the data (only on filesystems with copy-on-write support).
+
+    Returns:
+        success (bool): False if the filesystem does not support it.
+    """
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+
+def _copy(src, dst):
+    # copy into a temporary file first, so that an incomplete copy never shows up in the sink directory
+    tmp = dst + '.pumi_tmp'
+    shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+
+def copy_async(src, dst):
+    """
+    Copy src to dst in a background thread (see wait_for_copies).
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=globals.cfg_parser.getint('SINKING', 'copy_threads', fallback=4),
+                                           thread_name_prefix='pumi_sink')
+        _pending.append((src, dst, _executor.submit(_copy, src, dst)))
+
+
+def wait_for_copies():
+    """
+    Wait until all background copies of the sinkers are finished.
+    Raises a RuntimeError listing the files that could not be copied.
+    """
+    errors = []
+    while _pending:
+        src, dst, future = _pending.pop()
+        try:
+            future.result()
+        except Exception as e:
+            errors.append('%s -> %s: %s' % (src, dst, e))
+    if errors:
+        raise RuntimeError('Sinking failed for:\n' + '\n'.join(errors))
+
+
+atexit.register(wait_for_copies)
+
+
+def sink_file(src, dst):
+    """
+    Make the file src available as dst: a hardlink if possible, a reflink on copy-on-write filesystems, otherwise a
+    background copy. Nothing is done if dst is already a link or an identical copy (same size and mtime) of src.
+    """
+    if os.path.exists(dst):
+        src_stat, dst_stat = os.stat(src), os.stat(dst)
+        if os.path.samestat(src_stat, dst_stat) or \
+                (src_stat.st_size, src_stat.st_mtime_ns) == (dst_stat.st_size, dst_stat.st_mtime_ns):
+            return dst
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:  # e.g. sinking across filesystems
+        if not reflink(src, dst):
+            copy_async(src, dst)
+    return dst
+
+
+class LinkDataSink(DataSink):
+    """
+    DataSink that hardlinks (or reflinks) the files into the sink directory instead of copying them, and copies in
+    background threads if linking is not possible. Destination paths (incl. substitutions and
+    regexp_substitutions) are the same as with nipype's DataSink. S3 and local_copy are handled by DataSink.
+
+    Run it with run_without_submitting, background copies are awaited at the end of NestedWorkflow.run.
+    """
+
+    def _list_outputs(self):
+        if self._check_s3_base_dir()[0] or isdefined(self.inputs.local_copy):
+            return super()._list_outputs()
+
+        outputs = self.output_spec().get()
+        out_files = []
+        outdir = self.inputs.base_directory if isdefined(self.inputs.base_directory) else '.'
+        if isdefined(self.inputs.container):
+            outdir = os.path.join(outdir, self.inputs.container)
+        outdir = os.path.abspath(outdir)
+        os.makedirs(outdir, exist_ok=True)
+
+        for key, files in list(self.inputs._outputs.items()):
+            if not isdefined(files):
+                continue
+            tempoutdir = outdir
+            for d in key.split('.'):
+                if d[0] == '@':
+                    continue
+                tempoutdir = os.path.join(tempoutdir, d)
+
+            files = ensure_list(files if files else [])
+            if files and isinstance(files[0], list):
+                files = [item for sublist in files for item in sublist]
+
+            for src in ensure_list(files):
+                src = os.path.abspath(src)
+                if not os.path.isfile(src):
+                    src = os.path.join(src, '')
+                dst = self._substitute(os.path.join(tempoutdir, self._get_dst(src)))
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                if os.path.isfile(src):
+                    out_files.append(sink_file(src, dst))
+                elif os.path.isdir(src):
+                    if os.path.exists(dst) and self.inputs.remove_dest_dir:
+                        shutil.rmtree(dst)
+                    shutil.copytree(src, dst, copy_function=sink_file, dirs_exist_ok=True)
+                    out_files.append(dst)
+
+        outputs['out_file'] = out_files
+        return outputs
@@ -1,12 +1,6 @@
-from multiprocessing.managers import Value
 from pathlib import Path
 
-from sklearn.feature_selection import SelectKBest
-from sklearn.linear_model import ElasticNet
-from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import RobustScaler
-from sklearn.feature_selection import f_regression
-from templateflow import api as tflow
+# sklearn and templateflow are imported where needed: PUMI.utils is imported by every Function node
 import numpy as np
 import json
 import os
@@ -170,6 +164,8 @@ def get_ref_from_templateflow(query):
         Exception: If the specified file is not found in the templateflow archive.
     """
 
+    from templateflow import api as tflow
+
     if query.count('/') == 1:
         query = query.split('/')[1]
 
@@ -447,6 +443,134 @@ def scale_vol(in_file):
     return os.path.join(os.getcwd(), out_file)
 
 
+def denoise_func(in_file, noise_roi, friston24_file, fd_file=None, fd_threshold=0.2, frames_before=0,
+                 frames_after=0, highpass=0.008, lowpass=0.08, num_components=5, fwhm=0, chunk_size=10000):
+    """
+
+    Fused, in-memory version of the denoising chain scale_vol -> ACompCor -> fsl.FilterRegressor -> (fsl.Smooth) ->
+    afni.Bandpass -> scrubbing. The 4D image is read once (as float32) and only the denoised (and the scrubbed) image
+    is written.
+
+    Steps:
+        1. aCompCor: the noise ROI voxels are scaled, constant and linear trends are removed and the first
+           num_components principal components are extracted (as in nipype's ACompCor with pre_filter='polynomial').
+        2. Nuisance regression of the compcor components and the Friston-24 parameters (as fsl_regfilt -a,
+           the voxel means are kept).
+        3. Optional gaussian smoothing with the given FWHM (mm).
+        4. Quadratic detrending and FFT-based temporal bandpass filtering (as afni 3dBandpass).
+        5. Optional censoring of the volumes with high framewise displacement (see censor_frames, as above_threshold).
+
+    Parameters:
+        in_file (str): Path to the (despiked) 4D functional image.
+        noise_roi (str): Path to the noise ROI (e.g. eroded WM + ventricles in functional space).
+        friston24_file (str): Path to the Friston-24 parameters.
+        fd_file (str): Path to the framewise displacement file. If None, no censoring is done.
+        fd_threshold (float): FD threshold for the censoring.
+        frames_before (int): Number of volumes to censor before a high-FD volume.
+        frames_after (int): Number of volumes to censor after a high-FD volume.
+        highpass (float): Highpass cutoff in Hz.
+        lowpass (float): Lowpass cutoff in Hz.
+        num_components (int): Number of compcor components.
+        fwhm (float): FWHM of the smoothing kernel in mm. No smoothing if 0.
+        chunk_size (int): Number of voxels filtered at once (limits the memory used by the FFT).
+
+    Returns:
+        out_file (str): Path to the denoised 4D image.
+        scrubbed_image (str): Path to the denoised and scrubbed 4D image (None, if fd_file is None).
+        compcor_file (str): Path to the text file containing the compcor components.
+        fd_scrubbed_file (str): Path to the FD values of the retained volumes (None, if fd_file is None).
+        percent_scrubbed_file (str): Path to the text file with the percentage of censored volumes
+                                     (None, if fd_file is None).
+
+    """
+    import os
+    import nibabel as nib
+    import numpy as np
+    from numpy.polynomial import Legendre
+    from scipy.ndimage import gaussian_filter
+    from PUMI.utils import censor_frames
+
+    def regress_poly(Y, degree):
+        X = np.column_stack([Legendre.basis(d)(np.linspace(-1, 1, Y.shape[1])) for d in range(degree + 1)])
+        return Y - (Y @ np.linalg.pinv(X).T.astype(Y.dtype)) @ X.T.astype(Y.dtype)
+
+    img = nib.load(in_file)
+    data = img.get_fdata(dtype=np.float32)
+    tr = float(img.header['pixdim'][4])
+    n_vols = data.shape[3]
+
+    # 1. aCompCor on the scaled noise ROI
+    noise = data[np.asanyarray(nib.load(noise_roi).dataobj).astype(bool)]
+    std = noise.std(axis=1, keepdims=True)
+    std[std == 0] = 1
+    noise = (noise - noise.mean(axis=1, keepdims=True)) / std
+    M = regress_poly(noise, 1).T
+    std = M.std(axis=0)
+    std[(std == 0) | np.isnan(std)] = 1
+    u, _, _ = np.linalg.svd(M / std, full_matrices=False)
+    components = u[:, :num_components]
+    compcor_file = os.path.join(os.getcwd(), 'compcor_components.txt')
+    np.savetxt(compcor_file, components, fmt='%.10f', delimiter='\t')
+
+    # 2. nuisance regression (within the non-zero voxels)
+    brain = np.any(data != 0, axis=3)
+    Y = data[brain]
+    design = np.hstack((components, np.loadtxt(friston24_file)))
+    design = design - design.mean(axis=0)
+    mean = Y.mean(axis=1, keepdims=True)
+    Y -= mean
+    betas = np.linalg.pinv(design).astype(np.float32) @ Y.T
+    Y -= (design.astype(np.float32) @ betas).T
+    Y += mean
+    data[brain] = Y
+    del Y, betas
+
+    # 3. smoothing
+    if fwhm > 0:
+        sigma = fwhm / np.sqrt(8 * np.log(2)) / np.array(img.header.get_zooms()[:3])
+        for t in range(n_vols):
+            data[..., t] = gaussian_filter(data[..., t], sigma)
+        brain = np.any(data != 0, axis=3)
+
+    # 4. detrending and bandpass filtering
+    freqs = np.fft.rfftfreq(n_vols, d=tr)
+    stopband = (freqs < highpass) | (freqs > lowpass)
+    voxels = np.argwhere(brain)
+    for start in range(0, len(voxels), chunk_size):
+        idx = tuple(voxels[start:start + chunk_size].T)
+        spectrum = np.fft.rfft(regress_poly(data[idx], 2), axis=1)
+        spectrum[:, stopband] = 0
+        data[idx] = np.fft.irfft(spectrum, n=n_vols, axis=1)
+
+    old_filename = os.path.basename(in_file)
+    ext_type = '.nii.gz' if old_filename.endswith('.nii.gz') else '.nii'
+    basename = old_filename[:old_filename.find(ext_type)] if ext_type in old_filename else old_filename
+
+    out_img = nib.Nifti1Image(data, img.affine, img.header)
+    out_img.set_data_dtype(np.float32)
+    out_file = os.path.join(os.getcwd(), basename + '_denoised' + ext_type)
+    nib.save(out_img, out_file)
+
+    # 5. censoring
+    scrubbed_image, fd_scrubbed_file, percent_scrubbed_file = None, None, None
+    if fd_file is not None:
+        # as above_threshold, on the FD array
+        fd = np.loadtxt(fd_file, skiprows=1)
+        censored = censor_frames(fd, threshold=fd_threshold, frames_before=frames_before, frames_after=frames_after)
+        frames_in_idx = np.flatnonzero(~censored)
+        fd_scrubbed_file = os.path.join(os.getcwd(), 'FD_scrubbed.csv')
+        np.savetxt(fd_scrubbed_file, fd[frames_in_idx], delimiter=',')
+        percent_scrubbed_file = os.path.join(os.getcwd(), 'percent_scrubbed.txt')
+        with open(percent_scrubbed_file, 'w') as f:
+            f.write('%.3f' % (censored.sum() * 100 / (len(fd) + 1)))
+        scrubbed_img = nib.Nifti1Image(data[..., frames_in_idx], img.affine, img.header)
+        scrubbed_img.set_data_dtype(np.float32)
+        scrubbed_image = os.path.join(os.getcwd(), basename + '_denoised_scrubbed' + ext_type)
+        nib.save(scrubbed_img, scrubbed_image)
+
+    return out_file, scrubbed_image, compcor_file, fd_scrubbed_file, percent_scrubbed_file
+
+
 def drop_first_line(in_file):
     import os
 
@@ -612,6 +736,154 @@ def max_from_txt(in_file, axis=None, header=False, out_file='max.txt'):
     return new_file
 
 
+def motion_metrics_from_params(params, fd_mode='Power', threshold=0.2, radius=50.0, rmax=80.0):
+    """
+
+    Vectorized computation of the motion metrics from (FSL MCFLIRT) motion parameters.
+
+    Parameters:
+        params (np.ndarray): Motion parameters with shape (..., n_volumes, 6), columns in FSL order
+                             (rotations in radians, then translations in mm). Leading axes are treated as a batch.
+        fd_mode (str): FD used for the summary statistics, either "Power" or "Jenkinson".
+        threshold (float): FD threshold (mm) for the percentage of volumes above threshold.
+        radius (float): Head radius (mm) used to convert rotations for the FD of Power et al. (2012).
+        rmax (float): Radius (mm) of the sphere representing the brain for the FD of Jenkinson et al. (2002).
+
+    Returns:
+        metrics (dict): 'friston24' (..., n_volumes, 24), 'fd_power' (..., n_volumes - 1),
+                        'fd_jenkinson' (..., n_volumes - 1) and 'mean_fd', 'median_fd', 'max_fd', 'percent_above'
+                        (...) computed on the FD selected by fd_mode.
+
+    """
+    import numpy as np
+
+    if fd_mode not in ['Power', 'Jenkinson']:
+        raise ValueError('fd_mode has to be "Power" or "Jenkinson"! %s is not a valid option!' % fd_mode)
+
+    params = np.asarray(params, dtype=np.float64)
+    d_rot = np.diff(params[..., :3], axis=-2)
+    d_trans = np.diff(params[..., 3:], axis=-2)
+
+    fd_power = np.abs(d_trans).sum(axis=-1) + radius * np.abs(d_rot).sum(axis=-1)
+    fd_jenkinson = np.sqrt((rmax * rmax / 5) * (d_rot ** 2).sum(axis=-1) + (d_trans ** 2).sum(axis=-1))
+
+    params_roll = np.zeros_like(params)
+    params_roll[..., 1:, :] = params[..., :-1, :]
+    friston24 = np.concatenate((params, params ** 2, params_roll, params_roll ** 2), axis=-1)
+
+    fd = fd_power if fd_mode == 'Power' else fd_jenkinson
+    return {
+        'friston24': friston24,
+        'fd_power': fd_power,
+        'fd_jenkinson': fd_jenkinson,
+        'mean_fd': fd.mean(axis=-1),
+        'median_fd': np.median(fd, axis=-1),
+        'max_fd': fd.max(axis=-1),
+        'percent_above': (fd >= threshold).mean(axis=-1) * 100
+    }
+
+
+def motion_metrics(in_file, fd_mode='Power', threshold=0.2, save_plot=True):
+    """
+
+    Calculate all motion metrics from the motion parameter file in one step:
+    Friston-24 parameters, FD (Power and Jenkinson) and FD summary statistics.
+    Replaces calc_friston_twenty_four, calculate_FD_Jenkinson, FramewiseDisplacement, mean_from_txt and max_from_txt.
+
+    Parameters:
+        in_file (str): input movement parameters file from motion correction (FSL MCFLIRT .par file)
+        fd_mode (str): Either "Power" or "Jenkinson". Selects fd_file and the FD used for the summary statistics.
+        threshold (float): FD threshold for the percentage of volumes above threshold.
+        save_plot (bool): Save a plot of the selected FD.
+
+    Returns:
+        friston24_file (str): path to the 24 parameter values (same format as calc_friston_twenty_four)
+        fd_file (str): path to the selected FD (fd_power_file or fd_jenkinson_file)
+        fd_power_file (str): path to the FD of Power et al. (same format as nipype's FramewiseDisplacement)
+        fd_jenkinson_file (str): path to the FD of Jenkinson et al. (same format as calculate_FD_Jenkinson)
+        mean_fd_file (str): path to the mean FD
+        median_fd_file (str): path to the median FD
+        max_fd_file (str): path to the max FD
+        percent_above_file (str): path to the percentage of volumes with FD above threshold
+        fd_figure (str): path to the FD plot (None, if save_plot is False)
+
+    """
+    import os
+    import numpy as np
+    from PUMI.utils import motion_metrics_from_params
+
+    metrics = motion_metrics_from_params(np.loadtxt(in_file, ndmin=2), fd_mode=fd_mode, threshold=threshold)
+
+    friston24_file = os.path.join(os.getcwd(), 'fristons_twenty_four.1D')
+    np.savetxt(friston24_file, metrics['friston24'], delimiter=' ')
+
+    fd_power_file = os.path.join(os.getcwd(), 'fd_power_2012.txt')
+    np.savetxt(fd_power_file, metrics['fd_power'], header='FramewiseDisplacement', comments='')
+
+    # the first (zero) line plays the role of the header, as in calculate_FD_Jenkinson
+    fd_jenkinson_file = os.path.join(os.getcwd(), 'FD_J.1D')
+    np.savetxt(fd_jenkinson_file, np.insert(metrics['fd_jenkinson'], 0, 0), fmt='%.8f')
+
+    summary_files = []
+    for key, filename in [('mean_fd', 'FD.txt'), ('median_fd', 'FDmedian.txt'), ('max_fd', 'FDmax.txt'),
+                          ('percent_above', 'FDpercent_above.txt')]:
+        summary_files.append(os.path.join(os.getcwd(), filename))
+        np.savetxt(summary_files[-1], [metrics[key]])
+
+    fd_figure = None
+    if save_plot:
+        from nipype.algorithms.confounds import plot_confound
+        fd_figure = os.path.join(os.getcwd(), 'fd_%s.png' % fd_mode.lower())
+        fd = metrics['fd_power'] if fd_mode == 'Power' else metrics['fd_jenkinson']
+        fig = plot_confound(fd, (11.7, 2.3), 'FD', units='mm')
+        fig.savefig(fd_figure, dpi=100, format='png', bbox_inches='tight')
+        fig.clf()
+
+    fd_file = fd_power_file if fd_mode == 'Power' else fd_jenkinson_file
+    return (friston24_file, fd_file, fd_power_file, fd_jenkinson_file, *summary_files, fd_figure)
+
+
+def motion_metrics_batch(par_files, fd_mode='Power', threshold=0.2, out_file=None):
+    """
+
+    Batch mode of motion_metrics for cohort (re-)analyses: FD summary statistics for many motion parameter files.
+    Files with the same number of volumes are stacked and processed as one array.
+
+    Parameters:
+        par_files (list): paths to the motion parameter files (FSL MCFLIRT .par files)
+        fd_mode (str): Either "Power" or "Jenkinson".
+        threshold (float): FD threshold for the percentage of volumes above threshold.
+        out_file (str): If given, the table is also saved as tab-separated file.
+
+    Returns:
+        metrics (pd.DataFrame): one row per par file with the columns par_file, n_volumes, mean_fd, median_fd,
+                                max_fd and percent_above.
+
+    """
+    import numpy as np
+    import pandas as pd
+    from collections import defaultdict
+
+    groups = defaultdict(list)
+    for i, par_file in enumerate(par_files):
+        params = np.loadtxt(par_file, ndmin=2)
+        groups[params.shape].append((i, params))
+
+    rows = [None] * len(par_files)
+    for shape, items in groups.items():
+        metrics = motion_metrics_from_params(np.stack([params for _, params in items]), fd_mode=fd_mode,
+                                             threshold=threshold)
+        for j, (i, _) in enumerate(items):
+            rows[i] = {'par_file': par_files[i], 'n_volumes': shape[0], 'mean_fd': metrics['mean_fd'][j],
+                       'median_fd': metrics['median_fd'][j], 'max_fd': metrics['max_fd'][j],
+                       'percent_above': metrics['percent_above'][j]}
+
+    df = pd.DataFrame(rows, columns=['par_file', 'n_volumes', 'mean_fd', 'median_fd', 'max_fd', 'percent_above'])
+    if out_file is not None:
+        df.to_csv(out_file, sep='\t', index=False)
+    return df
+
+
 def get_indx(scrub_input, frames_in_1D_file):
     """
 
@@ -671,6 +943,75 @@ def scrub_image(scrub_input):
     return scrubbed_image
 
 
+def scrub_image_native(in_file, frames_in_idx):
+    """
+
+    Scrub the image in-process (without the 3dcalc call of scrub_image): only the selected volumes are read and
+    written. Uncompressed images are memory-mapped, so the retained volumes are copied only once.
+    The data type and the scaling of the input image are kept.
+
+    Parameters:
+        in_file (str): path to the 4D file to be scrubbed
+        frames_in_idx (list): indices of the volumes to be included, either as integers or in the format of
+                              above_threshold (a list with a comma-separated string)
+
+    Returns:
+        scrubbed_image (str): path to the scrubbed 4D file
+    """
+
+    import os
+    import numpy as np
+    import nibabel as nib
+
+    old_filename = os.path.basename(in_file)
+    if '.nii.gz' in old_filename:
+        ext_type = '.nii.gz'
+    elif '.nii' in old_filename:
+        ext_type = '.nii'
+    else:
+        raise ValueError(f'%s must have .nii or .nii.gz extension' % in_file)
+    new_filename = old_filename[:old_filename.find(ext_type)] + '_scrubbed' + ext_type
+
+    frames_in_idx = [int(x) for x in ','.join(str(x) for x in frames_in_idx).split(',') if x.strip() != '']
+
+    img = nib.load(in_file, mmap=True)
+    data = img.dataobj.get_unscaled()[..., frames_in_idx]
+    scrubbed_img = nib.Nifti1Image(data, img.affine, img.header)
+    scrubbed_img.header.set_slope_inter(img.dataobj.slope, img.dataobj.inter)
+
+    scrubbed_image = os.path.join(os.getcwd(), new_filename)
+    nib.save(scrubbed_img, scrubbed_image)
+
+    return scrubbed_image
+
+
+def censor_frames(fd, threshold=0.2, frames_before=0, frames_after=0, inclusive=True):
+    """
+
+    Select the frames to be censored: the frames with FD above the threshold, dilated by frames_before
+    preceding and frames_after following frames.
+    Used by above_threshold and PUMI.PAINTeR.scrub.
+
+    Parameters:
+        fd (np.ndarray): framewise displacement values
+        threshold (float): FD threshold
+        frames_before (int): number of frames to censor before a high-FD frame
+        frames_after (int): number of frames to censor after a high-FD frame
+        inclusive (bool): censor frames with FD equal to the threshold, too
+
+    Returns:
+        censored (np.ndarray): boolean mask of the censored frames
+    """
+
+    import numpy as np
+
+    fd = np.asarray(fd, dtype=float).ravel()
+    above = fd >= threshold if inclusive else fd > threshold
+    # frame j is censored, if any of the frames j - frames_after ... j + frames_before is above threshold
+    window = np.convolve(above, np.ones(frames_before + frames_after + 1), mode='full')
+    return window[frames_before:frames_before + len(fd)] > 0
+
+
 def above_threshold(in_file, threshold=0.2, frames_before=1, frames_after=2):
 
     """
@@ -682,33 +1023,15 @@ def above_threshold(in_file, threshold=0.2, frames_before=1, frames_after=2):
     import os
     import numpy as np
     from numpy import loadtxt, savetxt
+    from PUMI.utils import censor_frames
 
     powersFD_data = loadtxt(in_file, skiprows=1)
     np.insert(powersFD_data, 0, 0)  # TODO_ready: why do we need this: see output of nipype.algorithms.confounds.FramewiseDisplacement
-    frames_in_idx = np.argwhere(powersFD_data < threshold)[:, 0]
-    frames_out = np.argwhere(powersFD_data >= threshold)[:, 0]
-
-    extra_indices = []
-    for i in frames_out:
-
-        # remove preceding frames
-        if i > 0:
-            count = 1
-            while count <= frames_before:
-                extra_indices.append(i - count)
-                count += 1
-
-        # remove following frames
-        count = 1
-        while count <= frames_after:
-            if i+count < len(powersFD_data):  # do not censor unexistent data
-                extra_indices.append(i + count)
-            count += 1
-    indices_out = list(set(frames_out) | set(extra_indices))
-    indices_out.sort()
-
-    frames_out_idx = indices_out
-    frames_in_idx = np.setdiff1d(frames_in_idx, indices_out)
+    censored = censor_frames(powersFD_data, threshold=threshold, frames_before=frames_before,
+                             frames_after=frames_after)
+
+    frames_out_idx = list(np.flatnonzero(censored))
+    frames_in_idx = np.flatnonzero(~censored)
 
     FD_scrubbed = powersFD_data[frames_in_idx]
     fd_scrubbed_file = os.path.join(os.getcwd(), 'FD_scrubbed.csv')
@@ -853,65 +1176,90 @@ def relabel_atlas(atlas_file, modules, labels):
 
 def TsExtractor(labels, labelmap, func, mask, global_signal=True, pca=False, outfile="reg_timeseries.tsv",
                 outlabelmap="individual_gm_labelmap.nii.gz"):
-    # todo: check method
+    """
+
+    Extract the regional timeseries (and optionally the global signal) of a 4D functional image.
+
+    The 4D data is reshaped to voxels x time once, constant voxels are dropped with a vectorized std test and all
+    parcel means are computed in a single sparse-matrix product.
+
+    Parameters:
+        labels ([str]): Label names. Label l in the labelmap corresponds to labels[l-1].
+        labelmap (str): Path to the labelmap in the space of func.
+        func (str): Path to the 4D functional image.
+        mask (str): Path to the (grey matter) mask. Voxels outside the mask are set to background.
+        global_signal (bool): Add the mean timeseries of the mask as first column ('GlobSig').
+        pca (bool): Use the first principal component instead of the mean timeseries.
+        outfile (str): Name of the resulting TSV-file.
+        outlabelmap (str): Name of the masked labelmap.
+
+    Returns:
+        out_file (str): Path to the TSV-file containing the timeseries (one column per label).
+        labels ([str]): Column names.
+        out_gm_label (str): Path to the masked labelmap.
+
+    """
     import os
     import nibabel as nib
     import numpy as np
     import pandas as pd
+    from scipy import sparse
 
-    func_data = nib.load(func).get_fdata()
+    func_img = nib.load(func)
     labelmap_data = nib.load(labelmap).get_fdata()
     mask_data = nib.load(mask).get_fdata()
 
-    labelmap_data[mask_data==0] = 0 # background
+    labelmap_data[mask_data == 0] = 0  # background
 
     outlab = nib.Nifti1Image(labelmap_data, nib.load(labelmap).affine)
     nib.save(outlab, outlabelmap)
 
-    ret = []
+    n_labels = len(labels)
+    n_timepoints = func_img.shape[3]
+
+    # only voxels that are used for any of the timeseries are read into the voxels x time matrix
+    in_label = (labelmap_data == np.round(labelmap_data)) & (labelmap_data >= 1) & (labelmap_data <= n_labels)
+    in_mask = mask_data > 0 if global_signal else np.zeros(mask_data.shape, dtype=bool)
+    selected = in_label | in_mask
+
+    X = np.asanyarray(func_img.dataobj)[selected].astype(np.float64)  # voxels x time
+    valid = X.std(axis=1) > 0.000001  # drop constant voxels
+    voxel_labels = labelmap_data[selected].astype(np.int64)
+    voxel_labels[~(in_label[selected] & valid)] = 0
+
+    def first_component(X):
+        import sklearn.decomposition as decomp
+        from sklearn.preprocessing import StandardScaler
+        X = StandardScaler().fit_transform(np.transpose(X))
+        PCA = decomp.PCA(n_components=1, svd_solver="arpack")
+        return PCA.fit_transform(X).flatten()
+
+    ret = np.zeros((n_timepoints, n_labels + int(global_signal)))
 
     if global_signal:
-        indices = np.argwhere(mask_data > 0)
-        X = []
-        for i in indices:
-            x = func_data[i[0], i[1], i[2], :]
-            if np.std(x) > 0.000001:
-                X.append(x.tolist())
-        if len(X) == 0:
-            x = np.repeat(0, func_data.shape[3])
-        elif pca:
-            import sklearn.decomposition as decomp
-            from sklearn.preprocessing import StandardScaler
-            X = StandardScaler().fit_transform(np.transpose(X))
-            PCA = decomp.PCA(n_components=1, svd_solver="arpack")
-            x = PCA.fit_transform(X).flatten()
-        else:
-            x = np.mean(X, axis=0)
-        ret.append(x)
-
-    for l in range(1,len(labels)+1):
-        indices=np.argwhere(labelmap_data == l)
-        X = []
-        for i in indices:
-            x = func_data[i[0], i[1], i[2], :]
-            if np.std(x) > 0.000001:
-                X.append(x.tolist())
-        X = np.array(X)
-        if X.shape[0]==0:
-            x=np.repeat(0,func_data.shape[3])
-        elif X.shape[0]==1:
-            x=X.flatten()
+        glob = X[in_mask[selected] & valid]
+        if glob.shape[0] == 0:
+            ret[:, 0] = 0
         elif pca:
-            import sklearn.decomposition as decomp
-            from sklearn.preprocessing import StandardScaler
-            X = StandardScaler().fit_transform(np.transpose(X))
-            PCA = decomp.PCA(n_components=1, svd_solver="arpack")
-            x = PCA.fit_transform(X).flatten()
+            ret[:, 0] = first_component(glob)
         else:
-            x = np.mean(X, axis=0)
-        ret.append(x)
-
-    ret = np.transpose(np.array(ret))
+            ret[:, 0] = glob.mean(axis=0)
+
+    # label x voxel indicator matrix: one product gives the sum of all parcels
+    counts = np.bincount(voxel_labels, minlength=n_labels + 1)
+    indicator = sparse.csr_matrix((np.ones(len(voxel_labels)), (voxel_labels, np.arange(len(voxel_labels)))),
+                                  shape=(n_labels + 1, len(voxel_labels)))
+    sums = indicator @ X
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts[:, None] > 0, sums / counts[:, None], 0)
+    ret[:, int(global_signal):] = means[1:].T
+
+    if pca:
+        order = np.argsort(voxel_labels, kind='stable')
+        bounds = np.cumsum(counts)
+        for l in range(1, n_labels + 1):
+            if counts[l] > 1:
+                ret[:, l - 1 + int(global_signal)] = first_component(X[order[bounds[l - 1]:bounds[l]]])
 
     if global_signal:
         labels = ["GlobSig"] + labels
@@ -923,7 +1271,6 @@ def TsExtractor(labels, labelmap, func, mask, global_signal=True, pca=False, out
     return os.path.join(os.getcwd(), outfile), labels, os.path.join(os.getcwd(), outlabelmap)
 
 
-
 def plot_carpet_ts(timeseries, modules, atlas=None, background_file=None, subplot=None, output_file="regts.png"):
     """
     Adapted from: https://github.com/poldracklab/niworkflows
@@ -1054,6 +1401,12 @@ def plot_carpet_ts(timeseries, modules, atlas=None, background_file=None, subplo
     return [ax0, ax1], gs
 
 def rpn_model(file):
+    from sklearn.feature_selection import SelectKBest
+    from sklearn.linear_model import ElasticNet
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import RobustScaler
+    from sklearn.feature_selection import f_regression
+
     with open(file, 'r') as f_obj:
         data = json.load(f_obj)
     pipeline_steps = []
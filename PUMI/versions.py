@@ -0,0 +1,177 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PUMI import globals
+
+# Nipype provides some in-house interfaces that do not use external software like FSL.
+NIPYPE_IN_HOUSE_MODULES = [
+    'nipype.algorithms.',
+    'nipype.interfaces.image.',
+    'nipype.interfaces.io.',
+    'nipype.interfaces.mixins.',
+    'nipype.interfaces.utility.'
+]
+
+# Commands printing the version of the tools whose interfaces do not report it. The binary of the command is the one
+# probed (and keyed) for all interfaces of the tool, other tools are keyed by the command of the interface.
+VERSION_COMMANDS = {
+    'afni': ['afni', '-ver'],
+    'ants': ['antsRegistration', '--version'],
+    'c3': ['c3d', '-version'],
+    'fsl': ['flirt', '-version'],
+}
+
+_lock = threading.Lock()
+_memo = {}  # probed binary (see binary_key) -> version, for the lifetime of the process
+
+
+def versions_file():
+    return os.path.expanduser(globals.cfg_parser.get('CACHE', 'versions_file',
+                                                     fallback='~/.cache/pumi/tool_versions.json'))
+
+
+def binary_key(cmd):
+    """
+    Return '<path>:<mtime in ns>' of the binary of a command (resolved in PATH), or None if it is not found.
+    A new installation of the tool changes the key.
+    """
+    path = shutil.which(cmd) if cmd else None
+    if path is None:
+        return None
+    path = os.path.realpath(path)
+    return '%s:%d' % (path, os.stat(path).st_mtime_ns)
+
+
+def _load_versions():
+    try:
+        with open(versions_file(), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_version(key, value):
+    # merge with the versions saved by other processes in the meantime
+    path = versions_file()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        versions = _load_versions()
+        versions[key] = value
+        tmp = path + '.tmp_%d_%d' % (os.getpid(), threading.get_ident())
+        with open(tmp, 'w') as f:
+            json.dump(versions, f, indent=1, default=str)
+        os.replace(tmp, path)
+    except OSError as e:
+        print('[PUMI versions] could not save %s: %s' % (path, e))
+
+
+def version_command(interface_name):
+    """
+    Return the command printing the version of the tool of an interface (see VERSION_COMMANDS), or None.
+    """
+    for tool, command in VERSION_COMMANDS.items():
+        if tool in interface_name:
+            return command
+    return None
+
+
+def probe_key(interface):
+    """
+    Return the key of the version probe of an interface: '<path>:<mtime in ns>' of the probed binary (see
+    binary_key), i.e. the binary of the version command of the tool, or the binary of the interface's command for
+    other tools. If the binary is not found, the key is the name of the interface class. None for nipype in-house
+    interfaces.
+    """
+    interface_name = type(interface).__module__ + '.' + type(interface).__name__
+    # Let's see if it's a nipype in-house interface
+    for in_house in NIPYPE_IN_HOUSE_MODULES:
+        if in_house in interface_name:
+            return None
+
+    command = version_command(interface_name)
+    if command is None:
+        try:
+            command = (interface.cmd or '').split()
+        except Exception:  # not a command line interface or no command set
+            command = []
+    return (binary_key(command[0]) if command else None) or interface_name
+
+
+def _probe_interface_version(interface, interface_name):
+    try:
+        version = interface.version
+        if version is not None:
+            return version
+    except AttributeError:
+        pass
+
+    version_cmd = version_command(interface_name)
+    if version_cmd is None:
+        return 'Unknown'
+
+    try:
+        result = subprocess.run(version_cmd, capture_output=True, text=True)
+        return result.stdout.strip()
+    except Exception as e:
+        print(f"Error getting version for {interface_name}: {e}")
+        return 'Unknown'
+
+
+def get_interface_version(interface):
+    """
+
+    Try to get the version number of the underlying tool used in an interface.
+
+    Return None if interface is a nipype in-house interface that does not use external software like FSL.
+    Otherwise, return name of the tool and the version number of the underlying used tool (or the name of the
+    interface and 'Unknown' if the version could not be fetched).
+
+    The version is probed once per tool and process, keyed by the path and mtime of the probed binary (see
+    probe_key), and saved with the same key (versions_file in the [CACHE] section of settings.ini), so that later
+    processes do not run the tools again.
+
+    """
+    key = probe_key(interface)
+    if key is None:
+        return None
+    interface_name = type(interface).__module__ + '.' + type(interface).__name__
+    tool_name = interface_name.split('.')[2]  # e.g., 'fsl', 'ants', 'afni'
+
+    with _lock:
+        version = _memo.get(key)
+    if version is None:
+        persisted = key != interface_name  # the binary is found
+        version = _load_versions().get(key) if persisted else None
+        if version is None:
+            version = _probe_interface_version(interface, interface_name)
+            if persisted and version != 'Unknown':
+                _save_version(key, version)
+        with _lock:
+            _memo[key] = version
+
+    if version == 'Unknown':
+        return interface_name, version
+    return tool_name, version
+
+
+def get_interface_versions(interfaces, max_workers=8):
+    """
+    Probe the versions of the distinct tools (see probe_key) in parallel.
+
+    Returns:
+        versions (dict): Interface class name -> result of get_interface_version.
+    """
+    distinct = {}
+    for interface in interfaces:
+        distinct.setdefault(type(interface).__module__ + '.' + type(interface).__name__, interface)
+    # one interface per tool is probed first, the others are then read from the memo
+    tools = {}
+    for interface in distinct.values():
+        tools.setdefault(probe_key(interface), interface)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(get_interface_version, tools.values()))
+    return {name: get_interface_version(interface) for name, interface in distinct.items()}
@@ -0,0 +1,183 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sys
+from pathlib import Path
+
+import PUMI
+from PUMI import globals
+
+_source_digests = {}
+
+
+def workflow_cache_enabled():
+    return globals.cfg_parser.getboolean('CACHE', 'workflow_cache', fallback=False)
+
+
+def workflow_cache_dir():
+    return os.path.expanduser(globals.cfg_parser.get('CACHE', 'workflow_cache_dir',
+                                                     fallback='~/.cache/pumi/workflows'))
+
+
+def source_digest(path, pattern='*.py'):
+    """
+    Digest of the files matching pattern (default: the python sources) in a directory (recursively) or of a single
+    file.
+    """
+    path = os.path.abspath(path)
+    if (path, pattern) not in _source_digests:
+        files = [path] if os.path.isfile(path) else sorted(str(f) for f in Path(path).rglob(pattern)
+                                                           if f.is_file() and '__pycache__' not in f.parts)
+        sha = hashlib.sha1()
+        for file in files:
+            sha.update(os.path.relpath(file, path).encode())
+            with open(file, 'rb') as f:
+                sha.update(f.read())
+        _source_digests[path, pattern] = sha.hexdigest()
+    return _source_digests[path, pattern]
+
+
+def resources_digest():
+    """
+    Digest of the data files of the top-level resources package (atlases, models) read when building workflows, or
+    None if it is not installed.
+    """
+    import importlib.util
+
+    spec = importlib.util.find_spec('resources')
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    return {location: source_digest(location, '*') for location in spec.submodule_search_locations}
+
+
+def helper_digests(pipeline_fun):
+    """
+    Digests of the modules the module of pipeline_fun imports from (modules, functions and classes in its
+    namespace), except for the standard library and installed packages.
+    """
+    import sysconfig
+
+    installed = tuple(os.path.abspath(sysconfig.get_path(name)) + os.sep for name in ['stdlib', 'purelib', 'platlib'])
+    module = sys.modules.get(pipeline_fun.__module__)
+    digests = {}
+    for value in (vars(module).values() if module is not None else []):
+        helper = value if inspect.ismodule(value) else inspect.getmodule(value)
+        if helper is None or helper is module or helper.__name__.split('.')[0] == 'PUMI':  # PUMI: see workflow_key
+            continue
+        try:
+            file = inspect.getsourcefile(helper)
+        except TypeError:  # built-in module
+            continue
+        if file and not os.path.abspath(file).startswith(installed):
+            digests[helper.__name__] = source_digest(file)
+    return digests
+
+
+def stable_description(value, _seen=None):
+    """
+    JSON-serializable description of an argument that is the same in every process: no memory addresses (e.g. in the
+    default repr of objects and functions). Functions and classes are described by their name and source, other
+    objects by their type and attributes, arrays by their shape and a digest of their data.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, os.PathLike):
+        return os.fspath(value)
+    _seen = _seen or set()
+    if id(value) in _seen:  # reference cycle
+        return type(value).__qualname__
+    _seen = _seen | {id(value)}
+    if isinstance(value, dict):
+        return {str(key): stable_description(v, _seen) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [stable_description(v, _seen) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((stable_description(v, _seen) for v in value), key=repr)
+    if inspect.isfunction(value) or inspect.isclass(value) or inspect.ismethod(value) or inspect.isbuiltin(value):
+        try:
+            source = source_digest(inspect.getsourcefile(value))
+        except (TypeError, OSError):  # built-in or defined interactively
+            source = None
+        name = getattr(value, '__module__', None), getattr(value, '__qualname__', repr(value))
+        bound = stable_description(value.__self__, _seen) if inspect.ismethod(value) else None
+        return {'callable': '%s.%s' % name, 'source': source, 'self': bound}
+    if hasattr(value, 'tobytes') and hasattr(value, 'shape'):  # e.g. numpy arrays
+        return {'shape': list(value.shape), 'digest': hashlib.sha1(value.tobytes()).hexdigest()}
+    if hasattr(value, '__dict__') and type(value).__repr__ is object.__repr__:
+        return {'type': type(value).__module__ + '.' + type(value).__qualname__,
+                'attributes': stable_description(vars(value), _seen)}
+    return repr(value)
+
+
+def workflow_key(pipeline_fun, **arguments):
+    """
+    Key of a constructed workflow: the sources of the pipeline (the module of pipeline_fun, the helper modules it
+    imports from and the PUMI package), the data files of the resources package, the settings (settings.ini incl. the
+    changes made at runtime), the arguments of the pipeline (see stable_description) and the versions of python and
+    nipype (pickle compatibility).
+
+    Parameters:
+        pipeline_fun (function): Function that builds the workflow.
+        arguments: Arguments the workflow is built with.
+
+    Returns:
+        key (str): SHA1 hex digest.
+    """
+    import nipype
+
+    description = {
+        'pipeline': pipeline_fun.__module__ + '.' + pipeline_fun.__qualname__,
+        'pipeline_source': source_digest(inspect.getsourcefile(pipeline_fun)),
+        'helper_sources': helper_digests(pipeline_fun),
+        'pumi_source': source_digest(os.path.dirname(PUMI.__file__)),
+        'resources': resources_digest(),
+        'settings': {section: dict(globals.cfg_parser.items(section)) for section in globals.cfg_parser.sections()},
+        'arguments': stable_description(arguments),
+        'python': sys.version_info[:2],
+        'nipype': nipype.__version__
+    }
+    return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+def load_workflow(key):
+    """
+    Return the workflow saved with the given key, or None if there is none (or it cannot be loaded).
+    """
+    path = os.path.join(workflow_cache_dir(), key + '.pkl')
+    try:
+        with open(path, 'rb') as f:
+            wf = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:  # e.g. saved by an incompatible version of a dependency
+        print('[PUMI workflow cache] could not load %s: %s' % (path, e))
+        return None
+    os.utime(path)  # recently used
+    return wf
+
+
+def save_workflow(key, wf):
+    """
+    Save a constructed (unexpanded) workflow with the given key. Only the workflow_cache_entries (in the [CACHE] section
+    of settings.ini) most recently used workflows are kept.
+    """
+    cache_dir = workflow_cache_dir()
+    path = os.path.join(cache_dir, key + '.pkl')
+    tmp = path + '.tmp_%d' % os.getpid()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(tmp, 'wb') as f:
+            pickle.dump(wf, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except Exception as e:  # e.g. unpicklable objects in the workflow
+        print('[PUMI workflow cache] could not save %s: %s' % (path, e))
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return
+
+    max_entries = globals.cfg_parser.getint('CACHE', 'workflow_cache_entries', fallback=20)
+    entries = sorted(Path(cache_dir).glob('*.pkl'), key=lambda p: p.stat().st_mtime, reverse=True)
+    for entry in entries[max_entries:]:
+        entry.unlink(missing_ok=True)
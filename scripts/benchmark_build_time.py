@@ -0,0 +1,52 @@
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Runs a BIDS app script with --build_only in a fresh interpreter, with the workflow cache in the given directory
+LAUNCH = """import runpy, sys
+from PUMI import globals
+globals.cfg_parser.set('CACHE', 'workflow_cache', %r)
+globals.cfg_parser.set('CACHE', 'workflow_cache_dir', %r)
+sys.argv = %r
+runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+
+
+def build_time(script, args, cache_dir, cached=True):
+    """
+    Construct the workflow of a BIDS app script (e.g. pipelines/rcpl.py) in a fresh interpreter.
+
+    Returns:
+        seconds (float): Time of the workflow construction (or of loading it from the workflow cache).
+        loaded (bool): True if the workflow was loaded from the workflow cache.
+    """
+    code = LAUNCH % ('true' if cached else 'false', cache_dir, [script, *args, '--build_only'])
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    match = re.search(r'\[PUMI\] workflow \S+ (built|loaded from the workflow cache) in ([\d.]+) s', result.stdout)
+    if match is None:
+        raise RuntimeError('No workflow constructed by %s:\n%s' % (script, result.stdout + result.stderr))
+    return float(match.group(2)), match.group(1) != 'built'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the workflow construction of a BIDS app, with and without '
+                                                 'the workflow cache (in fresh interpreters).',
+                                     epilog='Example: python scripts/benchmark_build_time.py pipelines/rcpl.py '
+                                            '--bids_dir data_in/pumi-unittest')
+    parser.add_argument('script', help='BIDS app script')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of launches (the median is reported)')
+    args, script_args = parser.parse_known_args()
+
+    cache_dir = tempfile.mkdtemp(prefix='pumi_workflow_cache_')
+    uncached = [build_time(args.script, script_args, cache_dir, cached=False)[0] for _ in range(args.repeat)]
+    first, _ = build_time(args.script, script_args, cache_dir)  # builds and saves
+    cached = [build_time(args.script, script_args, cache_dir) for _ in range(args.repeat)]
+    if not all(loaded for _, loaded in cached):
+        sys.exit('The workflow was not loaded from the workflow cache.')
+
+    print('without cache:     %8.2f s' % statistics.median(uncached))
+    print('first (and save):  %8.2f s' % first)
+    print('from cache:        %8.2f s' % statistics.median(seconds for seconds, _ in cached))
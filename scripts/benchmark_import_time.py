@@ -0,0 +1,45 @@
+import argparse
+import statistics
+import subprocess
+import sys
+
+# Dependencies that must only be imported where they are used (see the lazy imports in PUMI)
+LAZY_MODULES = ['sklearn', 'templateflow', 'nilearn', 'matplotlib', 'IPython', 'nipype.pipeline.plugins',
+                'PUMI._version']
+
+
+def import_time(module):
+    """
+    Import a module in a fresh interpreter.
+
+    Returns:
+        seconds (float): Cumulative import time of the module (from python -X importtime).
+        lazy_loaded (list): Modules of LAZY_MODULES that were imported.
+    """
+    code = 'import sys, %s; print(" ".join(m for m in %r if m in sys.modules))' % (module, LAZY_MODULES)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                            check=True)
+    seconds = 0
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            seconds = int(fields[1]) / 1e6
+    return seconds, result.stdout.split()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the import time of PUMI modules in fresh interpreters.')
+    parser.add_argument('modules', nargs='*', default=['PUMI', 'PUMI.utils', 'PUMI.engine'])
+    parser.add_argument('--repeat', type=int, default=5, help='Number of imports per module (the median is reported)')
+    parser.add_argument('--max_seconds', type=float, help='Fail if a module takes longer to import')
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        runs = [import_time(module) for _ in range(args.repeat)]
+        seconds = statistics.median(run[0] for run in runs)
+        lazy_loaded = runs[-1][1]
+        print('%-20s %8.1f ms   %s' % (module, seconds * 1000,
+                                      'eagerly imports: ' + ', '.join(lazy_loaded) if lazy_loaded else ''))
+        failed |= bool(lazy_loaded) or (args.max_seconds is not None and seconds > args.max_seconds)
+    sys.exit(1 if failed else 0)
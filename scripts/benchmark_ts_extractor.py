@@ -0,0 +1,66 @@
+import argparse
+import os
+import tempfile
+import time
+import nibabel as nib
+import numpy as np
+import pandas as pd
+from PUMI.utils import TsExtractor
+
+
+def ts_extractor_loop(labels, labelmap, func, mask, global_signal=True):
+    """
+    Label-by-label, voxel-by-voxel implementation TsExtractor used before the vectorized engine (without pca).
+    """
+    func_data = nib.load(func).get_fdata()
+    labelmap_data = nib.load(labelmap).get_fdata()
+    mask_data = nib.load(mask).get_fdata()
+    labelmap_data[mask_data == 0] = 0
+
+    ret = []
+    if global_signal:
+        X = [func_data[i[0], i[1], i[2], :] for i in np.argwhere(mask_data > 0)]
+        X = [x for x in X if np.std(x) > 0.000001]
+        ret.append(np.mean(X, axis=0) if len(X) else np.repeat(0, func_data.shape[3]))
+
+    for l in range(1, len(labels) + 1):
+        X = [func_data[i[0], i[1], i[2], :] for i in np.argwhere(labelmap_data == l)]
+        X = [x for x in X if np.std(x) > 0.000001]
+        ret.append(np.mean(X, axis=0) if len(X) else np.repeat(0, func_data.shape[3]))
+
+    return np.transpose(np.array(ret))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark TsExtractor on a synthetic 4D image in the MIST grid.')
+    parser.add_argument('--resolution', default='444', help='MIST resolution (default: 444)')
+    parser.add_argument('--volumes', type=int, default=200, help='Number of volumes of the synthetic image')
+    args = parser.parse_args()
+
+    resources = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'resources')
+    labelmap = os.path.join(resources, 'MIST_' + args.resolution + '.nii.gz')
+    labels = pd.read_csv(os.path.join(resources, 'MIST_' + args.resolution + '.csv'), sep=';')['label'].tolist()
+
+    os.chdir(tempfile.mkdtemp())
+    atlas = nib.load(labelmap)
+    rng = np.random.default_rng(42)
+    func_data = rng.normal(100, 10, atlas.shape + (args.volumes,)).astype(np.float32)
+    func_data[::7] = 100  # some constant voxels
+    func = os.path.abspath('func.nii.gz')
+    nib.save(nib.Nifti1Image(func_data, atlas.affine), func)
+    mask = os.path.abspath('mask.nii.gz')
+    nib.save(nib.Nifti1Image((atlas.get_fdata() > 0).astype(np.uint8), atlas.affine), mask)
+
+    start = time.time()
+    reference = ts_extractor_loop(labels, labelmap, func, mask)
+    loop_time = time.time() - start
+
+    start = time.time()
+    out_file, _, _ = TsExtractor(labels, labelmap, func, mask)
+    vectorized_time = time.time() - start
+
+    max_diff = np.abs(pd.read_csv(out_file, sep='\t').values - reference).max()
+    print(f'MIST_{args.resolution}, {args.volumes} volumes')
+    print(f'loop:       {loop_time:8.2f} s')
+    print(f'vectorized: {vectorized_time:8.2f} s')
+    print(f'speedup:    {loop_time / vectorized_time:8.1f}x (max. abs. difference: {max_diff:.2e})')
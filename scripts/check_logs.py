@@ -1,6 +1,9 @@
 import argparse
 from pathlib import Path
 
+# Note: the runs are also recorded in the run ledger (see PUMI.ledger), 'pumi-runs failed' lists the failed subjects
+# with their failed nodes, hosts, crash files and exit reasons, 'pumi-runs retry' reruns them.
+
 
 if __name__ == '__main__':
     # Create CLI argument
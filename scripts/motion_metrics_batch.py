@@ -0,0 +1,24 @@
+import argparse
+import time
+from pathlib import Path
+from PUMI.utils import motion_metrics_batch
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='FD summary statistics for all MCFLIRT par files of a cohort.')
+    parser.add_argument('--derivatives_dir', help='Directory to search (recursively) for motion parameter files',
+                        required=True)
+    parser.add_argument('--pattern', default='*.par', help='Filename pattern of the motion parameter files')
+    parser.add_argument('--fd_mode', default='Power', choices=['Power', 'Jenkinson'])
+    parser.add_argument('--threshold', type=float, default=0.2, help='FD threshold in mm')
+    parser.add_argument('--out_file', default='motion_metrics.tsv')
+    args = parser.parse_args()
+
+    derivatives_dir = Path(args.derivatives_dir)
+    if not derivatives_dir.exists():
+        raise ValueError('Derivatives directory does not exist!')
+
+    par_files = sorted(str(par_file) for par_file in derivatives_dir.glob('**/' + args.pattern))
+    start = time.time()
+    df = motion_metrics_batch(par_files, fd_mode=args.fd_mode, threshold=args.threshold, out_file=args.out_file)
+    print(f'{len(df)} motion parameter files processed in {time.time() - start:.2f} s, saved to {args.out_file}')
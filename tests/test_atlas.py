@@ -0,0 +1,74 @@
+import heapq
+import operator
+import os
+import tempfile
+import unittest
+import nibabel as nib
+import numpy as np
+from scipy.spatial.distance import dice
+from PUMI.pipelines.multimodal.atlas import dummy_labels, get_det_atlas, relabel_atlas
+
+
+def modules_loop(labels, labelmap_data, labels_modules, modules_data, module_threshold):
+    # reference: region-by-region, module-by-module dice on the full volumes
+    modules = ['NA'] * len(labels)
+    for i in range(len(labels)):
+        dice_coeff = np.array([1 - dice((labelmap_data == i).ravel().astype(float),
+                                        (modules_data == j).ravel().astype(float))
+                               for j in range(len(labels_modules))])
+        pos = heapq.nlargest(2, range(len(dice_coeff)), key=dice_coeff.__getitem__)
+        val = heapq.nlargest(2, dice_coeff)
+        if pos[0] != 0:
+            modules[i] = labels_modules[pos[0]]
+        elif val[0] < module_threshold:
+            modules[i] = labels_modules[pos[1]]
+    return modules
+
+
+class TestAtlas(unittest.TestCase):
+
+    def test_get_det_atlas(self):
+        os.chdir(tempfile.mkdtemp())
+        rng = np.random.default_rng(0)
+        maps = rng.random((7, 6, 5, 9)).astype(np.float32)
+        maps[0, 0, 0] = 0.1  # ties: first component wins
+        nib.save(nib.Nifti1Image(maps, np.eye(4)), 'maps.nii.gz')
+
+        for threshold in [0, 0.8]:
+            expected = np.zeros(maps.shape[:3])
+            for x in np.ndindex(maps.shape[:3]):
+                idx, value = max(enumerate(maps[x].flatten()), key=operator.itemgetter(1))
+                if value > threshold:
+                    expected[x] = idx + 1
+            np.testing.assert_array_equal(get_det_atlas('maps.nii.gz', threshold).get_fdata(), expected)
+
+    def test_dummy_labels(self):
+        labels = dummy_labels(np.array([[3., 0.], [1., 3.]]))
+        self.assertEqual(list(labels.index), [0, 1, 3])
+        self.assertEqual(list(labels['Region']), ['Background', 'Component 1', 'Component 3'])
+
+    def test_same_as_full_volume_dice(self):
+        os.chdir(tempfile.mkdtemp())
+        rng = np.random.default_rng(0)
+        labelmap_data = rng.integers(0, 12, size=(10, 10, 8)).astype(float)
+        modules_data = np.zeros((10, 10, 8))
+        modules_data[:5] = 1
+        modules_data[5:, :5] = 2
+        modules_data[labelmap_data == 3] = 3
+        modules_data[0, 0, 0] = 7  # outside of the module labels
+        for name, data in [('labelmap', labelmap_data), ('modules', modules_data)]:
+            nib.save(nib.Nifti1Image(data, np.eye(4)), name + '.nii.gz')
+
+        labels = ['Background'] + ['region_%d' % i for i in range(1, 13)]  # region 12 is empty
+        labels_modules = ['Background', 'mod_a', 'mod_b', 'mod_c']
+
+        for module_threshold in [0, 0.5]:
+            reordered_labels, reordered_modules, _ = relabel_atlas(labels, 'labelmap.nii.gz', labels_modules, 'modules.nii.gz',
+                                                    module_threshold=module_threshold)
+            expected = modules_loop(labels, labelmap_data, labels_modules, modules_data, module_threshold)
+            self.assertEqual(dict(zip(reordered_labels, reordered_modules)), dict(zip(labels, expected)))
+            self.assertEqual(expected[3], 'mod_c')
+
+
+if __name__ == '__main__':
+    unittest.main()
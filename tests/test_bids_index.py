@@ -0,0 +1,43 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from bids import BIDSLayout
+from PUMI.bids_index import get_layout_index, FINGERPRINT_FILE
+
+
+def add_subject(bids_dir, subject):
+    os.makedirs(os.path.join(bids_dir, 'sub-' + subject, 'anat'))
+    open(os.path.join(bids_dir, 'sub-' + subject, 'anat', 'sub-%s_T1w.nii.gz' % subject), 'w').close()
+
+
+class TestLayoutIndex(unittest.TestCase):
+
+    def test_reuse_and_invalidation(self):
+        tmp = tempfile.mkdtemp()
+        bids_dir = os.path.join(tmp, 'bids')
+        os.makedirs(bids_dir)
+        with open(os.path.join(bids_dir, 'dataset_description.json'), 'w') as f:
+            json.dump({'Name': 'test', 'BIDSVersion': '1.6.0'}, f)
+        add_subject(bids_dir, '01')
+
+        database_path = get_layout_index(bids_dir, tmp)
+        self.assertEqual(BIDSLayout.load(database_path).get_subjects(), ['01'])
+        created = os.stat(os.path.join(database_path, FINGERPRINT_FILE)).st_mtime_ns
+
+        # unchanged dataset (derivatives are ignored): the index is reused
+        os.makedirs(os.path.join(bids_dir, 'derivatives', 'pumi'))
+        time.sleep(0.01)
+        self.assertEqual(get_layout_index(bids_dir, tmp), database_path)
+        self.assertEqual(os.stat(os.path.join(database_path, FINGERPRINT_FILE)).st_mtime_ns, created)
+
+        # new subject: the index is rebuilt
+        add_subject(bids_dir, '02')
+        self.assertEqual(get_layout_index(bids_dir, tmp), database_path)
+        self.assertEqual(BIDSLayout.load(database_path).get_subjects(), ['01', '02'])
+        self.assertTrue(os.path.islink(database_path))  # switched to the new version atomically
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from nipype import Function
+from PUMI import cache, globals
+from PUMI.cache import ResultCache, hash_file
+from PUMI.engine import CachedNode, NestedMapNode, NestedWorkflow
+from PUMI.engine import NestedNode as Node
+
+
+def write_sum(in_file, offset):
+    import os
+    with open(in_file, 'r') as f:
+        value = float(f.read()) + offset
+    out_file = os.path.join(os.getcwd(), 'sum.txt')
+    with open(out_file, 'w') as f:
+        f.write(str(value))
+    return out_file
+
+
+def add_one(value):
+    return value + 1
+
+
+class TestResultCache(unittest.TestCase):
+
+    def test_cache_hit_across_base_dirs(self):
+        tmp = tempfile.mkdtemp()
+        in_file = os.path.join(tmp, 'in.txt')
+        with open(in_file, 'w') as f:
+            f.write('1')
+
+        globals.cfg_parser.set('CACHE', 'enabled', 'true')
+        globals.cfg_parser.set('CACHE', 'cache_dir', os.path.join(tmp, 'cache'))
+        try:
+            results = []
+            for wf_name in ['rcpl', 'hcp']:
+                wf = NestedWorkflow(wf_name, base_dir=os.path.join(tmp, wf_name))
+                node = Node(Function(input_names=['in_file', 'offset'], output_names=['out_file'],
+                                     function=write_sum), name='sum')
+                node.inputs.in_file = in_file
+                node.inputs.offset = 2
+                wf.add_nodes([node])
+                graph = wf.run(plugin='Linear')
+                results.append(list(graph.nodes())[0].result)
+        finally:
+            globals.cfg_parser.set('CACHE', 'enabled', 'false')
+
+        out_files = [result.outputs.out_file for result in results]
+        self.assertNotEqual(out_files[0], out_files[1])
+        self.assertEqual(os.stat(out_files[0]).st_ino, os.stat(out_files[1]).st_ino)  # hardlinked from the cache
+        self.assertEqual(results[1].runtime.duration, 0)
+
+        result_cache = ResultCache(os.path.join(tmp, 'cache'))
+        self.assertEqual(len(result_cache.entries()), 1)
+        self.assertEqual(len(result_cache.prune(max_size=0)), 1)
+        self.assertEqual(len(result_cache.entries()), 0)
+
+    def test_map_node(self):
+        tmp = tempfile.mkdtemp()
+        globals.cfg_parser.set('CACHE', 'enabled', 'true')
+        globals.cfg_parser.set('CACHE', 'cache_dir', os.path.join(tmp, 'cache'))
+        try:
+            node = NestedMapNode(Function(input_names=['value'], output_names=['value'], function=add_one),
+                                 iterfield=['value'], name='add_one')
+            node.inputs.value = [1, 2]
+            subnodes = [subnode for _, subnode in node._make_nodes(cwd=tmp)]
+            self.assertEqual([type(subnode) for subnode in subnodes], [CachedNode, CachedNode])
+            self.assertEqual([subnode.inputs.value for subnode in subnodes], [1, 2])
+
+            results = [subnode.run() for subnode in subnodes]
+            cached = [subnode.run() for _, subnode in node._make_nodes(cwd=os.path.join(tmp, 'other'))]
+        finally:
+            globals.cfg_parser.set('CACHE', 'enabled', 'false')
+        self.assertEqual([result.outputs.value for result in cached], [2, 3])
+        self.assertEqual([result.runtime.duration for result in cached], [0, 0])
+        self.assertEqual(len(ResultCache(os.path.join(tmp, 'cache')).entries()), len(results))
+
+    def test_file_digest(self):
+        tmp = tempfile.mkdtemp()
+        in_file = os.path.join(tmp, 'in.txt')
+        with open(in_file, 'w') as f:
+            f.write('1')
+
+        with mock.patch.object(cache, 'hash_file', wraps=hash_file) as hashed:
+            digest = ResultCache(os.path.join(tmp, 'cache')).file_digest(in_file)
+            self.assertEqual(digest, hash_file(in_file))
+            cache._file_digests.clear()  # another process: the digest is read from the cache directory
+            self.assertEqual(ResultCache(os.path.join(tmp, 'cache')).file_digest(in_file), digest)
+            self.assertEqual(hashed.call_count, 1)
+
+            with open(in_file, 'w') as f:
+                f.write('2')
+            os.utime(in_file, ns=(0, 0))  # changed: hashed again
+            self.assertNotEqual(ResultCache(os.path.join(tmp, 'cache')).file_digest(in_file), digest)
+            self.assertEqual(hashed.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+import unittest
+from nipype import Function
+from nipype.interfaces.io import DataSink
+from PUMI import globals
+from PUMI.cleanup import MARKER_FILE
+from PUMI.engine import NestedWorkflow
+from PUMI.engine import NestedNode as Node
+
+
+def make_image(size):
+    import os
+    import nibabel as nib
+    import numpy as np
+    out_file = os.path.abspath('image.nii')
+    nib.save(nib.Nifti1Image(np.random.rand(size, size, size, 4).astype(np.float32), np.eye(4)), out_file)
+    return out_file
+
+
+def mean_image(in_file):
+    import nibabel as nib
+    return float(nib.load(in_file).get_fdata().mean())
+
+
+class TestCleanup(unittest.TestCase):
+
+    def build(self, tmp):
+        wf = NestedWorkflow('wf', base_dir=os.path.join(tmp, 'work'))
+        for name in ['intermediate', 'sinked']:
+            producer = Node(Function(input_names=['size'], output_names=['out_file'], function=make_image),
+                            name=name)
+            producer.inputs.size = 40
+            consumer = Node(Function(input_names=['in_file'], output_names=['mean'], function=mean_image),
+                            name=name + '_mean')
+            wf.connect(producer, 'out_file', consumer, 'in_file')
+        sinker = Node(DataSink(base_directory=os.path.join(tmp, 'derivatives')), name='sinker')
+        wf.connect('sinked', 'out_file', sinker, 'sinked')
+        return wf
+
+    def test_cleanup(self):
+        tmp = tempfile.mkdtemp()
+        prune = globals.cfg_parser.get('OPTIMIZE', 'prune')
+        merge_duplicates = globals.cfg_parser.get('OPTIMIZE', 'merge_duplicates')
+        globals.cfg_parser.set('WORKDIR', 'cleanup', 'true')
+        globals.cfg_parser.set('WORKDIR', 'min_size_mb', '0.1')
+        globals.cfg_parser.set('OPTIMIZE', 'prune', 'false')  # the consumers are not sinked
+        globals.cfg_parser.set('OPTIMIZE', 'merge_duplicates', 'false')  # the two branches are identical
+        try:
+            self.build(tmp).run(plugin='MultiProc', plugin_args={'n_procs': 1})
+
+            intermediate = os.path.join(tmp, 'work', 'wf', 'intermediate', 'image.nii')
+            sinked = os.path.join(tmp, 'work', 'wf', 'sinked', 'image.nii')
+            self.assertEqual(os.stat(intermediate).st_blocks, 0)  # removed, sparse placeholder left
+            self.assertEqual(os.path.getsize(intermediate), os.path.getsize(sinked))
+            self.assertGreater(os.stat(sinked).st_blocks, 0)  # routed to the sinker: kept
+            with open(os.path.join(tmp, 'work', 'wf', 'intermediate', MARKER_FILE)) as f:
+                self.assertEqual(json.load(f)['files'], ['image.nii'])
+
+            # a rerun finds all nodes done
+            result_files = [os.path.join(tmp, 'work', 'wf', name, 'result_%s.pklz' % name)
+                            for name in ['intermediate', 'intermediate_mean']]
+            mtimes = [os.path.getmtime(f) for f in result_files]
+            self.build(tmp).run(plugin='MultiProc', plugin_args={'n_procs': 1})
+            self.assertEqual([os.path.getmtime(f) for f in result_files], mtimes)
+        finally:
+            globals.cfg_parser.set('WORKDIR', 'cleanup', 'false')
+            globals.cfg_parser.set('WORKDIR', 'min_size_mb', '1')
+            globals.cfg_parser.set('OPTIMIZE', 'prune', prune)
+            globals.cfg_parser.set('OPTIMIZE', 'merge_duplicates', merge_duplicates)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+import nibabel as nib
+import numpy as np
+from PUMI.utils import denoise_func, drop_first_line, scale_vol
+
+
+class TestDenoise(unittest.TestCase):
+
+    # maximal RMS difference to the FSL/AFNI chain, relative to the RMS of its output
+    TOLERANCE = 0.05
+    n_vols, tr = 120, 2.0
+
+    def setUp(self):
+        os.chdir(tempfile.mkdtemp())
+        rng = np.random.default_rng(0)
+        n_vols, tr = self.n_vols, self.tr
+        affine = np.eye(4)
+
+        confounds = rng.normal(size=(n_vols, 24))
+        func_data = 100 + rng.normal(size=(5, 5, 4, n_vols)) + rng.normal(size=(5, 5, 4, 1)) * confounds[:, 0]
+        func_data[0, 0, 0] = 0  # background voxel
+        noise_roi = np.zeros((5, 5, 4))
+        noise_roi[:, :, 0] = 1
+        fd = np.full(n_vols - 1, 0.1)
+        fd[[10, 50]] = 0.5
+
+        img = nib.Nifti1Image(func_data.astype(np.float32), affine)
+        img.header.set_zooms((3, 3, 3, tr))
+        nib.save(img, 'func.nii.gz')
+        nib.save(nib.Nifti1Image(noise_roi, affine), 'noise_roi.nii.gz')
+        np.savetxt('friston24.txt', confounds)
+        np.savetxt('fd.txt', fd, header='FramewiseDisplacement', comments='')
+
+    def test_regression_and_bandpass(self):
+        n_vols, tr = self.n_vols, self.tr
+        out_file, scrubbed_image, compcor_file, fd_scrubbed_file, _ = denoise_func(
+            'func.nii.gz', 'noise_roi.nii.gz', 'friston24.txt', fd_file='fd.txt')
+
+        self.assertEqual(np.loadtxt(compcor_file).shape, (n_vols, 5))
+        out = nib.load(out_file).get_fdata()
+        np.testing.assert_array_equal(out[0, 0, 0], 0)
+
+        # no power outside of the passband
+        freqs = np.fft.rfftfreq(n_vols, d=tr)
+        power = np.abs(np.fft.rfft(out[1:].reshape(-1, n_vols), axis=1))
+        self.assertLess(power[:, (freqs < 0.008) | (freqs > 0.08)].max(), 1e-3)
+
+        # frames are selected on the FD series (n_vols - 1 values), as in datacens_workflow_threshold
+        self.assertEqual(nib.load(scrubbed_image).shape[3], n_vols - 3)
+        self.assertEqual(len(np.loadtxt(fd_scrubbed_file, delimiter=',')), n_vols - 3)
+
+    def test_same_compcor_as_nipype(self):
+        from nipype.algorithms.confounds import ACompCor
+
+        _, _, compcor_file, _, _ = denoise_func('func.nii.gz', 'noise_roi.nii.gz', 'friston24.txt')
+
+        # the default chain: scale_vol -> ACompCor -> drop_first_line (see compcor)
+        components_file = ACompCor(realigned_file=scale_vol('func.nii.gz'), mask_files=['noise_roi.nii.gz'],
+                                   pre_filter='polynomial', header_prefix='', num_components=5,
+                                   repetition_time=self.tr).run().outputs.components_file
+        reference = np.loadtxt(drop_first_line(components_file))
+        native = np.loadtxt(compcor_file)
+        self.assertEqual(native.shape, reference.shape)
+        # the components are unit vectors, up to their sign
+        signs = np.sign(np.sum(native * reference, axis=0))
+        np.testing.assert_allclose(native * signs, reference, atol=1e-4)
+
+    @unittest.skipUnless(shutil.which('fsl_regfilt') and shutil.which('3dBandpass'), 'FSL or AFNI is not installed')
+    def test_same_as_fsl_afni(self):
+        from nipype.interfaces import afni, fsl
+
+        out_file, _, compcor_file, _, _ = denoise_func('func.nii.gz', 'noise_roi.nii.gz', 'friston24.txt')
+
+        # the default chain on the same regressors: fsl.FilterRegressor -> afni.Bandpass (see temporal_filtering)
+        np.savetxt('design.txt', np.hstack((np.loadtxt(compcor_file), np.loadtxt('friston24.txt'))))
+        regressed = fsl.FilterRegressor(in_file='func.nii.gz', design_file='design.txt', filter_all=True,
+                                        out_file='regressed.nii.gz').run().outputs.out_file
+        bandpass = afni.Bandpass(in_file=regressed, tr=self.tr, highpass=0.008, lowpass=0.08, despike=False,
+                                 no_detrend=False, notrans=True, outputtype='NIFTI_GZ').run().outputs.out_file
+
+        brain = nib.load('func.nii.gz').get_fdata()[..., 0] != 0
+        native = nib.load(out_file).get_fdata()[brain]
+        reference = nib.load(bandpass).get_fdata()[brain]
+        relative_rms = np.sqrt(np.mean((native - reference) ** 2)) / np.sqrt(np.mean(reference ** 2))
+        self.assertLess(relative_rms, self.TOLERANCE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+import nibabel as nib
+import numpy as np
+from nipype.interfaces import fsl
+from PUMI import globals
+from PUMI import resources
+from PUMI.engine import BidsPipeline
+from PUMI.engine import NestedNode as Node
+from PUMI.estimate import estimate_run, print_estimate, subject_voxels
+
+OUTPUT_QUERY = {'bold': dict(datatype='func', suffix='bold', extension=['nii', 'nii.gz'])}
+
+
+@BidsPipeline(output_query=OUTPUT_QUERY)
+def motion_correction(wf, **kwargs):
+    mcflirt = Node(fsl.MCFLIRT(), name='mcflirt')
+    wf.connect('inputspec', 'bold', mcflirt, 'in_file')
+    wf.connect(mcflirt, 'out_file', 'sinker', 'motion_corrected')
+
+
+class TestEstimate(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.bids_dir = os.path.join(self.tmp, 'bids')
+        os.makedirs(self.bids_dir)
+        with open(os.path.join(self.bids_dir, 'dataset_description.json'), 'w') as f:
+            json.dump({'Name': 'test', 'BIDSVersion': '1.6.0'}, f)
+        for subject, n_vols in [('01', 10), ('02', 100)]:
+            func_dir = os.path.join(self.bids_dir, 'sub-' + subject, 'func')
+            os.makedirs(func_dir)
+            nib.save(nib.Nifti1Image(np.zeros((4, 4, 4, n_vols), dtype=np.uint8), np.eye(4)),
+                     os.path.join(func_dir, 'sub-%s_task-rest_bold.nii.gz' % subject))
+        self.settings = [('PROFILE', 'db_path', os.path.join(self.tmp, 'profile.sqlite')),
+                         ('CACHE', 'workflow_cache', 'false')]
+        self.defaults = [(section, option, globals.cfg_parser.get(section, option))
+                         for section, option, _ in self.settings]
+        for section, option, value in self.settings:
+            globals.cfg_parser.set(section, option, value)
+
+    def tearDown(self):
+        for section, option, value in self.defaults:
+            globals.cfg_parser.set(section, option, value)
+        resources._history.clear()
+
+    def test_estimate(self):
+        self.assertEqual(subject_voxels(self.bids_dir, '02', OUTPUT_QUERY), {'bold': 4 * 4 * 4 * 100})
+
+        wf = motion_correction('motion_correction', bids_dir=self.bids_dir, subjects=['01', '02'],
+                               base_dir=os.path.join(self.tmp, 'work'),
+                               sink_dir=os.path.join(self.tmp, 'derivatives'), build_only=True)
+        estimate = estimate_run(wf, self.bids_dir, ['01', '02'])
+
+        mcflirt_s = resources.DEFAULT_RUNTIMES['fsl.MCFLIRT']
+        output_bytes = resources.DEFAULT_OUTPUT_BYTES['fsl.MCFLIRT'] * 4 * 4 * 4 * 110
+        stage = estimate['stages']['motion_correction']
+        self.assertAlmostEqual(stage['cpu_h'], 2 * mcflirt_s / 3600)
+        self.assertAlmostEqual(stage['scratch_gb'], output_bytes / 1024 ** 3)
+        self.assertAlmostEqual(stage['sink_gb'], output_bytes / 1024 ** 3)
+        self.assertGreater(estimate['subjects']['02']['peak_mem_gb'], estimate['subjects']['01']['peak_mem_gb'])
+        self.assertEqual(estimate['history'], 0)
+
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            print_estimate(estimate, memory_gb=0.01)
+        self.assertIn('motion_correction', stdout.getvalue())
+        self.assertIn('Warning', stdout.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
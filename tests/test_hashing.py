@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+import nibabel as nib
+import numpy as np
+from nipype import Function
+from PUMI import globals
+from PUMI.engine import NestedNode as Node
+from PUMI.hashing import hash_file, hash_file_fast
+
+
+def mean_image(in_file):
+    import nibabel as nib
+    return float(nib.load(in_file).get_fdata().mean())
+
+
+class TestHashing(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.in_file = os.path.join(self.tmp, 'func.nii.gz')
+        nib.save(nib.Nifti1Image(np.random.rand(20, 20, 20, 50).astype(np.float32), np.eye(4)), self.in_file)
+
+    def test_hash_file_fast(self):
+        digest = hash_file_fast(self.in_file, block_size=1024, n_blocks=4)
+        copy = os.path.join(self.tmp, 'copy.nii.gz')
+        shutil.copy(self.in_file, copy)
+        os.utime(copy, (0, 0))
+        self.assertEqual(hash_file_fast(copy, block_size=1024, n_blocks=4), digest)
+
+        image = nib.load(self.in_file)
+        nib.save(nib.Nifti1Image(image.get_fdata().astype(np.float32), np.diag([2, 2, 2, 1])), copy)
+        self.assertNotEqual(hash_file_fast(copy, block_size=1024, n_blocks=4), digest)
+
+    def test_other_files_by_content(self):
+        regressors = os.path.join(self.tmp, 'regressors.txt')
+        content = bytearray(b'0.5\n' * 1024 ** 2)
+        with open(regressors, 'wb') as f:
+            f.write(content)
+        digest = hash_file(regressors, 'fast')
+        content[len(content) // 2 + 1] = ord('7')  # between the blocks a sampled digest would read
+        with open(regressors, 'wb') as f:
+            f.write(content)
+        self.assertNotEqual(hash_file(regressors, 'fast'), digest)
+
+    def test_node_hash(self):
+        def hashval():
+            node = Node(Function(input_names=['in_file'], output_names=['mean'], function=mean_image), name='mean')
+            node.inputs.in_file = self.in_file
+            node.base_dir = self.tmp
+            return node._get_hashval()[1]
+
+        default_method = globals.cfg_parser.get('HASHING', 'method')
+        try:
+            for method, unchanged in [('fast', True), ('timestamp', False)]:
+                globals.cfg_parser.set('HASHING', 'method', method)
+                before = hashval()
+                stat = os.stat(self.in_file)
+                os.utime(self.in_file, (stat.st_atime + 10, stat.st_mtime + 10))  # e.g. copied to another filesystem
+                self.assertEqual(hashval() == before, unchanged)
+        finally:
+            globals.cfg_parser.set('HASHING', 'method', default_method)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import subprocess
+import sys
+import unittest
+
+# Heavy dependencies that PUMI must only import where they are used
+LAZY_MODULES = ['sklearn', 'templateflow', 'nilearn', 'matplotlib', 'IPython', 'nipype.pipeline.plugins',
+                'PUMI._version']
+
+
+def eagerly_imported(module):
+    code = 'import sys, %s; print(" ".join(m for m in %r if m in sys.modules))' % (module, LAZY_MODULES)
+    return subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.split()
+
+
+class TestImportTime(unittest.TestCase):
+
+    def test_lazy_imports(self):
+        for module in ['PUMI', 'PUMI.utils', 'PUMI.engine']:
+            self.assertEqual(eagerly_imported(module), [], module)
+
+    def test_version(self):
+        import PUMI
+        self.assertEqual(PUMI.__version__, PUMI.get_version())
+        self.assertTrue(PUMI.get_version())
+
+
+if __name__ == '__main__':
+    unittest.main()
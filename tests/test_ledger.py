@@ -0,0 +1,75 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from nipype import Function
+from nipype.interfaces.utility import IdentityInterface
+from PUMI import globals
+from PUMI.engine import NestedWorkflow
+from PUMI.engine import NestedNode as Node
+from PUMI.ledger import RunLedger, launch_command, main, record_run
+
+
+def check_subject(subject):
+    if subject == '02':
+        raise ValueError('broken input of subject ' + subject)
+    return subject
+
+
+class TestLedger(unittest.TestCase):
+
+    def test_launch_command(self):
+        self.assertEqual(launch_command(['rcpl', '--bids_dir', 'data', '--participant_label', '01', '02', '--n_procs',
+                                         '4', '--shard', '1/4']),
+                         ['rcpl', '--bids_dir', 'data', '--n_procs', '4'])
+        self.assertEqual(launch_command(['rcpl.py', '--participant_label=01', '--shard=0/2'], executable='python'),
+                         ['python', 'rcpl.py'])
+
+    def test_ledger(self):
+        tmp = tempfile.mkdtemp()
+        db_path = os.path.join(tmp, 'runs.sqlite')
+
+        wf = NestedWorkflow('rcpl', base_dir=os.path.join(tmp, 'work'))
+        wf.config['execution']['crashdump_dir'] = tmp
+        subject_iterator = Node(IdentityInterface(fields=['subject']), name='subject_iterator')
+        subject_iterator.iterables = [('subject', ['01', '02'])]
+        check = Node(Function(input_names=['subject'], output_names=['subject'], function=check_subject),
+                     name='check')
+        check.keep = True
+        wf.connect(subject_iterator, 'subject', check, 'subject')
+
+        default_db_path = globals.cfg_parser.get('LEDGER', 'db_path')
+        globals.cfg_parser.set('LEDGER', 'enabled', 'true')
+        globals.cfg_parser.set('LEDGER', 'db_path', db_path)
+        try:
+            with mock.patch.object(sys, 'argv', ['rcpl', '--bids_dir', 'data', '--participant_label', '01', '02']):
+                with self.assertRaises(RuntimeError), record_run('rcpl', ['01', '02'], tmp) as run_id:
+                    wf.run(plugin='Linear')
+        finally:
+            globals.cfg_parser.set('LEDGER', 'enabled', 'false')
+            globals.cfg_parser.set('LEDGER', 'db_path', default_db_path)
+
+        ledger = RunLedger(db_path)
+        self.assertEqual(ledger.query('SELECT subject, status FROM subjects WHERE run_id = ? ORDER BY subject',
+                                      (run_id,)), [('01', 'done'), ('02', 'failed')])
+        nodes = ledger.query('SELECT subject, node, status, exit_reason FROM nodes WHERE run_id = ? ORDER BY subject',
+                             (run_id,))
+        self.assertEqual([row[:3] for row in nodes], [('01', 'check', 'done'), ('02', 'check', 'failed')])
+        self.assertIn('ValueError: broken input of subject 02', nodes[1][3])
+
+        command, cwd, subjects = ledger.retry_command()
+        self.assertEqual(command, ['rcpl', '--bids_dir', 'data', '--participant_label', '02'])
+        self.assertEqual((cwd, subjects), (os.getcwd(), ['02']))
+
+        stdout = io.StringIO()
+        with mock.patch.object(sys, 'argv', ['pumi-runs', '--db_path', db_path, 'failed']), \
+                contextlib.redirect_stdout(stdout):
+            main()
+        self.assertIn('broken input of subject 02', stdout.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
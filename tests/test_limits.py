@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from PUMI import limits
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+class TestLimits(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp, 'cgroup')
+        self.proc_cgroup = os.path.join(self.tmp, 'proc_cgroup')
+
+    def test_cgroup_v2(self):
+        write(self.proc_cgroup, '0::/slurm/job_42\n')
+        write(os.path.join(self.root, 'cgroup.controllers'), 'cpu memory')
+        write(os.path.join(self.root, 'cpu.max'), 'max 100000')
+        write(os.path.join(self.root, 'slurm', 'memory.max'), str(8 * 1024 ** 3))  # parent limit applies
+        write(os.path.join(self.root, 'slurm', 'job_42', 'cpu.max'), '250000 100000')
+        write(os.path.join(self.root, 'slurm', 'job_42', 'memory.max'), 'max')
+
+        self.assertEqual(limits.cgroup_cpu_limit(self.root, self.proc_cgroup), 2.5)
+        self.assertEqual(limits.cgroup_memory_limit_gb(self.root, self.proc_cgroup), 8)
+        with mock.patch.object(limits, 'affinity_cpus', return_value=16), \
+                mock.patch.object(limits, 'host_memory_gb', return_value=64):
+            detected = limits.effective_limits(self.root, self.proc_cgroup)
+        self.assertEqual((detected['n_procs'], detected['memory_gb']), (2, 8))
+        self.assertIn('cgroup quota: 2.50', detected['description'])
+
+    def test_cgroup_v1(self):
+        write(self.proc_cgroup, '4:memory:/docker/abc\n2:cpu,cpuacct:/docker/abc\n0::/\n')
+        write(os.path.join(self.root, 'memory', 'memory.limit_in_bytes'), '9223372036854771712')  # unlimited
+        write(os.path.join(self.root, 'cpu,cpuacct', 'cpu.cfs_quota_us'), '-1')
+        write(os.path.join(self.root, 'cpu,cpuacct', 'cpu.cfs_period_us'), '100000')
+        self.assertIsNone(limits.cgroup_cpu_limit(self.root, self.proc_cgroup))
+        self.assertIsNone(limits.cgroup_memory_limit_gb(self.root, self.proc_cgroup))
+
+        write(os.path.join(self.root, 'memory', 'docker', 'abc', 'memory.limit_in_bytes'), str(4 * 1024 ** 3))
+        write(os.path.join(self.root, 'cpu,cpuacct', 'docker', 'abc', 'cpu.cfs_quota_us'), '400000')
+        write(os.path.join(self.root, 'cpu,cpuacct', 'docker', 'abc', 'cpu.cfs_period_us'), '100000')
+        self.assertEqual(limits.cgroup_cpu_limit(self.root, self.proc_cgroup), 4)
+        self.assertEqual(limits.cgroup_memory_limit_gb(self.root, self.proc_cgroup), 4)
+        with mock.patch.object(limits, 'affinity_cpus', return_value=2), \
+                mock.patch.object(limits, 'host_memory_gb', return_value=64):
+            detected = limits.effective_limits(self.root, self.proc_cgroup)
+        self.assertEqual((detected['n_procs'], detected['memory_gb']), (2, 4))  # affinity mask is lower
+
+    def test_no_cgroups(self):
+        detected = limits.effective_limits(self.root, self.proc_cgroup)
+        self.assertEqual(detected['n_procs'], limits.affinity_cpus())
+        self.assertEqual(detected['memory_gb'], limits.host_memory_gb())
+
+
+if __name__ == '__main__':
+    unittest.main()
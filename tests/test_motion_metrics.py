@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from nipype.algorithms.confounds import FramewiseDisplacement
+from PUMI.utils import calc_friston_twenty_four, calculate_FD_Jenkinson, motion_metrics, motion_metrics_batch
+
+
+class TestMotionMetrics(unittest.TestCase):
+
+    def setUp(self):
+        os.chdir(tempfile.mkdtemp())
+        rng = np.random.default_rng(0)
+        self.par_files = []
+        for i, n_vols in enumerate([50, 50, 80]):
+            params = np.cumsum(rng.normal(scale=[0.002] * 3 + [0.1] * 3, size=(n_vols, 6)), axis=0)
+            self.par_files.append(os.path.abspath('sub-%d.par' % i))
+            np.savetxt(self.par_files[-1], params)
+
+    def test_same_as_separate_nodes(self):
+        friston24_file, fd_file, fd_power_file, fd_jenkinson_file, mean_fd_file, _, max_fd_file, _, fd_figure = \
+            motion_metrics(self.par_files[0], save_plot=False)
+
+        self.assertEqual(fd_file, fd_power_file)
+        self.assertIsNone(fd_figure)
+        np.testing.assert_allclose(np.loadtxt(friston24_file),
+                                   np.loadtxt(calc_friston_twenty_four(self.par_files[0])))
+        np.testing.assert_allclose(np.loadtxt(fd_jenkinson_file),
+                                   np.loadtxt(calculate_FD_Jenkinson(self.par_files[0])), atol=1e-8)
+
+        reference = FramewiseDisplacement(in_file=self.par_files[0], parameter_source='FSL').run().outputs.out_file
+        fd_power = np.loadtxt(fd_power_file, skiprows=1)
+        np.testing.assert_allclose(fd_power, np.loadtxt(reference, skiprows=1), atol=1e-6)
+        np.testing.assert_allclose(np.loadtxt(mean_fd_file), fd_power.mean())
+        np.testing.assert_allclose(np.loadtxt(max_fd_file), fd_power.max())
+
+    def test_batch(self):
+        df = motion_metrics_batch(self.par_files, fd_mode='Jenkinson', out_file='motion_metrics.tsv')
+
+        self.assertEqual(list(df['n_volumes']), [50, 50, 80])
+        for par_file, row in zip(self.par_files, df.itertuples()):
+            fd = np.loadtxt(motion_metrics(par_file, fd_mode='Jenkinson', save_plot=False)[1], skiprows=1)
+            self.assertEqual(row.par_file, par_file)
+            np.testing.assert_allclose(row.mean_fd, fd.mean())
+            np.testing.assert_allclose(row.percent_above, (fd >= 0.2).mean() * 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import os
+import tempfile
+import unittest
+from nipype import Function
+from nipype.interfaces import fsl
+from PUMI import globals
+from PUMI.engine import NestedWorkflow, PumiPipeline
+from PUMI.engine import NestedMapNode, NestedNode as Node
+from PUMI.optimize import disable_unused_outputs, merge_duplicate_nodes
+
+
+def make_value(x):
+    return x, x * 10
+
+
+def scale(value, factor=1):
+    return value * factor, -value
+
+
+def combine(a, b):
+    return [a, b]
+
+
+def identity(value):
+    return value
+
+
+class TestOptimize(unittest.TestCase):
+
+    def test_inline_function_nodes(self):
+        wf = NestedWorkflow('wf', base_dir=tempfile.mkdtemp())
+        producer = Node(Function(input_names=['x'], output_names=['a', 'b'], function=make_value), name='producer')
+        producer.inputs.x = 2
+        scaler = Node(Function(input_names=['value', 'factor'], output_names=['scaled', 'negated'],
+                               function=scale), name='scaler')
+        scaler.inputs.factor = 3
+        scaler.inline = True
+        combiner = Node(Function(input_names=['a', 'b'], output_names=['out'], function=combine), name='combiner')
+        combiner.inline = True
+        consumers = {name: Node(Function(input_names=['value'], output_names=['value'], function=identity),
+                                name=name) for name in ['scaled', 'negated', 'combined']}
+        wf.connect(producer, 'a', scaler, 'value')
+        wf.connect(scaler, 'scaled', consumers['scaled'], 'value')
+        wf.connect(scaler, 'negated', consumers['negated'], 'value')
+        wf.connect(scaler, 'scaled', combiner, 'a')
+        wf.connect(producer, 'b', combiner, 'b')
+        wf.connect(combiner, 'out', consumers['combined'], 'value')
+
+        execgraph = wf.run(plugin='MultiProc', plugin_args={'n_procs': 1})
+        names = sorted(node.name for node in execgraph.nodes())
+        self.assertEqual(names, ['combined', 'combiner', 'negated', 'producer', 'scaled'])  # scaler is fused
+        self.assertFalse(os.path.exists(os.path.join(wf.base_dir, 'wf', 'scaler')))
+        self.assertTrue([n for n in execgraph.nodes() if n.name == 'combiner'][0].run_without_submitting)
+
+        results = {node.name: node.result.outputs for node in execgraph.nodes()}
+        self.assertEqual(results['scaled'].value, 6)
+        self.assertEqual(results['negated'].value, -2)
+        self.assertEqual(results['combined'].value, [6, 20])
+
+    def test_merge_duplicate_nodes(self):
+        def pick(name):
+            # pick_volume-like subworkflow
+            sub_wf = NestedWorkflow(name)
+            info = Node(Function(input_names=['value', 'factor'], output_names=['index', 'negated'],
+                                 function=scale), name='info')
+            info.inputs.factor = 1
+            pick_node = Node(Function(input_names=['value'], output_names=['value'], function=identity),
+                             name='pick')
+            sub_wf.connect(info, 'index', pick_node, 'value')
+            return sub_wf, info, pick_node
+
+        wf = NestedWorkflow('wf', base_dir=tempfile.mkdtemp())
+        producer = Node(Function(input_names=['x'], output_names=['a', 'b'], function=make_value), name='producer')
+        producer.inputs.x = 2
+        consumers = []
+        for name in ['bet_vol', 'qc_overlay', 'qc_background']:
+            sub_wf, info, pick_node = pick(name)
+            if name == 'qc_background':
+                info.inputs.factor = 5  # computes something else
+            wf.connect(producer, 'a', sub_wf, 'info.value')
+            consumer = Node(Function(input_names=['value'], output_names=['value'], function=identity),
+                            name=name + '_consumer')
+            wf.connect(sub_wf, 'pick.value', consumer, 'value')
+            consumers.append(consumer)
+
+        execgraph = wf.run(plugin='Linear')
+        # qc_overlay (info, pick and its consumer) is merged into bet_vol
+        self.assertEqual(len(execgraph.nodes()), 1 + 2 * 2 + 2)
+        results = {node.name: node.result.outputs.value for node in execgraph.nodes() if 'consumer' in node.name}
+        self.assertEqual(results, {'bet_vol_consumer': 2, 'qc_background_consumer': 10})
+
+    def test_merge_signature(self):
+        import networkx as nx
+
+        def map_node(name):
+            node = NestedMapNode(Function(input_names=['value'], output_names=['value'], function=identity),
+                                 iterfield=['value'], name=name)
+            node.inputs.value = [1, 2]
+            return node
+
+        def node(name, **kwargs):
+            node = Node(Function(input_names=['value'], output_names=['value'], function=identity), name=name,
+                        **kwargs)
+            node.inputs.value = 1
+            return node
+
+        graph = nx.DiGraph()
+        graph.add_nodes_from([map_node('first'), map_node('second')])
+        self.assertEqual(merge_duplicate_nodes(graph), 1)
+
+        # same computation, but other resources
+        graph = nx.DiGraph()
+        graph.add_nodes_from([node('default'), node('threads', n_procs=4), node('memory', mem_gb=8)])
+        self.assertEqual(merge_duplicate_nodes(graph), 0)
+
+    def test_prune_dead_nodes(self):
+        def node(name):
+            return Node(Function(input_names=['value'], output_names=['value'], function=identity), name=name)
+
+        @PumiPipeline(inputspec_fields=['value'], outputspec_fields=['used', 'unused'])
+        def inner(wf, **kwargs):
+            for field in ['used', 'unused']:
+                wf.connect('inputspec', 'value', node(field), 'value')
+                wf.connect(field, 'value', 'outputspec', field)
+            wf.connect('inputspec', 'value', node('dead'), 'value')  # built but never consumed
+
+        @PumiPipeline(inputspec_fields=['value'], outputspec_fields=['out'])
+        def outer(wf, **kwargs):
+            inner_wf = inner('inner')
+            wf.connect('inputspec', 'value', inner_wf, 'value')
+            wf.connect(inner_wf, 'used', 'outputspec', 'out')
+            wf.connect('inputspec', 'value', node('sinked'), 'value')
+            wf.connect('sinked', 'value', 'sinker', 'sinked')
+
+        tmp = tempfile.mkdtemp()
+        wf = outer('outer', base_dir=tmp, sink_dir=os.path.join(tmp, 'derivatives'))
+        wf.get_node('inputspec').inputs.value = os.path.abspath(__file__)
+        merge_duplicates = globals.cfg_parser.get('OPTIMIZE', 'merge_duplicates')
+        globals.cfg_parser.set('OPTIMIZE', 'prune', 'true')
+        globals.cfg_parser.set('OPTIMIZE', 'merge_duplicates', 'false')  # inner.used and inner.unused are identical
+        try:
+            execgraph = wf.run(plugin='Linear')
+        finally:
+            globals.cfg_parser.set('OPTIMIZE', 'prune', 'false')
+            globals.cfg_parser.set('OPTIMIZE', 'merge_duplicates', merge_duplicates)
+        names = sorted(node.fullname.split('.', 1)[1] for node in execgraph.nodes())
+        # the inner sinker is not connected and inner.dead is not used (inner.unused reaches the inner outputspec)
+        self.assertEqual(names, ['inner.unused', 'inner.used', 'sinked', 'sinker'])
+        self.assertFalse(os.path.exists(os.path.join(tmp, 'outer', 'inner', 'dead')))
+        self.assertTrue(os.path.exists(os.path.join(tmp, 'derivatives', 'sinked', 'test_optimize.py')))
+
+    def test_disable_unused_outputs(self):
+        import networkx as nx
+        graph = nx.DiGraph()
+        fast = Node(fsl.FAST(segments=True, probability_maps=True), name='fast')
+        consumer = Node(Function(input_names=['value'], output_names=['value'], function=identity), name='consumer')
+        graph.add_edge(fast, consumer, connect=[('probability_maps', 'value')])
+        self.assertEqual(disable_unused_outputs(graph), 2)
+        self.assertFalse(fast.inputs.segments)
+        self.assertTrue(fast.inputs.probability_maps)
+        self.assertTrue(fast.inputs.no_pve)  # partial volume files, partial volume map and mixeltype
+        self.assertEqual(disable_unused_outputs(graph), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
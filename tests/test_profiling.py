@@ -0,0 +1,82 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+import nibabel as nib
+import numpy as np
+from nipype import Function
+from PUMI import globals
+from PUMI.engine import NestedWorkflow
+from PUMI.engine import NestedNode as Node
+from PUMI.profiling import ProfileDB, main
+
+
+def mean_image(in_file):
+    import nibabel as nib
+    return float(nib.load(in_file).get_fdata().mean())
+
+
+def identity(value):
+    return value
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_profile_db(self):
+        tmp = tempfile.mkdtemp()
+        in_file = os.path.join(tmp, 'func.nii.gz')
+        nib.save(nib.Nifti1Image(np.ones((4, 5, 6, 7), dtype=np.float32), np.eye(4)), in_file)
+        db_path = os.path.join(tmp, 'profile.sqlite')
+
+        default_db_path = globals.cfg_parser.get('PROFILE', 'db_path')
+        globals.cfg_parser.set('PROFILE', 'enabled', 'true')
+        globals.cfg_parser.set('PROFILE', 'db_path', db_path)
+        try:
+            wf = NestedWorkflow('rcpl', base_dir=tmp)
+            node = Node(Function(input_names=['in_file'], output_names=['mean'], function=mean_image), name='mean')
+            node.inputs.in_file = in_file
+            wf.add_nodes([node])
+            wf.run(plugin='Linear')
+        finally:
+            globals.cfg_parser.set('PROFILE', 'enabled', 'false')
+            globals.cfg_parser.set('PROFILE', 'db_path', default_db_path)
+
+        runs = ProfileDB(db_path).query('SELECT pipeline, node, input_shape, wall_time, peak_rss_mb, success '
+                                        'FROM node_runs')
+        self.assertEqual(len(runs), 1)
+        pipeline, node_name, shape, wall_time, peak_rss_mb, success = runs[0]
+        self.assertEqual((pipeline, node_name, shape, success), ('rcpl', 'mean', '4x5x6x7', 1))
+        self.assertGreater(wall_time, 0)
+        self.assertGreater(peak_rss_mb, 0)
+
+        stdout = io.StringIO()
+        with mock.patch.object(sys, 'argv', ['pumi-profile', '--db_path', db_path, 'hot']), \
+                contextlib.redirect_stdout(stdout):
+            main()
+        self.assertIn('rcpl      mean', stdout.getvalue())
+
+    def test_unwritable_profile_db(self):
+        tmp = tempfile.mkdtemp()
+        not_a_directory = os.path.join(tmp, 'file')
+        open(not_a_directory, 'w').close()
+
+        default_db_path = globals.cfg_parser.get('PROFILE', 'db_path')
+        globals.cfg_parser.set('PROFILE', 'enabled', 'true')
+        globals.cfg_parser.set('PROFILE', 'db_path', os.path.join(not_a_directory, 'profile.sqlite'))
+        try:
+            wf = NestedWorkflow('rcpl', base_dir=tmp)
+            node = Node(Function(input_names=['value'], output_names=['value'], function=identity), name='identity')
+            node.inputs.value = 1
+            wf.add_nodes([node])
+            execgraph = wf.run(plugin='Linear')  # profiling never makes a node fail
+        finally:
+            globals.cfg_parser.set('PROFILE', 'enabled', 'false')
+            globals.cfg_parser.set('PROFILE', 'db_path', default_db_path)
+        self.assertEqual(list(execgraph.nodes())[0].result.outputs.value, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+import nibabel as nib
+import numpy as np
+from nipype import Function
+from nipype.interfaces import fsl
+from PUMI import globals
+from PUMI import resources
+from PUMI.engine import NestedWorkflow
+from PUMI.engine import NestedNode as Node
+from PUMI.profiling import ProfileDB
+
+
+def mean_image(in_file):
+    import nibabel as nib
+    return float(nib.load(in_file).get_fdata().mean())
+
+
+def thread_settings(tag):
+    import os
+    from threadpoolctl import threadpool_info
+    return os.environ.get('OMP_NUM_THREADS'), [pool['num_threads'] for pool in threadpool_info()]
+
+
+class TestResources(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.in_file = os.path.join(self.tmp, 'func.nii.gz')
+        nib.save(nib.Nifti1Image(np.ones((4, 5, 6, 7), dtype=np.float32), np.eye(4)), self.in_file)
+        self.db_path = os.path.join(self.tmp, 'profile.sqlite')
+        self.default_db_path = globals.cfg_parser.get('PROFILE', 'db_path')
+        globals.cfg_parser.set('PROFILE', 'db_path', self.db_path)
+
+    def tearDown(self):
+        globals.cfg_parser.set('PROFILE', 'db_path', self.default_db_path)
+        resources._history.clear()
+
+    def test_defaults(self):
+        node = Node(fsl.FAST(), name='fast')
+        node.inputs.in_files = self.in_file
+        self.assertEqual(resources.interface_key(node.interface), 'fsl.FAST')
+        base_gb, bytes_per_voxel, threads = resources.DEFAULT_RESOURCES['fsl.FAST']
+        self.assertAlmostEqual(node.mem_gb_runtime, base_gb + bytes_per_voxel * 4 * 5 * 6 * 7 / 1024 ** 3)
+        self.assertEqual(node.n_procs, threads)
+
+        function_node = Node(Function(input_names=['in_file'], output_names=['mean'], function=mean_image),
+                             name='mean')
+        self.assertEqual(resources.interface_key(function_node.interface), 'Function:mean_image')
+
+        # explicit settings are not overwritten
+        explicit = Node(fsl.FAST(), name='fast', mem_gb=3, n_procs=2)
+        explicit.inputs.in_files = self.in_file
+        self.assertEqual((explicit.mem_gb_runtime, explicit.n_procs), (3, 2))
+
+    def test_history(self):
+        wf = NestedWorkflow('rcpl', base_dir=self.tmp)
+        node = Node(Function(input_names=['in_file'], output_names=['mean'], function=mean_image), name='mean')
+        node.inputs.in_file = self.in_file
+        wf.add_nodes([node])
+        wf.run(plugin='MultiProc', plugin_args={'n_procs': 2})
+
+        # a previous run on an image with twice the voxels and 3 GB peak memory at 200% CPU
+        profile_db = ProfileDB(self.db_path)
+        with profile_db.connect() as con:
+            con.execute('DELETE FROM node_runs')
+            con.execute("INSERT INTO node_runs (pipeline, node, interface, input_shape, wall_time, cpu_time, "
+                        "peak_rss_mb, success) VALUES ('rcpl', 'mean', 'nipype.interfaces.utility.wrappers.Function', "
+                        "'4x5x6x14', 10, 20, 3072, 1)")
+        resources._history.clear()
+
+        node = Node(Function(input_names=['in_file'], output_names=['mean'], function=mean_image), name='mean')
+        node.inputs.in_file = self.in_file
+        node._hierarchy = 'rcpl'
+        mem_gb, description = resources.estimate_memory_gb(node)
+        self.assertAlmostEqual(mem_gb, resources.HISTORY_MARGIN * 1.5)
+        self.assertIn('1 previous run', description)
+
+        globals.cfg_parser.set('RESOURCES', 'max_threads', '4')
+        try:
+            self.assertEqual(node.n_procs, 2)
+            globals.cfg_parser.set('RESOURCES', 'max_threads', '1')
+            self.assertEqual(node.n_procs, 1)
+            globals.cfg_parser.set('RESOURCES', 'max_threads', '4')
+            globals.cfg_parser.set('RESOURCES', 'use_history', 'false')
+            resources._history.clear()
+            self.assertEqual(node.n_procs, 1)
+        finally:
+            globals.cfg_parser.set('RESOURCES', 'max_threads', '')
+            globals.cfg_parser.set('RESOURCES', 'use_history', 'true')
+
+    def test_thread_budget(self):
+        from nipype.interfaces.base import CommandLine
+        globals.cfg_parser.set('RESOURCES', 'max_threads', '3')
+        try:
+            wf = NestedWorkflow('wf', base_dir=self.tmp)
+            for n_procs in [2, 8]:
+                node = Node(Function(input_names=['tag'], output_names=['settings'], function=thread_settings),
+                            name='threads_%d' % n_procs, n_procs=n_procs)
+                node.inputs.tag = n_procs
+                wf.add_nodes([node])
+            command = Node(CommandLine('printenv', args='ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS'), name='command',
+                           n_procs=2)
+            wf.add_nodes([command])
+            execgraph = wf.run(plugin='Linear')
+            results = {node.name: node.result for node in execgraph.nodes()}
+            executed = {node.name: node for node in execgraph.nodes()}
+        finally:
+            globals.cfg_parser.set('RESOURCES', 'max_threads', '')
+
+        omp_threads, pool_threads = results['threads_2'].outputs.settings
+        self.assertEqual(omp_threads, '2')
+        self.assertTrue(all(threads <= 2 for threads in pool_threads))
+        self.assertEqual(results['threads_8'].outputs.settings[0], '3')  # limited to max_threads
+        self.assertEqual(results['command'].runtime.stdout.strip(), '2')
+        self.assertNotEqual(os.environ.get('OMP_NUM_THREADS'), '2')  # restored
+        self.assertNotIn('ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS', executed['command'].interface.inputs.environ)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+from nipype import Function
+from PUMI import globals
+from PUMI import resources
+from PUMI.engine import NestedWorkflow
+from PUMI.engine import NestedNode as Node
+from PUMI.scheduling import critical_path_lengths
+
+
+def registration_ants_hardcoded(value):
+    # stands in for the long registration (see PUMI.resources.DEFAULT_RUNTIMES)
+    import time
+    return time.time()
+
+
+def qc(value):
+    import time
+    return time.time()
+
+
+class TestScheduling(unittest.TestCase):
+
+    def setUp(self):
+        globals.cfg_parser.set('RESOURCES', 'use_history', 'false')
+        resources._history.clear()
+
+    def tearDown(self):
+        globals.cfg_parser.set('RESOURCES', 'use_history', 'true')
+        resources._history.clear()
+
+    def build(self):
+        wf = NestedWorkflow('wf', base_dir=tempfile.mkdtemp())
+        nodes = {}
+        for name in ['qc_1', 'qc_2', 'qc_3']:  # before the registration in graph order
+            nodes[name] = Node(Function(input_names=['value'], output_names=['started'], function=qc), name=name)
+            nodes[name].inputs.value = name
+        registration = Node(Function(input_names=['value'], output_names=['started'],
+                                     function=registration_ants_hardcoded), name='registration')
+        prepare = Node(Function(input_names=['value'], output_names=['started'], function=qc), name='prepare')
+        prepare.inputs.value = 0
+        wf.connect(prepare, 'started', registration, 'value')
+        after = Node(Function(input_names=['value'], output_names=['started'], function=qc), name='after')
+        wf.connect(registration, 'started', after, 'value')
+        wf.add_nodes(list(nodes.values()))
+        return wf
+
+    def test_critical_path_lengths(self):
+        wf = self.build()
+        graph = wf._create_flat_graph()
+        lengths = {node.name: length for node, length in critical_path_lengths(graph).items()}
+        runtime = resources.DEFAULT_RUNTIMES['Function:registration_ants_hardcoded']
+        self.assertEqual(lengths['registration'], runtime + resources.GENERIC_RUNTIME)
+        self.assertEqual(lengths['prepare'], runtime + 2 * resources.GENERIC_RUNTIME)
+        self.assertEqual(lengths['after'], resources.GENERIC_RUNTIME)
+        self.assertEqual(lengths['qc_1'], resources.GENERIC_RUNTIME)
+
+    def test_critical_path_first(self):
+        execgraph = self.build().run(plugin='MultiProc', plugin_args={'n_procs': 1, 'scheduler': 'critical_path'})
+        started = {node.name: node.result.outputs.started for node in execgraph.nodes()}
+        self.assertEqual(sorted(started, key=started.get)[:2], ['prepare', 'registration'])
+
+
+if __name__ == '__main__':
+    unittest.main()
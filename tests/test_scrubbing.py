@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+import nibabel as nib
+import numpy as np
+from PUMI.utils import above_threshold, censor_frames, scrub_image_native
+
+
+def censor_frames_loop(fd, threshold, frames_before, frames_after):
+    # reference: the while-loop implementation previously used by above_threshold
+    frames_out = np.argwhere(fd >= threshold)[:, 0]
+    extra_indices = []
+    for i in frames_out:
+        extra_indices += [i - count for count in range(1, frames_before + 1) if i - count >= 0]
+        extra_indices += [i + count for count in range(1, frames_after + 1) if i + count < len(fd)]
+    return sorted(set(frames_out) | set(extra_indices))
+
+
+class TestScrubbing(unittest.TestCase):
+
+    def setUp(self):
+        os.chdir(tempfile.mkdtemp())
+        self.rng = np.random.default_rng(0)
+
+    def test_censor_frames(self):
+        fd = self.rng.exponential(0.1, size=300)
+        fd[[0, 299]] = 1
+        for frames_before, frames_after in [(0, 0), (1, 2), (3, 0), (0, 4)]:
+            censored = censor_frames(fd, 0.2, frames_before, frames_after)
+            self.assertEqual(list(np.flatnonzero(censored)), censor_frames_loop(fd, 0.2, frames_before, frames_after))
+        self.assertFalse(censor_frames([0.1, 0.2], 0.2, inclusive=False).any())
+
+    def test_scrub_image_native(self):
+        data = self.rng.integers(0, 1000, size=(4, 4, 3, 20)).astype(np.int16)
+        for filename in ['func.nii', 'func.nii.gz']:
+            img = nib.Nifti1Image(data, np.eye(4))
+            img.header.set_slope_inter(0.5, 10)
+            nib.save(img, filename)
+
+            fd = np.full(20, 0.1)
+            fd[[3, 10]] = 0.5
+            np.savetxt('fd.txt', fd, header='FramewiseDisplacement', comments='')
+            frames_in_idx = above_threshold('fd.txt', threshold=0.2, frames_before=1, frames_after=1)[0]
+
+            scrubbed = nib.load(scrub_image_native(os.path.abspath(filename), frames_in_idx))
+            self.assertTrue(scrubbed.get_filename().endswith('func_scrubbed' + filename[4:]))
+            self.assertEqual(scrubbed.get_data_dtype(), np.int16)
+            keep = [i for i in range(20) if i not in [2, 3, 4, 9, 10, 11]]
+            np.testing.assert_allclose(scrubbed.get_fdata(), data[..., keep] * 0.5 + 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
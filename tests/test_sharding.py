@@ -0,0 +1,54 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+import nibabel as nib
+import numpy as np
+from PUMI.engine import BidsApp
+from PUMI.sharding import estimate_subject_cost, parse_shard, partition_subjects
+
+
+class TestSharding(unittest.TestCase):
+
+    def setUp(self):
+        self.bids_dir = tempfile.mkdtemp()
+        for subject, n_vols in [('01', 10), ('02', 100), ('03', 20), ('04', 90), ('05', 10)]:
+            func_dir = os.path.join(self.bids_dir, 'sub-' + subject, 'func')
+            os.makedirs(func_dir)
+            nib.save(nib.Nifti1Image(np.zeros((4, 4, 4, n_vols), dtype=np.uint8), np.eye(4)),
+                     os.path.join(func_dir, 'sub-%s_task-rest_bold.nii.gz' % subject))
+
+    def test_partition(self):
+        self.assertEqual(estimate_subject_cost(self.bids_dir, '02'), 4 * 4 * 4 * 100)
+
+        costs = {subject: estimate_subject_cost(self.bids_dir, subject) for subject in ['01', '02', '03', '04', '05']}
+        shards, loads = partition_subjects(costs, 2)
+        self.assertEqual(shards, [['01', '02', '05'], ['03', '04']])
+        self.assertEqual(loads, [64 * 120, 64 * 110])
+        self.assertEqual(partition_subjects(dict(reversed(list(costs.items()))), 2)[0], shards)  # deterministic
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard('2/5'), (2, 5))
+        for shard in ['5/5', '-1/5', '1', 'a/b']:
+            self.assertRaises(ValueError, parse_shard, shard)
+
+    def test_bids_app_dry_run(self):
+        pipeline = mock.Mock()
+        app = BidsApp(pipeline=pipeline, name='test', bids_dir=self.bids_dir)
+        stdout = io.StringIO()
+        with mock.patch.object(sys, 'argv', ['test', '--shard', '1/2', '--dry_run']), \
+                contextlib.redirect_stdout(stdout):
+            app.run()
+        pipeline.assert_not_called()
+        self.assertIn('shard 1/2: 2 subject(s)', stdout.getvalue())
+
+        with mock.patch.object(sys, 'argv', ['test', '--shard', '0/2']), contextlib.redirect_stdout(io.StringIO()):
+            app.run()
+        self.assertEqual(pipeline.call_args.kwargs['subjects'], ['01', '02', '05'])
+
+
+if __name__ == '__main__':
+    unittest.main()
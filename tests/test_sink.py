@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from nipype.interfaces.io import DataSink
+from PUMI import globals, sink
+from PUMI.engine import PumiPipeline
+from PUMI.sink import LinkDataSink, wait_for_copies
+
+
+class TestSink(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.files = []
+        for subject in ['001', '002']:
+            directory = os.path.join(self.tmp, 'work', '_subject_' + subject, 'mc')
+            os.makedirs(directory)
+            path = os.path.join(directory, 'func_mcf.nii.gz')
+            np.random.rand(1000).tofile(path)
+            self.files.append(path)
+
+    def sink(self, interface, name):
+        interface.inputs.base_directory = os.path.join(self.tmp, name)
+        interface.inputs.regexp_substitutions = [(r'_subject_(\w+)', r'sub-\1'), (r'_mcf', '')]
+        setattr(interface.inputs, 'mc_func', self.files)
+        setattr(interface.inputs, 'qc.@mc_func', self.files[0])
+        return interface.run().outputs.out_file
+
+    def test_same_destinations(self):
+        linked = self.sink(LinkDataSink(), 'linked')
+        copied = self.sink(DataSink(), 'copied')
+        self.assertEqual([os.path.relpath(f, os.path.join(self.tmp, 'linked')) for f in linked],
+                         [os.path.relpath(f, os.path.join(self.tmp, 'copied')) for f in copied])
+        self.assertTrue(os.path.samefile(linked[0], self.files[0]))
+
+        # sinking again keeps the links
+        self.assertEqual(self.sink(LinkDataSink(), 'linked'), linked)
+        self.assertTrue(os.path.samefile(linked[0], self.files[0]))
+
+    def test_empty_input(self):
+        interface = LinkDataSink(base_directory=os.path.join(self.tmp, 'empty'))
+        setattr(interface.inputs, 'mc_func', [])
+        setattr(interface.inputs, 'qc.@mc_func', self.files[0])
+        out_files = interface.run().outputs.out_file
+        self.assertEqual(len(out_files), 1)
+        self.assertTrue(os.path.samefile(out_files[0], self.files[0]))
+
+    def test_background_copy(self):
+        with mock.patch.object(sink.os, 'link', side_effect=OSError('cross-device link')), \
+                mock.patch.object(sink, 'reflink', return_value=False):
+            out_files = self.sink(LinkDataSink(), 'copied')
+        wait_for_copies()
+        for src, dst in zip(self.files, out_files):
+            self.assertFalse(os.path.samefile(src, dst))
+            self.assertEqual(open(src, 'rb').read(), open(dst, 'rb').read())
+            self.assertFalse(os.path.exists(dst + '.pumi_tmp'))
+
+    def test_sinker_submitted_when_copying(self):
+        @PumiPipeline(inputspec_fields=['in_file'])
+        def pipeline(wf, **kwargs):
+            wf.connect('inputspec', 'in_file', 'sinker', 'out_file')
+
+        default_mode = globals.cfg_parser.get('SINKING', 'mode')
+        for mode, run_without_submitting in [('link', True), ('copy', False)]:
+            globals.cfg_parser.set('SINKING', 'mode', mode)
+            try:
+                wf = pipeline('wf', base_dir=self.tmp, sink_dir=os.path.join(self.tmp, 'derivatives'))
+            finally:
+                globals.cfg_parser.set('SINKING', 'mode', default_mode)
+            self.assertEqual(wf.get_node('sinker').run_without_submitting, run_without_submitting)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+import nibabel as nib
+import numpy as np
+import pandas as pd
+from PUMI.utils import TsExtractor
+
+
+class TestTsExtractor(unittest.TestCase):
+
+    def test_parcel_means(self):
+        os.chdir(tempfile.mkdtemp())
+        rng = np.random.default_rng(0)
+        affine = np.eye(4)
+
+        func_data = rng.normal(size=(6, 5, 4, 20))
+        func_data[0, 0, 0] = 3  # constant voxel, must be ignored
+        labelmap_data = rng.integers(0, 4, size=(6, 5, 4)).astype(float)
+        labelmap_data[0, 0, 0] = 1
+        labelmap_data[labelmap_data == 3] = 0  # label 3 stays empty
+        mask_data = np.ones((6, 5, 4))
+        mask_data[5] = 0
+
+        for name, data in [('func', func_data), ('labelmap', labelmap_data), ('mask', mask_data)]:
+            nib.save(nib.Nifti1Image(data, affine), name + '.nii.gz')
+
+        out_file, labels, _ = TsExtractor(['a', 'b', 'c'], 'labelmap.nii.gz', 'func.nii.gz', 'mask.nii.gz')
+        ts = pd.read_csv(out_file, sep='\t')
+
+        self.assertEqual(labels, ['GlobSig', 'a', 'b', 'c'])
+        self.assertEqual(list(ts.columns), labels)
+
+        valid = (mask_data > 0) & (func_data.std(axis=3) > 0.000001)
+        np.testing.assert_allclose(ts['GlobSig'], func_data[valid].mean(axis=0))
+        np.testing.assert_allclose(ts['a'], func_data[valid & (labelmap_data == 1)].mean(axis=0))
+        np.testing.assert_allclose(ts['b'], func_data[valid & (labelmap_data == 2)].mean(axis=0))
+        np.testing.assert_allclose(ts['c'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
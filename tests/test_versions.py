@@ -0,0 +1,75 @@
+import json
+import os
+import stat
+import tempfile
+import unittest
+from unittest import mock
+from nipype.interfaces.base import CommandLine
+from PUMI import globals
+from PUMI import versions
+from PUMI.versions import get_interface_version, get_interface_versions
+
+
+class FakeTool(CommandLine):
+    _cmd = 'faketool'
+    probes = 0
+
+    @property
+    def version(self):
+        FakeTool.probes += 1
+        return '1.2.3'
+
+
+class OtherFakeTool(FakeTool):
+    pass
+
+
+FakeTool.__module__ = 'PUMI.interfaces.fake'
+OtherFakeTool.__module__ = 'PUMI.interfaces.fake'
+
+
+class TestVersions(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        binary = os.path.join(self.tmp, 'faketool')
+        with open(binary, 'w') as f:
+            f.write('#!/bin/sh\n')
+        os.chmod(binary, os.stat(binary).st_mode | stat.S_IEXEC)
+        self.default_versions_file = globals.cfg_parser.get('CACHE', 'versions_file')
+        globals.cfg_parser.set('CACHE', 'versions_file', os.path.join(self.tmp, 'tool_versions.json'))
+        FakeTool.probes = 0
+        versions._memo.clear()
+
+    def tearDown(self):
+        globals.cfg_parser.set('CACHE', 'versions_file', self.default_versions_file)
+        versions._memo.clear()
+
+    def test_memoized_and_persisted(self):
+        with mock.patch.dict(os.environ, {'PATH': self.tmp + os.pathsep + os.environ['PATH']}):
+            result = get_interface_versions([FakeTool(), FakeTool(), OtherFakeTool(), CommandLine('ls')])
+            self.assertEqual(result['PUMI.interfaces.fake.FakeTool'], ('fake', '1.2.3'))
+            self.assertEqual(result['PUMI.interfaces.fake.OtherFakeTool'], ('fake', '1.2.3'))
+            self.assertEqual(get_interface_version(FakeTool()), ('fake', '1.2.3'))
+            self.assertEqual(FakeTool.probes, 1)
+
+            # a new process reads the saved version
+            versions._memo.clear()
+            self.assertEqual(get_interface_version(FakeTool()), ('fake', '1.2.3'))
+            self.assertEqual(FakeTool.probes, 1)
+            with open(os.path.join(self.tmp, 'tool_versions.json')) as f:
+                self.assertEqual(list(json.load(f)), [versions.binary_key('faketool')])
+
+            # a new installation of the tool is probed again
+            os.utime(os.path.join(self.tmp, 'faketool'), ns=(0, 0))
+            versions._memo.clear()
+            get_interface_version(FakeTool())
+            self.assertEqual(FakeTool.probes, 2)
+
+    def test_in_house(self):
+        from nipype.interfaces.utility import IdentityInterface
+        self.assertIsNone(get_interface_version(IdentityInterface(fields=['a'])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from nipype import Function
+from PUMI import globals
+from PUMI.engine import BidsPipeline, create_dataset_description
+from PUMI.engine import NestedNode as Node
+from PUMI.workflow_cache import workflow_key
+
+
+def identity(value):
+    return value
+
+
+class Options:
+    def __init__(self, smoothing):
+        self.smoothing = smoothing
+        self.fun = identity
+
+
+@BidsPipeline(output_query={'T1w': dict(datatype='anat', suffix='T1w', extension=['nii', 'nii.gz'])})
+def pipeline(wf, factor=1, **kwargs):
+    node = Node(Function(input_names=['value'], output_names=['value'], function=identity), name='node')
+    node.inputs.value = factor
+    wf.connect('inputspec', 'T1w', 'sinker', 'T1w')
+    create_dataset_description(wf, pipeline_description_name='test-pipeline')
+
+
+class TestWorkflowCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.bids_dir = os.path.join(self.tmp, 'bids')
+        for subject in ['001', '002']:
+            os.makedirs(os.path.join(self.bids_dir, 'sub-' + subject, 'anat'))
+        self.settings = {('CACHE', 'workflow_cache'): 'true',
+                         ('CACHE', 'workflow_cache_dir'): os.path.join(self.tmp, 'workflows'),
+                         ('BIDS', 'layout_index'): 'false'}
+        self.previous = {key: globals.cfg_parser.get(*key) for key in self.settings}
+        for key, value in self.settings.items():
+            globals.cfg_parser.set(*key, value)
+
+    def tearDown(self):
+        for key, value in self.previous.items():
+            globals.cfg_parser.set(*key, value)
+
+    def build(self, subjects, **kwargs):
+        return pipeline('wf', self.bids_dir, subjects=subjects, base_dir=os.path.join(self.tmp, 'work'),
+                        sink_dir=os.path.join(self.tmp, 'derivatives'), build_only=True, **kwargs)
+
+    def test_workflow_cache(self):
+        with mock.patch.object(BidsPipeline, '_build', autospec=True, side_effect=BidsPipeline._build) as build:
+            wf = self.build(['001'])
+            self.assertEqual(build.call_count, 1)
+            self.assertEqual(build.call_args.args[4], os.path.join(self.tmp, 'work'))  # set during the construction
+            self.assertEqual(len(os.listdir(os.path.join(self.tmp, 'workflows'))), 1)
+
+            # other participants (e.g. another array task) and an other working directory: loaded from the cache
+            description_file = os.path.join(self.tmp, 'derivatives', 'dataset_description.json')
+            os.remove(description_file)
+            cached = self.build(['002'])
+            self.assertEqual(build.call_count, 1)
+            self.assertIsNot(cached, wf)
+            self.assertEqual(sorted(cached.list_node_names()), sorted(wf.list_node_names()))
+            self.assertEqual(cached.get_node('subject_iterator').iterables, [('subject', ['002'])])
+            self.assertEqual(cached.base_dir, os.path.join(self.tmp, 'work'))
+            with open(description_file) as f:
+                self.assertEqual(json.load(f)['PipelineDescription']['Name'], 'test-pipeline')
+
+            # other pipeline arguments: built again
+            self.build(['001'], factor=2)
+            self.assertEqual(build.call_count, 2)
+
+    def test_stable_key(self):
+        # arguments without a stable repr (memory addresses) give the same key in every process
+        key = workflow_key(pipeline, kwargs={'options': Options(6), 'fun': identity})
+        self.assertEqual(workflow_key(pipeline, kwargs={'options': Options(6), 'fun': identity}), key)
+        self.assertNotEqual(workflow_key(pipeline, kwargs={'options': Options(8), 'fun': identity}), key)
+
+
+if __name__ == '__main__':
+    unittest.main()